@@ -0,0 +1,171 @@
+"""
+Load test for concurrent mission audio downloads.
+
+Simulates towers on slow Wi-Fi that download /mission-audio/<id> while other
+towers keep requesting /mission, and reports how many downloads the server
+sustains and how /mission latency degrades at each concurrency level.
+
+Usage:
+    python benchmarks/audio_load_test.py --url http://localhost:8000 --mission-id 1 \
+        --concurrency 1 4 16 32 --read-delay 0.01 --output audio_load.json
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile from a list of values.
+
+    Args:
+        values (list): The measured values.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def request(url, path, chunk_size=4096, read_delay=0.0, timeout=60):
+    """
+    Send a GET request and read the response in chunks.
+
+    Args:
+        url (ParseResult): The parsed server URL.
+        path (str): The request path.
+        chunk_size (int): The number of bytes read at a time.
+        read_delay (float): Seconds to wait between chunks, to simulate a slow client.
+        timeout (float): The socket timeout in seconds.
+
+    Returns:
+        tuple: The status code, the number of bytes read and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        received = 0
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            received += len(chunk)
+            if read_delay:
+                time.sleep(read_delay)
+        return response.status, received, time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def run_level(url, mission_id, concurrency, duration, read_delay):
+    """
+    Run downloads at one concurrency level while probing /mission latency.
+
+    Returns:
+        dict: The measurements for this concurrency level.
+    """
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    downloads, failures, received_bytes, download_times = 0, 0, 0, []
+    probe_times, probe_failures = [], 0
+
+    def download_loop():
+        nonlocal downloads, failures, received_bytes
+        while time.monotonic() < deadline:
+            try:
+                status, received, elapsed = request(
+                    url, f"/mission-audio/{mission_id}", read_delay=read_delay
+                )
+            except OSError:
+                status, received, elapsed = None, 0, None
+            with lock:
+                if status == 200:
+                    downloads += 1
+                    received_bytes += received
+                    download_times.append(elapsed)
+                else:
+                    failures += 1
+
+    def probe_loop():
+        nonlocal probe_failures
+        while time.monotonic() < deadline:
+            try:
+                status, _, elapsed = request(url, "/mission", timeout=10)
+                if status == 200:
+                    probe_times.append(elapsed)
+                else:
+                    probe_failures += 1
+            except OSError:
+                probe_failures += 1
+            time.sleep(0.1)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency + 1) as executor:
+        for _ in range(concurrency):
+            executor.submit(download_loop)
+        executor.submit(probe_loop)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "downloads": downloads,
+        "download_failures": failures,
+        "downloads_per_s": round(downloads / elapsed, 3),
+        "megabytes_per_s": round(received_bytes / elapsed / 1_000_000, 3),
+        "download_p50_s": percentile(download_times, 0.5),
+        "download_p99_s": percentile(download_times, 0.99),
+        "mission_probes": len(probe_times),
+        "mission_probe_failures": probe_failures,
+        "mission_p50_ms": (
+            round(statistics.median(probe_times) * 1000, 3) if probe_times else None
+        ),
+        "mission_p99_ms": (
+            round(percentile(probe_times, 0.99) * 1000, 3) if probe_times else None
+        ),
+    }
+
+
+def main():
+    """
+    Parse the command line arguments and run the load test.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--mission-id", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--read-delay",
+        type=float,
+        default=0.0,
+        help="Seconds between 4 KiB reads, to simulate slow towers",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    results = [
+        run_level(url, args.mission_id, level, args.duration, args.read_delay)
+        for level in args.concurrency
+    ]
+    report = json.dumps({"url": args.url, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Micro-benchmark for the mission claim path under each database engine profile.
+
+Seeds a fresh database, then claims missions from several threads in several
+processes while a writer thread keeps inserting missions, like the buffer
+maintenance does. Reports claim throughput, "database is locked" errors and
+whether any mission was handed out twice.
+
+The exit status is 1 if any profile handed out a mission twice.
+
+Usage:
+    python benchmarks/claim_throughput.py --missions 2000 --threads 8 --processes 2 \
+        --profiles default concurrent --output claim_throughput.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+
+def claim_missions(threads, duration):
+    """
+    Claim missions from several threads until the time is up.
+
+    Returns:
+        dict: The claimed mission ids, the number of errors and the number of
+            claims that found the buffer empty.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy.exc import OperationalError
+    from api.controllers import get_latest_unrequested_mission
+
+    deadline = time.monotonic() + duration
+
+    def claim_loop():
+        claimed, errors, empty = [], 0, 0
+        while time.monotonic() < deadline:
+            try:
+                mission = get_latest_unrequested_mission()
+            except OperationalError:
+                errors += 1
+                continue
+            if mission:
+                claimed.append(mission["id"])
+            else:
+                empty += 1
+        return claimed, errors, empty
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: claim_loop(), range(threads)))
+
+    return {
+        "claimed": [mission_id for claimed, _, _ in results for mission_id in claimed],
+        "errors": sum(errors for _, errors, _ in results),
+        "empty": sum(empty for _, _, empty in results),
+    }
+
+
+def insert_missions(count, stop):
+    """
+    Insert missions one transaction at a time until stopped or count is reached.
+
+    Returns:
+        int: The number of failed inserts.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy.exc import OperationalError
+    from api.database import Session, Mission
+
+    errors = 0
+    session = Session()
+    try:
+        for number in range(count):
+            if stop.is_set():
+                break
+            try:
+                session.add(
+                    Mission(
+                        mission_title=f"Benchmark mission {number}",
+                        involved_pups="Chase,Rubble",
+                        main_location="Adventure Bay",
+                        mission_script="Script " * 200,
+                        translation="Manus " * 200,
+                    )
+                )
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                errors += 1
+    finally:
+        session.close()
+    return errors
+
+
+def run_profile(args):
+    """
+    Run the benchmark for the engine profile set in the environment and print the result.
+    """
+    sys.path.insert(0, SOURCE_DIRECTORY)
+    # pylint: disable=import-outside-toplevel
+    from api.database import Session, Mission
+    from api.database.models import engine
+
+    session = Session()
+    session.bulk_save_objects(
+        [
+            Mission(
+                mission_title=f"Seed mission {number}",
+                involved_pups="Skye",
+                main_location="Lookout",
+                mission_script="Script " * 200,
+                translation="Manus " * 200,
+            )
+            for number in range(args.missions)
+        ]
+    )
+    session.commit()
+    session.close()
+    # Do not share pooled connections with the forked processes
+    engine.dispose()
+
+    stop = threading.Event()
+    insert_errors = []
+    writer = threading.Thread(
+        target=lambda: insert_errors.append(insert_missions(args.missions, stop))
+    )
+
+    # Fork the claiming processes before the writer thread can hold any locks
+    with multiprocessing.get_context("fork").Pool(
+        args.processes, initializer=engine.dispose, initargs=(False,)
+    ) as pool:
+        started = time.perf_counter()
+        writer.start()
+        results = pool.starmap(
+            claim_missions, [(args.threads, args.duration)] * args.processes
+        )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    writer.join()
+
+    claimed = [mission_id for result in results for mission_id in result["claimed"]]
+    print(
+        json.dumps(
+            {
+                "profile": os.environ["DATABASE_ENGINE_PROFILE"],
+                "processes": args.processes,
+                "threads_per_process": args.threads,
+                "duration_s": round(elapsed, 3),
+                "claims": len(claimed),
+                "claims_per_s": round(len(claimed) / elapsed, 1),
+                "duplicate_claims": len(claimed) - len(set(claimed)),
+                "claim_errors": sum(result["errors"] for result in results),
+                "empty_claims": sum(result["empty"] for result in results),
+                "insert_errors": sum(insert_errors),
+            }
+        )
+    )
+
+
+def main():
+    """
+    Parse the command line arguments and benchmark each profile in a fresh process.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--missions", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--profiles", nargs="+", default=["default", "concurrent"], metavar="PROFILE"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--run-profile", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        run_profile(args)
+        return
+
+    results = []
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as directory:
+            environment = dict(
+                os.environ,
+                DATABASE_ENGINE_PROFILE=profile,
+                DATABASE_DIRECTORY_PATH=directory,
+                AUDIO_DIRECTORY_PATH=directory,
+            )
+            output = subprocess.run(
+                [sys.executable, __file__, "--run-profile"] + sys.argv[1:],
+                env=environment,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    violations = [
+        f"{result['profile']}: {result['duplicate_claims']} missions claimed twice"
+        for result in results
+        if result["duplicate_claims"] > 0
+    ]
+    report = json.dumps({"results": results, "violations": violations}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(report)
+    print(report)
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
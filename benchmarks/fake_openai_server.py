@@ -0,0 +1,606 @@
+"""
+Local stand-in for the OpenAI API used by the benchmarks.
+
+Implements chat completions (plain and streamed), audio speech, file uploads
+and chat completion batches with configurable latency, error rates and
+payload sizes, so the mission pipeline and the bulk generation can be
+benchmarked and tried out without network access. Chat responses follow the
+mission and translation prompts closely enough for the generators to parse them.
+
+Usage:
+    python benchmarks/fake_openai_server.py --port 8089 --latency 0.2 \
+        --rate-limit-rate 0.05 --server-error-rate 0.05 --script-chars 1500 \
+        --requests-per-minute 120
+
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python src/main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+# An MPEG-1 Layer III frame (128 kbps, 44.1 kHz, joint stereo) that decodes to silence
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+# Bytes of speech audio sent between two --stream-chunk-delay pauses
+SPEECH_PART_SIZE = 16 * 1024
+
+# Format of the raw PCM audio returned by the TTS model
+PCM_BYTES_PER_SECOND = 24000 * 2
+
+PUPS = ["Chase", "Marshall", "Skye", "Rocky", "Rubble", "Zuma", "Everest"]
+
+
+def add_arguments(parser):
+    """
+    Add the fake server options to an argument parser.
+
+    Args:
+        parser (ArgumentParser): The parser to extend.
+    """
+    group = parser.add_argument_group("fake OpenAI server")
+    group.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds before each response"
+    )
+    group.add_argument(
+        "--jitter", type=float, default=0.0, help="Random extra latency in seconds"
+    )
+    group.add_argument(
+        "--stream-chunk-delay",
+        type=float,
+        default=0.0,
+        help="Seconds between the chunks of streamed responses",
+    )
+    group.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="Fraction of 429 responses"
+    )
+    group.add_argument(
+        "--server-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of 500/503 responses",
+    )
+    group.add_argument(
+        "--timeout-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that hang for --hang-seconds",
+    )
+    group.add_argument("--hang-seconds", type=float, default=30.0)
+    group.add_argument(
+        "--requests-per-minute",
+        type=int,
+        default=0,
+        help="Chat and speech requests allowed per minute, reported in x-ratelimit-* "
+        "headers and enforced with 429 responses; 0 disables the limit",
+    )
+    group.add_argument(
+        "--script-chars",
+        type=int,
+        default=1200,
+        help="Length of the generated mission scripts and translations",
+    )
+    group.add_argument(
+        "--audio-bytes-per-char",
+        type=float,
+        default=None,
+        help="Size of the speech responses, defaults to the TTS model's ~15 chars/s",
+    )
+    group.add_argument(
+        "--batch-seconds",
+        type=float,
+        default=0.5,
+        help="Seconds a batch stays in progress before its results are ready",
+    )
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the fake API configuration and request statistics.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+        self.random = random.Random(getattr(config, "seed", 0))
+        self.missions = count(1)
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "server_errors": 0, "hangs": 0}
+        self.files = {}
+        self.batches = {}
+        self.request_times = deque()
+
+    @property
+    def base_url(self):
+        """
+        str: The base URL to use as OPENAI_BASE_URL.
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, key):
+        """
+        Increment a request statistic.
+        """
+        with self.lock:
+            self.stats[key] += 1
+
+    def take_request_quota(self):
+        """
+        Count a request against --requests-per-minute.
+
+        Returns:
+            tuple: The rate limit headers of the response, and whether the
+                request is within the limit.
+        """
+        limit = getattr(self.config, "requests_per_minute", 0)
+        if not limit:
+            return {}, True
+        now = time.monotonic()
+        with self.lock:
+            while self.request_times and now - self.request_times[0] >= 60:
+                self.request_times.popleft()
+            allowed = len(self.request_times) < limit
+            if allowed:
+                self.request_times.append(now)
+            remaining = limit - len(self.request_times)
+            reset = 60 - (now - self.request_times[0]) if remaining < 1 else 0
+        headers = {
+            "x-ratelimit-limit-requests": str(limit),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after"] = f"{reset:.3f}"
+        return headers, allowed
+
+    def pick_failure(self):
+        """
+        Decide whether the next request fails, and how.
+
+        Returns:
+            str: "rate_limited", "server_errors", "hangs" or None.
+        """
+        config = self.config
+        with self.lock:
+            roll = self.random.random()
+        for key, rate in (
+            ("rate_limited", config.rate_limit_rate),
+            ("server_errors", config.server_error_rate),
+            ("hangs", config.timeout_rate),
+        ):
+            if roll < rate:
+                return key
+            roll -= rate
+        return None
+
+    def assistant_message(self, body):
+        """
+        Build the assistant message for a chat completion request.
+
+        Returns:
+            dict: A mission, or a translation for the translator prompt.
+        """
+        messages = body.get("messages", [])
+        system = messages[0]["content"] if messages else ""
+        length = self.config.script_chars
+
+        if system.startswith("You are a world class translator"):
+            return {"translation": _text("Valparna rycker ut.", length)}
+
+        number = next(self.missions)
+        with self.lock:
+            pups = self.random.sample(PUPS, 2)
+        mission = {
+            "mission_title": f"Benchmark Mission {number}",
+            "involved_pups": pups,
+            "main_location": f"Benchmark Location {number}",
+            "mission_script": self.story(number, length),
+        }
+        if "translation" in system:
+            mission["translation"] = _text("Valparna rycker ut.", length)
+        return mission
+
+    def story(self, number, length):
+        """
+        Build a mission script of made-up words, so that missions are not near-duplicates.
+
+        Returns:
+            str: The script.
+        """
+        with self.lock:
+            words = [
+                "".join(
+                    self.random.choice("bdfgklmnprstvz") + self.random.choice("aeiou")
+                    for _ in range(3)
+                )
+                for _ in range(40)
+            ]
+        return _text(f"Mission {number}: {' '.join(words)}.", length)
+
+    def chat_completion(self, body):
+        """
+        Build a complete chat completion for a request.
+
+        Returns:
+            tuple: The completion without choices, the content and the usage.
+        """
+        content = json.dumps(self.assistant_message(body))
+        prompt_tokens = sum(
+            len(message.get("content") or "") // 4 for message in body["messages"]
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        }
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": "fake"}
+        return base, content, usage
+
+    def create_file(self, content, filename, purpose):
+        """
+        Store an uploaded file.
+
+        Returns:
+            dict: The file object.
+        """
+        file_id = f"file-fake{next(self.ids)}"
+        document = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = (document, content)
+        return document
+
+    def create_batch(self, body):
+        """
+        Create a batch and process it in a background thread.
+
+        Returns:
+            dict: The batch object.
+        """
+        batch_id = f"batch_fake{next(self.ids)}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._process_batch, args=(batch,), daemon=True).start()
+        return dict(batch)
+
+    def _process_batch(self, batch):
+        with self.lock:
+            _, content = self.files.get(batch["input_file_id"], (None, None))
+        if content is None:
+            batch.update(status="failed", errors={"data": [{"code": "not_found"}]})
+            return
+        batch["status"] = "in_progress"
+        time.sleep(self.config.batch_seconds)
+
+        outputs, errors = [], []
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            result = {
+                "id": f"batch_req_{next(self.ids)}",
+                "custom_id": request["custom_id"],
+            }
+            failure = self.pick_failure()
+            if failure in ("rate_limited", "server_errors"):
+                self.count(failure)
+                errors.append(
+                    dict(
+                        result,
+                        response={
+                            "status_code": 500,
+                            "body": {"error": {"message": "Server error"}},
+                        },
+                        error=None,
+                    )
+                )
+                continue
+            base, message, usage = self.chat_completion(request["body"])
+            completion = dict(
+                base,
+                object="chat.completion",
+                choices=[
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": message},
+                        "finish_reason": "stop",
+                    }
+                ],
+                usage=usage,
+            )
+            outputs.append(
+                dict(
+                    result,
+                    response={"status_code": 200, "body": completion},
+                    error=None,
+                )
+            )
+
+        for key, results in (("output_file_id", outputs), ("error_file_id", errors)):
+            if results:
+                data = "".join(json.dumps(result) + "\n" for result in results)
+                batch[key] = self.create_file(
+                    data.encode("utf-8"), f"{key}.jsonl", "batch_output"
+                )["id"]
+        batch["request_counts"] = {
+            "total": len(outputs) + len(errors),
+            "completed": len(outputs),
+            "failed": len(errors),
+        }
+        batch["status"] = "completed"
+
+
+def _text(prefix, length):
+    sentence = f"{prefix} The pups race to the rescue and nobody is left behind. "
+    return (sentence * (length // len(sentence) + 1))[:length].strip()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the chat completions and audio speech endpoints.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def end_headers(self):
+        for name, value in getattr(self, "extra_headers", {}).items():
+            self.send_header(name, value)
+        super().end_headers()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Handle an API request.
+        """
+        server = self.server
+        raw_body = self.rfile.read(int(self.headers["Content-Length"]))
+        content_type = self.headers.get("Content-Type", "")
+        body = (
+            {}
+            if content_type.startswith("multipart/")
+            else json.loads(raw_body or b"{}")
+        )
+        server.count("requests")
+        config = server.config
+        self.extra_headers = {}
+
+        time.sleep(config.latency + server.random.random() * config.jitter)
+        if self.path.endswith(("/chat/completions", "/audio/speech")):
+            self.extra_headers, allowed = server.take_request_quota()
+            if not allowed:
+                server.count("rate_limited")
+                self._send_error(429, "rate_limit_exceeded", "Rate limit reached")
+                return
+        failure = server.pick_failure()
+        if failure:
+            server.count(failure)
+        if failure == "hangs":
+            time.sleep(config.hang_seconds)
+        elif failure == "rate_limited":
+            self._send_error(429, "rate_limit_exceeded", "Rate limit reached")
+            return
+        elif failure == "server_errors":
+            self._send_error(
+                server.random.choice([500, 503]), "server_error", "Server error"
+            )
+            return
+
+        if self.path.endswith("/chat/completions"):
+            self._chat_completion(body)
+        elif self.path.endswith("/audio/speech"):
+            self._speech(body)
+        elif self.path.endswith("/files"):
+            self._upload_file(content_type, raw_body)
+        elif self.path.endswith("/batches"):
+            self._send_json(server.create_batch(body))
+        else:
+            self._send_error(404, "not_found", f"Unknown path {self.path}")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handle a request for the state of a batch or the content of a file.
+        """
+        server = self.server
+        server.count("requests")
+        self.extra_headers = {}
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in server.batches:
+            self._send_json(dict(server.batches[parts[-1]]))
+        elif len(parts) >= 3 and parts[-1] == "content" and parts[-2] in server.files:
+            _, content = server.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_error(404, "not_found", f"Unknown path {self.path}")
+
+    def _upload_file(self, content_type, raw_body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + raw_body
+        )
+        fields, content, filename = {}, b"", "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            else:
+                fields[name] = part.get_payload(decode=True).decode("utf-8")
+        self._send_json(
+            self.server.create_file(content, filename, fields.get("purpose", ""))
+        )
+
+    def _send_error(self, status, code, message):
+        payload = json.dumps(
+            {"error": {"message": message, "type": code, "code": code}}
+        ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429 and "retry-after" not in self.extra_headers:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_json(self, document):
+        payload = json.dumps(document).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _chat_completion(self, body):
+        base, content, usage = self.server.chat_completion(body)
+
+        if not body.get("stream"):
+            self._send_json(
+                dict(
+                    base,
+                    object="chat.completion",
+                    choices=[
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    usage=usage,
+                )
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        parts = [content[index : index + 40] for index in range(0, len(content), 40)]
+        for part in parts:
+            self._write_event(
+                dict(
+                    base,
+                    object="chat.completion.chunk",
+                    choices=[{"index": 0, "delta": {"content": part}}],
+                )
+            )
+            time.sleep(self.server.config.stream_chunk_delay)
+        self._write_event(
+            dict(base, object="chat.completion.chunk", choices=[], usage=usage)
+        )
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, document):
+        self._write_chunk(f"data: {json.dumps(document)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _speech(self, body):
+        response_format = body.get("response_format", "mp3")
+        seconds = len(body.get("input", "")) / 15
+        if self.server.config.audio_bytes_per_char is not None:
+            size = int(
+                len(body.get("input", "")) * self.server.config.audio_bytes_per_char
+            )
+        elif response_format == "pcm":
+            size = int(seconds * PCM_BYTES_PER_SECOND)
+        else:
+            size = int(seconds * MP3_FRAMES_PER_SECOND) * len(MP3_FRAME)
+
+        if response_format == "pcm":
+            audio = bytes(size - size % 2)
+            content_type = "audio/pcm"
+        elif response_format == "mp3":
+            audio = MP3_FRAME * max(1, size // len(MP3_FRAME))
+            content_type = "audio/mpeg"
+        else:
+            self._send_error(400, "invalid_request_error", "Unsupported format")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        # Sent in parts like the TTS model, which streams audio while generating it
+        for index in range(0, len(audio), SPEECH_PART_SIZE):
+            self.wfile.write(audio[index : index + SPEECH_PART_SIZE])
+            self.wfile.flush()
+            time.sleep(self.server.config.stream_chunk_delay)
+
+
+def start_fake_openai_server(config, host="127.0.0.1", port=0):
+    """
+    Start the fake OpenAI server in a background thread.
+
+    Args:
+        config (Namespace): The options added by add_arguments.
+        host (str): The interface to listen on.
+        port (int): The port to listen on, 0 picks a free port.
+
+    Returns:
+        FakeOpenAIServer: The running server.
+    """
+    server = FakeOpenAIServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """
+    Parse the command line arguments and run the fake server until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), args)
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
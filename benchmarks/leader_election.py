@@ -0,0 +1,168 @@
+"""
+Multi-process check of the mission buffer leader election.
+
+Starts several processes against the same data directory, each trying to
+become the buffer leader like the maintenance thread of a gunicorn worker
+does, and checks that exactly one of them holds the lock. The leader is then
+killed, and another process must take over within the timeout, until one
+process is left.
+
+The exit status is 1 if there was ever more or less than one leader, or if
+no process took over after the leader was killed.
+
+Usage:
+    python benchmarks/leader_election.py --processes 4 --takeover-timeout 5 \
+        --output leader_election.json
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+# Tries to become the leader like the maintenance loop, and reports when it did
+CANDIDATE_SCRIPT = """
+import os, time
+from api.controllers import become_buffer_leader
+while not become_buffer_leader():
+    time.sleep(%r)
+print(os.getpid(), flush=True)
+time.sleep(3600)
+"""
+
+
+def start_candidates(directory, count, poll_interval):
+    """
+    Start the candidate processes on a shared data directory.
+
+    Returns:
+        tuple: The processes, by PID, and a queue of the PIDs that became leader.
+    """
+    environment = dict(
+        os.environ,
+        DATABASE_DIRECTORY_PATH=os.path.join(directory, "database"),
+        PYTHONPATH=SOURCE_DIRECTORY,
+    )
+    leaders = queue.Queue()
+    processes = {}
+    for _ in range(count):
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-c", CANDIDATE_SCRIPT % poll_interval],
+            env=environment,
+            cwd=SOURCE_DIRECTORY,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        processes[process.pid] = process
+        threading.Thread(
+            target=lambda stdout=process.stdout: [
+                leaders.put(int(line)) for line in stdout
+            ],
+            daemon=True,
+        ).start()
+    return processes, leaders
+
+
+def collect_leaders(leaders, seconds):
+    """
+    Collect the PIDs reported as leader within the given time.
+
+    Returns:
+        tuple: The PIDs, in the order they became leader, and the seconds until
+            the first one did, or None if none did.
+    """
+    pids, first_s = [], None
+    started = time.monotonic()
+    deadline = started + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return pids, first_s
+        try:
+            pids.append(leaders.get(timeout=remaining))
+        except queue.Empty:
+            return pids, first_s
+        if first_s is None:
+            first_s = round(time.monotonic() - started, 3)
+
+
+def run_election(count, takeover_timeout, poll_interval):
+    """
+    Run the candidates and kill every leader in turn.
+
+    Returns:
+        dict: The leaders of every round and the problems found.
+    """
+    rounds, violations = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        processes, leaders = start_candidates(directory, count, poll_interval)
+        try:
+            for number in range(count):
+                pids, takeover_s = collect_leaders(leaders, takeover_timeout)
+                rounds.append(
+                    {
+                        "alive": len(processes),
+                        "leaders": pids,
+                        "takeover_s": takeover_s,
+                    }
+                )
+                if len(pids) != 1:
+                    violations.append(
+                        f"round {number}: {len(pids)} leaders among "
+                        f"{len(processes)} processes"
+                    )
+                    break
+                # Killed without cleanup, like a worker lost to the OOM killer
+                leader = processes.pop(pids[0])
+                leader.send_signal(signal.SIGKILL)
+                leader.wait()
+        finally:
+            for process in processes.values():
+                process.kill()
+                process.wait()
+    return {"rounds": rounds, "violations": violations}
+
+
+def main():
+    """
+    Parse the command line arguments, run the check and write the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument(
+        "--takeover-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for a leader, and for any second leader, each round",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.1,
+        help="Seconds between the attempts of a process to take the lock",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = dict(
+        {"processes": args.processes},
+        **run_election(args.processes, args.takeover_timeout, args.poll_interval),
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(output)
+    print(output)
+    if report["violations"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Offline benchmark of the mission pipeline and the API against a fake OpenAI server.
+
+Starts the fake OpenAI server from fake_openai_server.py, points the app at it
+and a temporary data directory, and measures:
+
+- maintain_mission_buffer throughput, end to end from chat to audio file,
+- /mission and /mission-audio latency under concurrency, over real HTTP,
+- create_audio_file cost per audio conversion mode, with the TTS latency at 0,
+- generate_missions_in_batches end to end through the fake Batch API.
+
+The results are written as a JSON report to stdout and --output. Anything the
+app prints while the benchmarks run goes to stderr, so stdout only holds the
+report. With --baseline, the results are
+compared with an earlier report and the exit status is 1 if any of them
+regressed by more than --tolerance. The exit status is also 1 if bulk
+generation failed or released no missions.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --missions 12 --concurrency 1 8 32 \
+        --latency 0.05 --output pipeline.json --baseline pipeline_baseline.json
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from audio_load_test import percentile, request
+from fake_openai_server import add_arguments, start_fake_openai_server
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+# Result fields compared with the baseline, and whether higher values are better
+COMPARED_FIELDS = {
+    "missions_per_s": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "mean_ms": False,
+}
+
+
+def configure_environment(directory, base_url, args):
+    """
+    Point the app at the temporary data directory and the fake OpenAI server.
+    """
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": base_url,
+            "OPENAI_READ_TIMEOUT": str(args.client_timeout),
+            "DATABASE_DIRECTORY_PATH": os.path.join(directory, "database"),
+            "AUDIO_DIRECTORY_PATH": os.path.join(directory, "audio"),
+            "LOG_DIRECTORY_PATH": os.path.join(directory, "logs"),
+            "MISSION_GENERATION_MODE": args.generation_mode,
+            "AUDIO_CONVERSION_MODE": args.conversion_modes[0],
+            "TTS_CACHE_MAX_BYTES": "0",
+        }
+    )
+    sys.path.insert(0, SOURCE_DIRECTORY)
+
+
+def timings(values):
+    """
+    Summarize a list of durations in seconds.
+
+    Returns:
+        dict: The count, mean, p50 and p99 in milliseconds.
+    """
+    if not values:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p99_ms": None}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def benchmark_buffer(args):
+    """
+    Measure how fast maintain_mission_buffer fills an empty buffer.
+
+    Returns:
+        dict: The mission throughput.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.controllers import maintain_mission_buffer
+    from api.database import Session, Mission
+
+    started = time.perf_counter()
+    maintain_mission_buffer(args.missions, args.generation_concurrency)
+    elapsed = time.perf_counter() - started
+
+    session = Session()
+    try:
+        stored = session.query(Mission).count()
+    finally:
+        session.close()
+    return {
+        "generation_mode": args.generation_mode,
+        "generation_concurrency": args.generation_concurrency,
+        "missions": stored,
+        "duration_s": round(elapsed, 3),
+        "missions_per_s": round(stored / elapsed, 3),
+    }
+
+
+def seed_missions(count, template):
+    """
+    Store copies of a mission so that every /mission request can claim one.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.controllers import add_mission
+    from api.database import Session
+
+    session = Session()
+    try:
+        for number in range(count):
+            add_mission(dict(template, mission_title=f"Seeded {number}"), session)
+    finally:
+        session.close()
+
+
+def benchmark_requests(url, path, concurrency, requests_per_client):
+    """
+    Send requests to one endpoint from several clients at once.
+
+    Returns:
+        dict: The latency and error counts.
+    """
+    durations, errors = [], 0
+    lock = threading.Lock()
+
+    def client():
+        nonlocal errors
+        for _ in range(requests_per_client):
+            try:
+                status, _, elapsed = request(url, path, chunk_size=65536)
+            except OSError:
+                status, elapsed = None, None
+            with lock:
+                if status == 200:
+                    durations.append(elapsed)
+                else:
+                    errors += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    return dict(
+        {"path": path, "concurrency": concurrency, "errors": errors},
+        **timings(durations),
+    )
+
+
+def benchmark_api(args, app):
+    """
+    Serve the app over HTTP and measure /mission and /mission-audio latency.
+
+    Returns:
+        list: The results per endpoint and concurrency level.
+    """
+    # pylint: disable=import-outside-toplevel
+    from werkzeug.serving import make_server
+    from api.database import Session, Mission
+
+    session = Session()
+    try:
+        mission = session.query(Mission).order_by(Mission.id.asc()).first()
+        template = mission.to_dict()
+    finally:
+        session.close()
+    # Both /mission paths claim a mission per request
+    seed_missions(
+        2 * sum(args.concurrency) * args.requests_per_client + args.missions, template
+    )
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = urlparse(f"http://127.0.0.1:{server.server_port}")
+    try:
+        results = []
+        for concurrency in args.concurrency:
+            for path in (
+                "/mission",
+                "/mission?compact=true",
+                f"/mission-audio/{mission.id}",
+            ):
+                results.append(
+                    benchmark_requests(url, path, concurrency, args.requests_per_client)
+                )
+        return results
+    finally:
+        server.shutdown()
+
+
+def benchmark_conversion(args, fake_server):
+    """
+    Measure create_audio_file per conversion mode without TTS latency.
+
+    Returns:
+        list: The results per conversion mode.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.generators import create_audio_file
+
+    script = "The pups race to the rescue. " * (args.script_chars // 30 + 1)
+    latency, fake_server.config.latency = fake_server.config.latency, 0.0
+    results = []
+    try:
+        for mode in args.conversion_modes:
+            os.environ["AUDIO_CONVERSION_MODE"] = mode
+            durations, failures = [], 0
+            for number in range(args.conversion_runs):
+                started = time.perf_counter()
+                if create_audio_file(f"benchmark_{mode}_{number}", script):
+                    durations.append(time.perf_counter() - started)
+                else:
+                    failures += 1
+            results.append(
+                dict({"mode": mode, "failures": failures}, **timings(durations))
+            )
+    finally:
+        fake_server.config.latency = latency
+        os.environ["AUDIO_CONVERSION_MODE"] = args.conversion_modes[0]
+    return results
+
+
+def benchmark_batch(args, directory):
+    """
+    Run a bulk generation through the fake Batch API.
+
+    Returns:
+        dict: The number of missions requested and released, the duration and
+            the error that stopped the run, if any.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.controllers import generate_missions_in_batches
+
+    started = time.perf_counter()
+    result = {"missions": args.batch_missions, "released": 0, "error": None}
+    try:
+        released = generate_missions_in_batches(
+            args.batch_missions,
+            run_directory=os.path.join(directory, "batch-run"),
+            poll_interval=min(1.0, args.batch_seconds),
+            timeout=60 + args.batch_seconds * 3,
+            concurrency=args.generation_concurrency,
+        )
+        result["released"] = len(released)
+    except Exception as e:  # pylint: disable=broad-except
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["duration_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _flatten(report):
+    """
+    Index the compared result fields of a report by a readable key.
+    """
+    values = {}
+    if report.get("buffer"):
+        values["buffer.missions_per_s"] = report["buffer"]["missions_per_s"]
+    for result in report.get("api", []):
+        for field in ("p50_ms", "p99_ms"):
+            key = f"api.{result['path']}@{result['concurrency']}.{field}"
+            values[key] = result[field]
+    for result in report.get("conversion", []):
+        values[f"conversion.{result['mode']}.mean_ms"] = result["mean_ms"]
+    return values
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Compare the results with a baseline report.
+
+    Returns:
+        list: A description of every result that regressed by more than the tolerance.
+    """
+    current, previous = _flatten(report), _flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        before = previous.get(key)
+        if value is None or not before:
+            continue
+        higher_is_better = COMPARED_FIELDS[key.rsplit(".", 1)[-1]]
+        change = (value - before) / before
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{key}: {before} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    """
+    Parse the command line arguments, run the benchmarks and write the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--missions", type=int, default=12)
+    parser.add_argument("--generation-concurrency", type=int, default=3)
+    parser.add_argument(
+        "--generation-mode", choices=["multi-pass", "single-pass"], default="multi-pass"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument(
+        "--conversion-modes",
+        nargs="+",
+        default=["stream", "pcm", "mp3"] if shutil.which("ffmpeg") else ["pcm"],
+        help="AUDIO_CONVERSION_MODE values to benchmark, the first is used for the buffer",
+    )
+    parser.add_argument("--conversion-runs", type=int, default=5)
+    parser.add_argument(
+        "--batch-missions",
+        type=int,
+        default=4,
+        help="Missions requested through the Batch API, 0 skips bulk generation",
+    )
+    parser.add_argument(
+        "--client-timeout",
+        type=float,
+        default=5.0,
+        help="OpenAI client read timeout, requests hanging longer count as timeouts",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare the results with this report")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed regression against the baseline, as a fraction",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    # The pipeline prints its progress, which must not mix with the report
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(
+        sys.stderr
+    ):
+        fake_server = start_fake_openai_server(args)
+        configure_environment(directory, fake_server.base_url, args)
+        # Creating the app configures logging before the pipeline logs anything,
+        # the benchmark drives the buffer maintenance itself
+        app = importlib.import_module("main").create_app(background_services=False)
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "ffmpeg": shutil.which("ffmpeg") is not None,
+            },
+            "arguments": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "baseline")
+            },
+        }
+        report["buffer"] = benchmark_buffer(args)
+        report["api"] = benchmark_api(args, app)
+        report["conversion"] = benchmark_conversion(args, fake_server)
+        if args.batch_missions > 0:
+            report["batch"] = benchmark_batch(args, directory)
+        report["fake_openai"] = dict(fake_server.stats)
+        fake_server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            report["regressions"] = compare_with_baseline(
+                report, json.load(baseline_file), args.tolerance
+            )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(output)
+    print(output)
+    batch = report.get("batch")
+    if report.get("regressions") or (
+        batch and (batch["error"] or not batch["released"])
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
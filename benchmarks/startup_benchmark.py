@@ -0,0 +1,255 @@
+"""
+Startup benchmark enforcing the import-time budget of the API.
+
+Imports main and calls create_app() in fresh Python processes, so nothing is
+cached between runs, and measures:
+
+- the time to import main,
+- the time create_app() takes, without starting the background services,
+- which of the deferred modules, e.g. openai and sqlalchemy, got loaded anyway,
+- whether the mission buffer maintenance thread is still alive a few seconds
+  after create_app() started it on a fresh data directory.
+
+With --import-time, the slowest imports reported by python -X importtime are
+added to the report. The exit status is 1 if the median import or create_app()
+time is over its budget, if a deferred module was loaded during startup, or if
+the maintenance thread died.
+
+Usage:
+    python benchmarks/startup_benchmark.py --runs 5 --import-budget-ms 400 \
+        --create-app-budget-ms 100 --import-time --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from statistics import median
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+# Modules that must only be imported when they are first used, not at startup
+DEFERRED_MODULES = (
+    "openai",
+    "httpx",
+    "sqlalchemy",
+    "api.database",
+    "api.generators",
+    "api.openai_integration",
+)
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app(background_services=False)
+created = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (
+    DEFERRED_MODULES,
+)
+
+
+# Started with an empty buffer, so the maintenance thread makes no OpenAI calls
+MAINTENANCE_SCRIPT = """
+import json, os, time
+import main
+main.create_app()
+time.sleep(%r)
+lock_path = os.path.join(os.environ["DATABASE_DIRECTORY_PATH"], "buffer_maintenance.lock")
+print(json.dumps({
+    "alive": main._buffer_thread is not None and main._buffer_thread.is_alive(),
+    "leader": os.path.exists(lock_path),
+}))
+"""
+
+
+def startup_environment(directory):
+    """
+    Build the environment of the startup processes.
+
+    Returns:
+        dict: The current environment pointing the app at a temporary data directory.
+    """
+    return dict(
+        os.environ,
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "benchmark"),
+        DATABASE_DIRECTORY_PATH=os.path.join(directory, "database"),
+        AUDIO_DIRECTORY_PATH=os.path.join(directory, "audio"),
+        LOG_DIRECTORY_PATH=os.path.join(directory, "logs"),
+        PYTHONPATH=SOURCE_DIRECTORY,
+    )
+
+
+def measure_startup(environment):
+    """
+    Import main and create the app in a fresh process.
+
+    Returns:
+        dict: The import and create_app() times and the deferred modules loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT],
+        env=environment,
+        cwd=SOURCE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def check_maintenance_thread(directory, seconds):
+    """
+    Start the app with its background services on a fresh data directory.
+
+    Returns:
+        dict: Whether the maintenance thread is alive after the given seconds,
+            and whether it took the buffer maintenance lock.
+    """
+    environment = dict(
+        startup_environment(os.path.join(directory, "maintenance")),
+        MISSION_BUFFER_SIZE="0",
+        OPENAI_BASE_URL="http://127.0.0.1:9/v1",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", MAINTENANCE_SCRIPT % seconds],
+        env=environment,
+        cwd=SOURCE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def slowest_imports(environment, count):
+    """
+    Find the slowest imports of main with python -X importtime.
+
+    Returns:
+        list: The modules with the highest cumulative import time, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=environment,
+        cwd=SOURCE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        imports.append(
+            {
+                "module": module.strip(),
+                "cumulative_ms": round(int(cumulative) / 1000, 3),
+            }
+        )
+    imports.sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+    return imports[:count]
+
+
+def check_budget(report, import_budget_ms, create_app_budget_ms):
+    """
+    Compare the startup results with the budget.
+
+    Returns:
+        list: A description of every budget that was exceeded.
+    """
+    violations = []
+    if report["import_ms"]["p50"] > import_budget_ms:
+        violations.append(
+            f"import main: {report['import_ms']['p50']} ms > {import_budget_ms} ms"
+        )
+    if report["create_app_ms"]["p50"] > create_app_budget_ms:
+        violations.append(
+            f"create_app(): {report['create_app_ms']['p50']} ms > "
+            f"{create_app_budget_ms} ms"
+        )
+    for module in report["deferred_modules_loaded"]:
+        violations.append(f"{module} was imported during startup")
+    if not report["maintenance_thread"]["alive"]:
+        violations.append("the mission buffer maintenance thread died")
+    elif not report["maintenance_thread"]["leader"]:
+        violations.append("the maintenance thread did not take the buffer lock")
+    return violations
+
+
+def main():
+    """
+    Parse the command line arguments, run the benchmark and write the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=400.0)
+    parser.add_argument("--create-app-budget-ms", type=float, default=100.0)
+    parser.add_argument(
+        "--import-time",
+        action="store_true",
+        help="Add the slowest imports reported by python -X importtime",
+    )
+    parser.add_argument("--slowest", type=int, default=15)
+    parser.add_argument(
+        "--maintenance-seconds",
+        type=float,
+        default=2.0,
+        help="Seconds the maintenance thread must stay alive after create_app()",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = startup_environment(directory)
+        runs = [measure_startup(environment) for _ in range(args.runs)]
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+            },
+            "budget": {
+                "import_ms": args.import_budget_ms,
+                "create_app_ms": args.create_app_budget_ms,
+                "deferred_modules": list(DEFERRED_MODULES),
+            },
+        }
+        for key in ("import_ms", "create_app_ms"):
+            values = [run[key] for run in runs]
+            report[key] = {
+                "p50": round(median(values), 3),
+                "min": round(min(values), 3),
+                "max": round(max(values), 3),
+            }
+        report["deferred_modules_loaded"] = sorted(
+            {module for run in runs for module in run["loaded"]}
+        )
+        report["maintenance_thread"] = check_maintenance_thread(
+            directory, args.maintenance_seconds
+        )
+        if args.import_time:
+            report["slowest_imports"] = slowest_imports(environment, args.slowest)
+
+    report["violations"] = check_budget(
+        report, args.import_budget_ms, args.create_app_budget_ms
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(output)
+    print(output)
+    if report["violations"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
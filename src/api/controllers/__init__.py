@@ -1,18 +1,55 @@
 """
 This module contains the controllers for managing missions in the Paw Patrol Tower API.
+
+The controllers are imported from their modules on first use, so that
+importing the package does not pull in the mission generators and the OpenAI
+client. The web process only needs the ready queue to serve /mission, the
+generators are loaded by the buffer maintenance thread.
 """
-from .mission_controller import (
-    add_mission,
-    get_mission_by_id,
-    get_latest_unrequested_mission,
-    get_mission_by_title,
-    maintain_mission_buffer,
-)
+from importlib import import_module
+
+# The exported names, mapped to the module that defines them
+_EXPORTS = {
+    "add_mission": ".mission_controller",
+    "get_mission_by_id": ".mission_controller",
+    "get_latest_unrequested_mission": ".mission_controller",
+    "get_mission_by_title": ".mission_controller",
+    "maintain_mission_buffer": ".mission_controller",
+    "generate_missions_in_batches": ".batch_generation",
+    "claim_ready_mission": ".ready_queue",
+    "parse_mission_fields": ".ready_queue",
+    "become_buffer_leader": ".buffer_leader",
+    "get_buffer_state": ".buffer_state",
+    "get_buffer_size": ".buffer_refill",
+    "request_buffer_refill": ".buffer_refill",
+    "wait_for_refill_request": ".buffer_refill",
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
+
 
 __all__ = [
     "add_mission",
     "get_mission_by_id",
     "get_latest_unrequested_mission",
+    "claim_ready_mission",
     "get_mission_by_title",
     "maintain_mission_buffer",
+    "generate_missions_in_batches",
+    "parse_mission_fields",
+    "become_buffer_leader",
+    "get_buffer_state",
+    "get_buffer_size",
+    "request_buffer_refill",
+    "wait_for_refill_request",
 ]
@@ -0,0 +1,318 @@
+"""
+This module contains the bulk generation of missions through the OpenAI Batch API.
+
+Where maintain_mission_buffer makes interactive chat calls for every mission,
+bulk generation writes each stage of the pipeline for all missions to a JSONL
+batch file and submits it through the Batch API, at batch pricing and rate
+limits. The stages are generation, translation and refinement in multi-pass
+mode, and generation only in single-pass mode. Completed missions are stored
+in one transaction and held back from /mission until their audio is created,
+after which they are released in one transaction.
+
+The progress of a run is kept in a state file in its run directory, so a run
+interrupted overnight can be resumed without submitting its batches again.
+"""
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from api.database import Session
+from api.generators import (
+    build_mission_chat_request,
+    build_mission_messages,
+    build_translation_messages,
+    get_generation_mode,
+    get_mission_variation,
+    SINGLE_PASS_MODE,
+)
+from api.openai_integration import (
+    read_batch_results,
+    submit_batch,
+    wait_for_batch,
+    write_batch_file,
+)
+
+from .buffer_state import get_latest_mission
+from .similarity_index import MissionSimilarityIndex, get_similarity_index
+from .mission_controller import (
+    add_missions,
+    create_mission_audio,
+    delete_missions,
+    release_missions,
+)
+
+GENERATION_PHASE = "generation"
+TRANSLATION_PHASE = "translation"
+REFINEMENT_PHASE = "refinement"
+
+STATE_FILE_NAME = "state.json"
+
+REQUIRED_MISSION_FIELDS = ("mission_title", "main_location", "mission_script")
+
+
+def get_batch_phases(mode: str) -> List[str]:
+    """
+    Get the batch phases of a generation mode, in order.
+
+    Args:
+        mode (str): The generation mode.
+
+    Returns:
+        list: The phases, each submitted as one batch.
+    """
+    if mode == SINGLE_PASS_MODE:
+        return [GENERATION_PHASE]
+    return [GENERATION_PHASE, TRANSLATION_PHASE, REFINEMENT_PHASE]
+
+
+def _load_state(run_directory: str) -> Optional[Dict]:
+    path = os.path.join(run_directory, STATE_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as state_file:
+        return json.load(state_file)
+
+
+def _save_state(run_directory: str, state: Dict):
+    path = os.path.join(run_directory, STATE_FILE_NAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def _phase_requests(phase: str, state: Dict, session: Session):
+    """
+    Build the requests of a batch phase from the missions still in the run.
+
+    Every generation request gets its own variation hint and seed, as the
+    requests of a batch cannot see each other's missions.
+    """
+    if phase == GENERATION_PHASE:
+        avoid_missions = [get_latest_mission(session)]
+        avoid_summary = get_similarity_index(session).avoid_summary()
+        return [
+            (
+                custom_id,
+                dict(
+                    build_mission_chat_request(
+                        build_mission_messages(
+                            avoid_missions,
+                            state["mode"],
+                            avoid_summary,
+                            get_mission_variation(number),
+                        ),
+                        temperature=0.8,
+                    ),
+                    seed=number,
+                ),
+            )
+            for number, custom_id in enumerate(state["missions"])
+        ]
+
+    requests = []
+    for custom_id, entry in state["missions"].items():
+        if entry["mission"] is None:
+            continue
+        if phase == TRANSLATION_PHASE:
+            messages = build_translation_messages(entry["mission"])
+        else:
+            messages = build_translation_messages(
+                entry["mission"], entry["draft_translation"]
+            )
+        requests.append(
+            (custom_id, build_mission_chat_request(messages, temperature=0.8))
+        )
+    return requests
+
+
+def _response_content(body: Optional[Dict]) -> Optional[str]:
+    if not body or not body.get("choices"):
+        return None
+    return body["choices"][0]["message"]["content"]
+
+
+def _parse_json(content: Optional[str]) -> Optional[Dict]:
+    try:
+        document = json.loads(content) if content else None
+    except json.JSONDecodeError:
+        logging.error("Failed to parse JSON response")
+        return None
+    return document if isinstance(document, dict) else None
+
+
+def _apply_generation_results(state: Dict, results: Dict, session: Session):
+    """
+    Store the generated missions, dropping failed, incomplete and duplicate ones.
+
+    Missions are compared with the stored missions and with the missions of
+    the run accepted before them by the similarity index, so missions that
+    only share a location are kept.
+    """
+    stored_index, run_index = get_similarity_index(session), MissionSimilarityIndex()
+    for custom_id, entry in state["missions"].items():
+        mission = _parse_json(_response_content(results.get(custom_id)))
+        if mission is None or any(
+            not mission.get(key) for key in REQUIRED_MISSION_FIELDS
+        ):
+            entry["mission"] = None
+            continue
+        if state["mode"] == SINGLE_PASS_MODE and not mission.get("translation"):
+            entry["mission"] = None
+            continue
+
+        if stored_index.find_duplicate(mission) or run_index.find_duplicate(mission):
+            logging.info(
+                "Discarding duplicate mission draft: %s", mission["mission_title"]
+            )
+            entry["mission"] = None
+            continue
+        run_index.add(dict(mission, id=custom_id))
+        entry["mission"] = mission
+
+
+def _apply_results(phase: str, state: Dict, results: Dict, session: Session):
+    """
+    Update the missions of the run with the results of a batch phase.
+    """
+    if phase == GENERATION_PHASE:
+        _apply_generation_results(state, results, session)
+        return
+
+    for custom_id, entry in state["missions"].items():
+        if entry["mission"] is None:
+            continue
+        content = _response_content(results.get(custom_id))
+        if phase == TRANSLATION_PHASE:
+            if _parse_json(content) is None:
+                entry["mission"] = None
+            entry["draft_translation"] = content
+            continue
+
+        translation = (_parse_json(content) or {}).get("translation")
+        if not translation:
+            logging.warning(
+                "Refinement of %s failed, using the first translation", custom_id
+            )
+            translation = _parse_json(entry["draft_translation"]).get("translation")
+        entry["mission"]["translation"] = translation
+
+
+def _ingest_missions(run_directory: str, state: Dict, session: Session, concurrency):
+    """
+    Store the completed missions, create their audio and release them.
+
+    Returns:
+        list: The released missions.
+    """
+    if state.get("stored") is None:
+        completed = [
+            entry["mission"]
+            for entry in state["missions"].values()
+            if entry["mission"] and entry["mission"].get("translation")
+        ]
+        state["stored"] = add_missions(completed, session, hold=True)
+        _save_state(run_directory, state)
+
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="batch-audio"
+    ) as executor:
+        created = list(executor.map(create_mission_audio, state["stored"]))
+
+    released = [mission for mission, ok in zip(state["stored"], created) if ok]
+    failed = [mission["id"] for mission, ok in zip(state["stored"], created) if not ok]
+    if failed:
+        logging.error(
+            "Failed to create the audio file of %s missions. Deleting them.",
+            len(failed),
+        )
+    release_missions(released, session)
+    delete_missions(failed, session)
+    state["released"] = [mission["id"] for mission in released]
+    _save_state(run_directory, state)
+    return released
+
+
+def generate_missions_in_batches(
+    count: int = None,
+    run_directory: str = None,
+    poll_interval: float = None,
+    timeout: float = None,
+    concurrency: int = None,
+) -> List[Dict]:
+    """
+    Generate missions in bulk through the OpenAI Batch API.
+
+    Args:
+        count (int, optional): The number of missions to request. Duplicates and
+            failed requests are dropped, so fewer missions may be stored.
+            Not needed when resuming a run.
+        run_directory (str, optional): The directory of the batch files and the
+            run state. An existing run in it is resumed. Defaults to a new
+            directory in the BATCH_DIRECTORY_PATH environment variable.
+        poll_interval (float, optional): Seconds between polls of a batch.
+            Defaults to the BATCH_POLL_INTERVAL environment variable.
+        timeout (float, optional): Seconds to wait for each batch at most.
+            Defaults to no limit.
+        concurrency (int, optional): The number of audio files created at once.
+            Defaults to the MISSION_GENERATION_CONCURRENCY environment variable.
+
+    Returns:
+        list: The missions stored and released to the buffer.
+
+    Raises:
+        BatchException: If a batch failed, was cancelled or did not end in time.
+            The run can be resumed from its run directory.
+    """
+    if run_directory is None:
+        run_directory = os.path.join(
+            os.getenv("BATCH_DIRECTORY_PATH", "/data/batches"),
+            time.strftime("run-%Y%m%d-%H%M%S"),
+        )
+    if poll_interval is None:
+        poll_interval = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+    if concurrency is None:
+        concurrency = int(os.getenv("MISSION_GENERATION_CONCURRENCY", "3"))
+    os.makedirs(run_directory, exist_ok=True)
+
+    state = _load_state(run_directory)
+    if state is None:
+        if not count:
+            raise ValueError(f"No run to resume in {run_directory}")
+        state = {
+            "mode": get_generation_mode(),
+            "missions": {
+                f"mission-{number}": {"mission": None, "draft_translation": None}
+                for number in range(count)
+            },
+            "batches": {},
+            "completed_phases": [],
+        }
+        _save_state(run_directory, state)
+    elif state.get("released") is not None:
+        logging.info("Batch run %s is already complete", run_directory)
+        return []
+    logging.info("Batch run %s in %s mode", run_directory, state["mode"])
+
+    session = Session()
+    try:
+        for phase in get_batch_phases(state["mode"]):
+            if phase in state["completed_phases"]:
+                continue
+            if phase not in state["batches"]:
+                path = os.path.join(run_directory, f"{phase}.jsonl")
+                requests = _phase_requests(phase, state, session)
+                if write_batch_file(path, requests) == 0:
+                    break
+                state["batches"][phase] = submit_batch(path)["id"]
+                _save_state(run_directory, state)
+
+            batch = wait_for_batch(state["batches"][phase], poll_interval, timeout)
+            _apply_results(phase, state, read_batch_results(batch), session)
+            state["completed_phases"].append(phase)
+            _save_state(run_directory, state)
+
+        return _ingest_missions(run_directory, state, session, max(1, concurrency))
+    finally:
+        session.close()
@@ -0,0 +1,59 @@
+"""
+This module contains the leader election for the mission buffer maintenance.
+
+Every gunicorn worker runs a maintenance thread, but only the process holding
+an exclusive lock on a file on the database volume generates missions. The
+operating system releases the lock when that process exits, after which
+another worker takes over.
+"""
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is not available on Windows
+    fcntl = None
+
+_lock_file = None
+
+
+def _get_lock_path() -> str:
+    return os.path.join(
+        os.getenv("DATABASE_DIRECTORY_PATH", "/data/database"),
+        "buffer_maintenance.lock",
+    )
+
+
+def become_buffer_leader() -> bool:
+    """
+    Tries to become the process that maintains the mission buffer.
+
+    Returns:
+        bool: True if this process holds the maintenance lock, False otherwise.
+    """
+    global _lock_file  # pylint: disable=global-statement
+    if _lock_file is not None:
+        return True
+
+    if fcntl is None:
+        logging.warning("File locks are not supported, maintaining buffer anyway")
+        return True
+
+    # The lock may be taken before the database engine has created the directory
+    lock_path = _get_lock_path()
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(  # pylint: disable=consider-using-with
+        lock_path, "a+", encoding="utf-8"
+    )
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file
+    logging.info("Process %s is now maintaining the mission buffer", os.getpid())
+    return True
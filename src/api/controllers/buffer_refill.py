@@ -0,0 +1,117 @@
+"""
+This module contains the signalling between the claim path and the mission buffer maintenance.
+
+Claiming a mission that takes the buffer from above its low watermark to at
+or below it requests a refill. Claims that find the buffer already low do not
+request another one, so an empty buffer does not defeat the debounce and the
+fallback interval of the maintenance thread. The request wakes the maintenance thread of the same
+process directly, and the maintenance threads of other gunicorn workers
+through a trigger file on the database volume.
+"""
+import os
+import logging
+import threading
+import time
+
+_refill_requested = threading.Event()
+_last_seen_trigger = None
+_level_lock = threading.Lock()
+_last_level = None
+
+
+def get_buffer_size() -> int:
+    """
+    Gets the size of the mission buffer, which is its high watermark.
+
+    Returns:
+        int: The MISSION_BUFFER_SIZE environment variable, defaults to 5.
+    """
+    return int(os.getenv("MISSION_BUFFER_SIZE", "5"))
+
+
+def get_low_watermark() -> int:
+    """
+    Gets the number of unrequested missions at or below which a refill is requested.
+
+    Returns:
+        int: The MISSION_BUFFER_LOW_WATERMARK environment variable, defaults to
+            half of the buffer size.
+    """
+    return int(os.getenv("MISSION_BUFFER_LOW_WATERMARK", str(get_buffer_size() // 2)))
+
+
+def _get_trigger_path() -> str:
+    return os.path.join(
+        os.getenv("DATABASE_DIRECTORY_PATH", "/data/database"), "buffer_refill.trigger"
+    )
+
+
+def _read_trigger():
+    try:
+        return os.stat(_get_trigger_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def request_buffer_refill():
+    """
+    Requests a refill of the mission buffer from the maintenance thread of every worker.
+    """
+    _refill_requested.set()
+    try:
+        with open(_get_trigger_path(), "a", encoding="utf-8"):
+            pass
+        os.utime(_get_trigger_path())
+    except OSError as e:
+        logging.warning("Failed to signal buffer refill to other workers: %s", e)
+
+
+def notify_buffer_level(unrequested_count: int):
+    """
+    Requests a refill if the number of unrequested missions crossed the low watermark.
+
+    The first level seen by the process counts as a crossing when it is low.
+
+    Args:
+        unrequested_count (int): The number of unrequested missions left.
+    """
+    global _last_level  # pylint: disable=global-statement
+    low_watermark = get_low_watermark()
+    with _level_lock:
+        previous, _last_level = _last_level, unrequested_count
+    if unrequested_count <= low_watermark and (
+        previous is None or previous > low_watermark
+    ):
+        request_buffer_refill()
+
+
+def wait_for_refill_request(timeout: float) -> bool:
+    """
+    Waits until a refill is requested or the timeout expires.
+
+    Once a request arrives, waits for the MISSION_BUFFER_REFILL_DEBOUNCE_SECONDS
+    period so that a burst of claims results in a single refill.
+
+    Args:
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        bool: True if a refill was requested, False if the timeout expired.
+    """
+    global _last_seen_trigger  # pylint: disable=global-statement
+    poll_interval = float(os.getenv("MISSION_BUFFER_POLL_SECONDS", "5"))
+    debounce = float(os.getenv("MISSION_BUFFER_REFILL_DEBOUNCE_SECONDS", "2"))
+    deadline = time.monotonic() + timeout
+
+    requested = False
+    while not requested:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        requested = _refill_requested.wait(min(poll_interval, remaining))
+        requested = _read_trigger() != _last_seen_trigger or requested
+
+    time.sleep(debounce)
+    _refill_requested.clear()
+    _last_seen_trigger = _read_trigger()
+    return True
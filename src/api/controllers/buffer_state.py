@@ -0,0 +1,156 @@
+"""
+This module contains the in-memory state of the mission buffer.
+
+The number of unrequested missions and the latest stored mission are kept up
+to date on insert, claim and delete, so the buffer maintenance and the claim
+path do not need to scan the missions table for every mission. The count only
+sees the changes made by this process, so it is reconciled with the database
+when the maintenance starts a refill and whenever it is older than
+MISSION_BUFFER_RECONCILE_SECONDS.
+"""
+import os
+import time
+from threading import Lock
+from typing import Dict, Optional
+from api.database import Mission
+from api.monitoring import BUFFER_DEPTH
+
+# pylint: disable=singleton-comparison
+
+_lock = Lock()
+_unrequested_count: Optional[int] = None
+_latest_mission: Optional[Dict] = None
+_reconciled_at: Optional[float] = None
+
+
+def _get_reconcile_interval() -> float:
+    return float(os.getenv("MISSION_BUFFER_RECONCILE_SECONDS", "60"))
+
+
+def _is_stale() -> bool:
+    return (
+        _unrequested_count is None
+        or time.monotonic() - _reconciled_at > _get_reconcile_interval()
+    )
+
+
+def reconcile_buffer_state(session) -> int:
+    """
+    Recounts the unrequested missions in the database.
+
+    Args:
+        session (Session): The database session.
+
+    Returns:
+        int: The number of unrequested missions.
+    """
+    global _unrequested_count, _reconciled_at  # pylint: disable=global-statement
+    unrequested_count = (
+        session.query(Mission).filter(Mission.is_requested == False).count()
+    )
+    with _lock:
+        _unrequested_count = unrequested_count
+        _reconciled_at = time.monotonic()
+    return unrequested_count
+
+
+def get_unrequested_count(session) -> int:
+    """
+    Gets the number of unrequested missions, reconciling it with the database if it is stale.
+
+    Args:
+        session (Session): The database session used to reconcile the count.
+
+    Returns:
+        int: The number of unrequested missions.
+    """
+    with _lock:
+        if not _is_stale():
+            return _unrequested_count
+    return reconcile_buffer_state(session)
+
+
+def get_latest_mission(session) -> Optional[Dict]:
+    """
+    Gets the latest stored mission, loading it from the database on first use.
+
+    Args:
+        session (Session): The database session used to load the mission.
+
+    Returns:
+        dict: The latest mission data, or None if there are no missions.
+    """
+    global _latest_mission  # pylint: disable=global-statement
+    with _lock:
+        if _latest_mission is not None:
+            return _latest_mission
+
+    latest_mission = session.query(Mission).order_by(Mission.id.desc()).first()
+    if latest_mission is None:
+        return None
+    with _lock:
+        if _latest_mission is None:
+            _latest_mission = latest_mission.to_dict()
+        return _latest_mission
+
+
+def record_mission_added(mission: Dict):
+    """
+    Records a mission stored in the database as unrequested and latest.
+
+    Args:
+        mission (dict): The stored mission data.
+    """
+    global _unrequested_count, _latest_mission  # pylint: disable=global-statement
+    with _lock:
+        if _unrequested_count is not None:
+            _unrequested_count += 1
+        if _latest_mission is None or mission["id"] > _latest_mission["id"]:
+            _latest_mission = mission
+
+
+def record_mission_removed(session, count: int = 1) -> int:
+    """
+    Records that unrequested missions were claimed or deleted.
+
+    A stale count is recounted from the database instead, which already
+    reflects the removed missions.
+
+    Args:
+        session (Session): The database session used if the count is stale.
+        count (int, optional): The number of missions removed. Defaults to 1.
+
+    Returns:
+        int: The number of unrequested missions left.
+    """
+    global _unrequested_count  # pylint: disable=global-statement
+    with _lock:
+        if not _is_stale():
+            _unrequested_count = max(0, _unrequested_count - count)
+            return _unrequested_count
+    return reconcile_buffer_state(session)
+
+
+def get_buffer_state() -> Dict:
+    """
+    Gets the buffer state as last seen by this process, without querying the database.
+
+    Returns:
+        dict: The number of unrequested missions (None if not yet counted),
+            the id of the latest mission and the seconds since the last reconciliation.
+    """
+    with _lock:
+        return {
+            "unrequested_missions": _unrequested_count,
+            "latest_mission_id": _latest_mission["id"] if _latest_mission else None,
+            "seconds_since_reconcile": (
+                round(time.monotonic() - _reconciled_at, 1)
+                if _reconciled_at is not None
+                else None
+            ),
+        }
+
+
+BUFFER_DEPTH.set_function(lambda: get_buffer_state()["unrequested_missions"])
+
+# pylint: enable=singleton-comparison
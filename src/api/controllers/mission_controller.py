@@ -3,11 +3,37 @@ This module contains functions for managing missions in the Paw Patrol Tower API
 """
 import logging
 import os
-from typing import Dict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count
+from threading import Lock
+from typing import Dict, List, Optional
 from sqlalchemy.exc import SQLAlchemyError
-from api.openai_integration import ChatApp
 from api.database import Session, Mission
-from api.generators import generate_new_mission_data, create_audio_file
+from api.generators import (
+    add_mission_translation,
+    create_audio_file,
+    create_mission_chat_app,
+    generate_mission_draft,
+    generate_single_pass_mission,
+    get_generation_mode,
+    SINGLE_PASS_MODE,
+)
+from api.openai_integration import RetryLaterException, RetryScheduler
+
+from .buffer_state import (
+    get_latest_mission,
+    get_unrequested_count,
+    reconcile_buffer_state,
+    record_mission_added,
+    record_mission_removed,
+)
+from .ready_queue import claim_ready_mission, discard_ready_mission
+from .similarity_index import (
+    MissionSimilarityIndex,
+    get_similarity_index,
+    index_mission,
+    remove_indexed_mission,
+)
 
 # pylint: disable=singleton-comparison
 
@@ -24,17 +50,19 @@ def add_mission(mission_data: Dict[str, any], session: Session):
         dict: The added mission data if successful, None otherwise.
     """
     try:
-        involved_pups_str = ",".join(mission_data.get("involved_pups", []))
         mission = Mission(
             mission_title=mission_data["mission_title"],
-            involved_pups=involved_pups_str,
+            involved_pups=mission_data.get("involved_pups", []),
             main_location=mission_data["main_location"],
             mission_script=mission_data["mission_script"],
             translation=mission_data["translation"],
         )
         session.add(mission)
         session.commit()
-        return mission.to_dict()
+        mission_dict = mission.to_dict()
+        record_mission_added(mission_dict)
+        index_mission(mission_dict)
+        return mission_dict
 
     except KeyError as e:  # Specific exception for missing dictionary keys
         logging.error("KeyError: Missing data in mission_data: %s", e)
@@ -48,6 +76,71 @@ def add_mission(mission_data: Dict[str, any], session: Session):
     return None  # Return None outside of the try-except block
 
 
+def add_missions(
+    missions_data: List[Dict[str, any]], session: Session, hold: bool = False
+) -> List[Dict]:
+    """
+    Add several missions to the database in one transaction.
+
+    Args:
+        missions_data (list): The data of the missions to be added.
+        session (Session): The database session.
+        hold (bool): Store the missions as requested, so that they are not served
+            until release_missions() is called, e.g. once their audio exists.
+
+    Returns:
+        list: The added mission data, empty if the transaction failed.
+    """
+    try:
+        missions = [
+            Mission(
+                mission_title=mission_data["mission_title"],
+                involved_pups=mission_data.get("involved_pups", []),
+                main_location=mission_data["main_location"],
+                mission_script=mission_data["mission_script"],
+                translation=mission_data["translation"],
+                is_requested=hold,
+            )
+            for mission_data in missions_data
+        ]
+        session.add_all(missions)
+        session.commit()
+        mission_dicts = [mission.to_dict() for mission in missions]
+        for mission_dict in mission_dicts:
+            if not hold:
+                record_mission_added(mission_dict)
+            index_mission(mission_dict)
+        return mission_dicts
+
+    except KeyError as e:
+        logging.error("KeyError: Missing data in missions_data: %s", e)
+
+    except SQLAlchemyError as e:
+        session.rollback()
+        logging.error("Database error: %s", e)
+
+    logging.error("Failed to add missions to the database.")
+    return []
+
+
+def release_missions(missions: List[Dict], session: Session):
+    """
+    Release missions added with hold=True so that they can be served.
+
+    Args:
+        missions (list): The data of the held missions.
+        session (Session): The database session.
+    """
+    if not missions:
+        return
+    session.query(Mission).filter(
+        Mission.id.in_([mission["id"] for mission in missions])
+    ).update({Mission.is_requested: False}, synchronize_session=False)
+    session.commit()
+    for mission in missions:
+        record_mission_added(dict(mission, is_requested=False))
+
+
 def get_mission_by_id(mission_id):
     """
     Get a mission by its ID.
@@ -90,27 +183,25 @@ def get_mission_by_title(title):
     return return_data
 
 
-def get_latest_unrequested_mission():
+def get_latest_unrequested_mission(fields=None):
     """
-    Get the latest unrequested mission.
+    Get the latest unrequested mission and mark it as requested.
+
+    The mission is taken from the ready queue of this process, whose missions
+    were claimed when they were queued, or claimed with a single
+    UPDATE ... RETURNING statement when the queue is empty, so concurrent
+    requests, even from different worker processes, can never be served the
+    same mission. A buffer refill is requested when the number of unrequested
+    missions left crosses the low watermark.
+
+    Args:
+        fields (Sequence[str], optional): The fields to return, defaults to all fields.
 
     Returns:
         dict: The mission data if found, None otherwise.
     """
-    return_data = None
-    session = Session()
-    mission = (
-        session.query(Mission)
-        .filter(Mission.is_requested == False)
-        .order_by(Mission.id.asc())
-        .first()
-    )
-    if mission:
-        mission.is_requested = True
-        session.commit()
-        return_data = mission.to_dict()
-    session.close()
-    return return_data
+    ready_mission = claim_ready_mission(fields)
+    return ready_mission.mission if ready_mission else None
 
 
 def delete_mission(mission_id, session):
@@ -124,63 +215,353 @@ def delete_mission(mission_id, session):
     try:
         mission = session.query(Mission).get(mission_id)
         if mission:
+            was_unrequested = not mission.is_requested
             session.delete(mission)
             session.commit()
+            if was_unrequested:
+                record_mission_removed(session)
+            discard_ready_mission(mission_id)
+            remove_indexed_mission(mission_id)
     except SQLAlchemyError as e:
         logging.error("Error deleting mission from the database: %s", e)
         print("Error deleting mission from the database: %s", e)
 
 
-def maintain_mission_buffer(buffer_size=5):
+def delete_missions(mission_ids: List[int], session):
+    """
+    Delete missions that were never served, e.g. held missions without audio,
+    in one transaction.
+
+    Args:
+        mission_ids (list): The IDs of the missions.
+        session: The database session.
+    """
+    if not mission_ids:
+        return
+    try:
+        for mission in session.query(Mission).filter(Mission.id.in_(mission_ids)):
+            session.delete(mission)
+        session.commit()
+        for mission_id in mission_ids:
+            remove_indexed_mission(mission_id)
+    except SQLAlchemyError as e:
+        session.rollback()
+        logging.error("Error deleting missions from the database: %s", e)
+
+
+TEXT_STAGE = "text"
+TRANSLATION_STAGE = "translation"
+AUDIO_STAGE = "audio"
+
+
+class _MissionHistory:
+    """
+    Thread-safe record of the latest stored mission and the missions in flight.
+
+    Workers generating missions concurrently read it to build their
+    "avoid previous mission" prompt, and reserve their draft in it so that two
+    workers cannot both translate and store the same mission.
+    """
+
+    def __init__(self, latest_mission: Optional[Dict] = None):
+        self._lock = Lock()
+        self._latest_mission = latest_mission
+        self._in_flight: Dict[int, Dict] = {}
+
+    def missions_to_avoid(self) -> List[Dict]:
+        """
+        Get the missions a new draft should avoid.
+
+        Returns:
+            list: The latest stored mission followed by the missions in flight.
+        """
+        with self._lock:
+            missions = [self._latest_mission] + list(self._in_flight.values())
+        return [mission for mission in missions if mission]
+
+    def conflicts(self, key: str, value) -> bool:
+        """
+        Check whether a mission field duplicates the same field of an in-flight draft.
+
+        Args:
+            key (str): The field name. Only the title and location are compared.
+            value: The field value.
+
+        Returns:
+            bool: True if another draft in flight has the same title or location.
+        """
+        if key not in ("mission_title", "main_location"):
+            return False
+        with self._lock:
+            return any(
+                _normalize(value) == _normalize(other.get(key))
+                for other in self._in_flight.values()
+            )
+
+    def reserve(self, token: int, mission_data: Dict) -> bool:
+        """
+        Reserve a mission draft unless another in-flight draft already covers it.
+
+        Args:
+            token (int): The identifier of the pipeline job.
+            mission_data (dict): The mission draft.
+
+        Returns:
+            bool: True if the draft was reserved, False if it is a duplicate.
+        """
+        with self._lock:
+            for other in self._in_flight.values():
+                for key in ("mission_title", "main_location"):
+                    if _normalize(mission_data.get(key)) == _normalize(other.get(key)):
+                        return False
+            self._in_flight[token] = mission_data
+        return True
+
+    def release(self, token: int, stored_mission: Optional[Dict] = None):
+        """
+        Release a reserved draft, recording it as the latest mission if it was stored.
+
+        Args:
+            token (int): The identifier of the pipeline job.
+            stored_mission (dict, optional): The stored mission data.
+        """
+        with self._lock:
+            self._in_flight.pop(token, None)
+            if stored_mission:
+                self._latest_mission = stored_mission
+
+
+def _normalize(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def _is_near_duplicate(index: MissionSimilarityIndex, mission_data: Dict) -> bool:
+    duplicate = index.find_duplicate(mission_data)
+    if duplicate is None:
+        return False
+    logging.info(
+        "Rejected mission %s as a near-duplicate of mission %s %s (similarity %.2f)",
+        mission_data.get("mission_title"),
+        *duplicate,
+    )
+    return True
+
+
+def _draft_stage(
+    history: _MissionHistory, index: MissionSimilarityIndex, attempt: int = None
+):
+    chat_app = create_mission_chat_app(temperature=0.8)
+    avoid_summary = index.avoid_summary()
+    if get_generation_mode() == SINGLE_PASS_MODE:
+        fields = {}
+
+        def on_field(key, value):
+            fields[key] = value
+            if history.conflicts(key, value):
+                return False
+            # The script is complete before the translation starts streaming
+            return key != "mission_script" or not _is_near_duplicate(index, fields)
+
+        return generate_single_pass_mission(
+            history.missions_to_avoid(),
+            chat_app,
+            on_field=on_field,
+            avoid_summary=avoid_summary,
+            attempt=attempt,
+        )
+
+    mission_data = generate_mission_draft(
+        history.missions_to_avoid(), chat_app, avoid_summary, attempt
+    )
+    if mission_data is None or _is_near_duplicate(index, mission_data):
+        return None
+    return mission_data
+
+
+def _translation_stage(mission_data: Dict, attempt: int = None):
+    return add_mission_translation(
+        mission_data, create_mission_chat_app(temperature=0.8), attempt
+    )
+
+
+def create_mission_audio(
+    mission: Dict, pcm_chunks: Dict = None, attempt: int = None
+) -> bool:
+    """
+    Create the audio file of a stored mission from its translation.
+
+    Args:
+        mission (Dict): The mission data, including its id and translation.
+        pcm_chunks (Dict, optional): The synthesized chunks kept between
+            rescheduled attempts. Defaults to None.
+        attempt (int, optional): The number of this attempt, from 0, when the caller
+            reschedules retries itself. Defaults to None, retrying in this thread.
+
+    Returns:
+        bool: True if the audio file was created, False otherwise.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the call should be
+            retried after a delay.
+    """
+    return create_audio_file(
+        f"mission_{mission.get('id')}", mission.get("translation"), attempt, pcm_chunks
+    )
+
+
+def maintain_mission_buffer(buffer_size=5, concurrency=None):
     """
     Maintain the mission buffer by generating new missions.
 
+    Missions are generated by a bounded pool of workers. Each mission passes
+    through a text, a translation and an audio (TTS and conversion) stage, and
+    is stored in the database between the translation and audio stages. In
+    single-pass mode the text stage also produces the translation.
+
+    Drafts that are near-duplicates of a stored mission, according to the
+    similarity index, are rejected in the text stage. The refill stops early
+    if too many drafts fail or are rejected.
+
+    A stage whose OpenAI call fails is rescheduled as a delayed job instead of
+    sleeping in its worker. Jobs waiting for their delay do not count against
+    the concurrency, so new missions are started in their place meanwhile.
+
     Args:
         buffer_size (int): The desired size of the mission buffer.
+        concurrency (int, optional): The maximum number of pipeline jobs running
+            at once. Defaults to the MISSION_GENERATION_CONCURRENCY environment variable.
     """
+    if concurrency is None:
+        concurrency = int(os.getenv("MISSION_GENERATION_CONCURRENCY", "3"))
+    concurrency = max(1, concurrency)
+
     session = Session()
     try:
-        chat_app = ChatApp(
-            response_format={"type": "json_object"},
-            temperature=0.8,
-            max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "2048")),
-            top_p=1,
-            frequency_penalty=0.3,
-        )
-        while True:
-            unrequested_count = (
-                session.query(Mission).filter(Mission.is_requested == False).count()
-            )
-            if unrequested_count >= buffer_size:
-                break
-
-            # Fetch the latest mission
-            latest_mission = session.query(Mission).order_by(Mission.id.desc()).first()
-            latest_mission_data = None
-            if latest_mission:
-                latest_mission_data = latest_mission.to_dict()
-
-            new_mission_data = generate_new_mission_data(latest_mission_data, chat_app)
-            if new_mission_data is None:
-                continue
-
-            new_mission = add_mission(new_mission_data, session)
-            if new_mission is None:
-                continue
-
-            audio_file_name = f"mission_{new_mission.get('id')}"
-            audio_script = new_mission.get("translation")
-            if not create_audio_file(audio_file_name, audio_script):
-                logging.error(
-                    "Failed to create the audio file after retries. Deleting the mission entry."
-                )
-                print(
-                    "Failed to create the audio file after retries. Deleting the mission entry."
+        # Other workers may have claimed missions since the last pass
+        reconcile_buffer_state(session)
+        history = _MissionHistory(get_latest_mission(session))
+        index = get_similarity_index(session)
+        tokens = count()
+        # Stop drafting when most drafts fail or are duplicates, instead of spending calls
+        rejected_drafts, max_rejected_drafts = 0, max(3, 2 * buffer_size)
+
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="mission-pipeline"
+        ) as executor:
+            scheduler = RetryScheduler(executor)
+            # Every pending future maps to its stage, pipeline job, stored
+            # mission, and the function, arguments and attempt of the stage
+            pending = {}
+
+            # Futures of the delayed jobs, which only start running once due
+            delayed = set()
+
+            def submit(stage, token, mission, function, args, attempt=0, delay=0):
+                future = scheduler.submit(function, *args, attempt=attempt, delay=delay)
+                pending[future] = (stage, token, mission, function, args, attempt)
+                if delay > 0:
+                    delayed.add(future)
+
+            def active():
+                return len(pending) - sum(
+                    1 for future in delayed if not future.running()
                 )
-                delete_mission(new_mission.get("id"), session)
-            else:
-                logging.info("Audio file created successfully.")
-                print("Audio file created successfully.")
+
+            try:
+                while True:
+                    drafting = sum(
+                        1 for job in pending.values() if job[0] != AUDIO_STAGE
+                    )
+                    missing = buffer_size - get_unrequested_count(session) - drafting
+                    if rejected_drafts >= max_rejected_drafts:
+                        missing = 0
+                    while missing > 0 and active() < concurrency:
+                        submit(
+                            TEXT_STAGE,
+                            next(tokens),
+                            None,
+                            _draft_stage,
+                            (history, index),
+                        )
+                        missing -= 1
+
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage, token, mission, function, args, attempt = pending.pop(
+                            future
+                        )
+                        delayed.discard(future)
+                        try:
+                            result = future.result()
+                        except RetryLaterException as e:
+                            submit(
+                                stage,
+                                token,
+                                mission,
+                                function,
+                                args,
+                                attempt + 1,
+                                e.delay,
+                            )
+                            continue
+
+                        if stage == TEXT_STAGE:
+                            if result is None or not history.reserve(token, result):
+                                if result is not None:
+                                    logging.info(
+                                        "Discarding duplicate mission draft: %s",
+                                        result.get("mission_title"),
+                                    )
+                                rejected_drafts += 1
+                                if rejected_drafts == max_rejected_drafts:
+                                    logging.warning(
+                                        "%s mission drafts failed or were duplicates, "
+                                        "stopping this refill",
+                                        rejected_drafts,
+                                    )
+                                continue
+                            if "translation" not in result:
+                                submit(
+                                    TRANSLATION_STAGE,
+                                    token,
+                                    None,
+                                    _translation_stage,
+                                    (result,),
+                                )
+                                continue
+
+                        if stage in (TEXT_STAGE, TRANSLATION_STAGE):
+                            new_mission = None
+                            if result is not None:
+                                new_mission = add_mission(result, session)
+                            history.release(token, new_mission)
+                            if new_mission is None:
+                                continue
+                            # The synthesized chunks are kept between rescheduled attempts
+                            submit(
+                                AUDIO_STAGE,
+                                token,
+                                new_mission,
+                                create_mission_audio,
+                                (new_mission, {}),
+                            )
+
+                        elif not result:
+                            logging.error(
+                                "Failed to create the audio file after retries. Deleting the mission entry."
+                            )
+                            print(
+                                "Failed to create the audio file after retries. Deleting the mission entry."
+                            )
+                            delete_mission(mission.get("id"), session)
+                        else:
+                            logging.info("Audio file created successfully.")
+                            print("Audio file created successfully.")
+            finally:
+                scheduler.close()
     finally:
         session.close()
 
@@ -0,0 +1,298 @@
+"""
+This module contains the ready queue serving /mission from pre-rendered payloads.
+
+Every worker process claims the next few unrequested missions ahead of time,
+in a single statement from a background thread, and keeps them as pre-rendered
+JSON payloads. A /mission request only pops the next payload, so serving a
+queued mission does not touch the database, after which the background thread
+tops the queue up again. Claimed missions are no longer counted as unrequested,
+so the buffer state and its reconciliation stay in line with the database.
+The queued missions are returned to the buffer when the process exits; a worker
+that is killed loses at most MISSION_READY_QUEUE_SIZE missions.
+"""
+import os
+import json
+import atexit
+import logging
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Dict, List, NamedTuple, Optional, Sequence
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from api.database import (
+    Session,
+    Mission,
+    MissionPup,
+    MISSION_FIELDS,
+    COMPACT_MISSION_FIELDS,
+)
+from api.monitoring import READY_QUEUE_DEPTH
+
+from .buffer_refill import notify_buffer_level
+from .buffer_state import reconcile_buffer_state, record_mission_removed
+
+# pylint: disable=singleton-comparison
+
+_lock = Lock()
+_top_up_lock = Lock()
+_ready: deque = deque()
+_released = False
+_top_up_requested = Event()
+_top_up_thread: Optional[Thread] = None
+
+
+class ReadyMission(NamedTuple):
+    """
+    A claimed mission and its pre-rendered /mission response body.
+    """
+
+    mission: Dict
+    payload: bytes
+
+
+def parse_mission_fields(fields: Optional[str] = None, compact: bool = False):
+    """
+    Parse the fields requested from the /mission endpoint.
+
+    Args:
+        fields (str, optional): A comma-separated list of mission fields.
+        compact (bool): Whether to return only the COMPACT_MISSION_FIELDS.
+            Ignored when fields are given.
+
+    Returns:
+        tuple: The requested fields, or None for all fields.
+
+    Raises:
+        ValueError: If a field is not a mission field.
+    """
+    if not fields:
+        return COMPACT_MISSION_FIELDS if compact else None
+
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",")))
+    unknown = [field for field in requested if field not in MISSION_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {', '.join(unknown)}, expected any of {', '.join(MISSION_FIELDS)}"
+        )
+    return requested
+
+
+def get_ready_queue_size() -> int:
+    """
+    Gets the number of missions each worker keeps ready.
+
+    Returns:
+        int: The MISSION_READY_QUEUE_SIZE environment variable, defaults to 2.
+            0 disables the queue.
+    """
+    return int(os.getenv("MISSION_READY_QUEUE_SIZE", "2"))
+
+
+def render_mission(mission: Optional[Dict]) -> bytes:
+    """
+    Renders a mission as the JSON response body of /mission.
+
+    The output is identical to flask.jsonify with the default settings.
+
+    Args:
+        mission (dict): The mission data, or None.
+
+    Returns:
+        bytes: The JSON document followed by a newline.
+    """
+    return (json.dumps(mission, sort_keys=True, separators=(",", ":")) + "\n").encode(
+        "utf-8"
+    )
+
+
+def _load_involved_pups(session, mission_ids: List[int]) -> Dict[int, str]:
+    involved_pups = {mission_id: [] for mission_id in mission_ids}
+    rows = session.execute(
+        select(MissionPup.mission_id, MissionPup.pup)
+        .where(MissionPup.mission_id.in_(mission_ids))
+        .order_by(MissionPup.mission_id, MissionPup.position)
+    )
+    for mission_id, pup in rows:
+        involved_pups[mission_id].append(pup)
+    return {mission_id: ",".join(pups) for mission_id, pups in involved_pups.items()}
+
+
+def claim_missions(limit: int, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    Claims the next unrequested missions in a single UPDATE ... RETURNING statement.
+
+    Only the columns of the requested fields are read, so a compact claim
+    never loads the mission scripts.
+
+    Args:
+        limit (int): The maximum number of missions to claim.
+        fields (Sequence[str], optional): The fields to return, defaults to
+            all of MISSION_FIELDS.
+
+    Returns:
+        list: The claimed mission data, oldest first.
+    """
+    fields = fields or MISSION_FIELDS
+    columns = [
+        getattr(Mission, field)
+        for field in fields
+        if field not in ("id", "involved_pups")
+    ]
+    session = Session()
+    try:
+        next_unrequested_ids = (
+            select(Mission.id)
+            .where(Mission.is_requested == False)
+            .order_by(Mission.id.asc())
+            .limit(limit)
+        )
+        claim_statement = (
+            update(Mission)
+            .where(Mission.id.in_(next_unrequested_ids), Mission.is_requested == False)
+            .values(is_requested=True)
+            .returning(Mission.id, *columns)
+        )
+        rows = sorted(
+            session.execute(claim_statement).mappings(), key=lambda row: row["id"]
+        )
+        involved_pups = {}
+        if rows and "involved_pups" in fields:
+            involved_pups = _load_involved_pups(session, [row["id"] for row in rows])
+        session.commit()
+        missions = [
+            {
+                field: involved_pups[row["id"]]
+                if field == "involved_pups"
+                else row[field]
+                for field in fields
+            }
+            for row in rows
+        ]
+
+        if missions:
+            unrequested_count = record_mission_removed(session, len(missions))
+        else:
+            unrequested_count = reconcile_buffer_state(session)
+        notify_buffer_level(unrequested_count)
+        return missions
+    finally:
+        session.close()
+
+
+def _top_up_ready_queue():
+    with _top_up_lock:
+        with _lock:
+            missing = get_ready_queue_size() - len(_ready)
+        if _released or missing <= 0:
+            return
+
+        ready = [
+            ReadyMission(mission, render_mission(mission))
+            for mission in claim_missions(missing)
+        ]
+        with _lock:
+            _ready.extend(ready)
+
+
+def _run_top_up():
+    poll_interval = float(os.getenv("MISSION_BUFFER_POLL_SECONDS", "5"))
+    while True:
+        _top_up_requested.wait(poll_interval)
+        _top_up_requested.clear()
+        try:
+            _top_up_ready_queue()
+        except SQLAlchemyError as e:
+            logging.error("Failed to top up the mission ready queue: %s", e)
+
+
+def _request_top_up():
+    global _top_up_thread  # pylint: disable=global-statement
+    with _lock:
+        if _top_up_thread is None:
+            _top_up_thread = Thread(
+                target=_run_top_up, name="mission-ready-queue", daemon=True
+            )
+            _top_up_thread.start()
+            atexit.register(release_ready_missions)
+    _top_up_requested.set()
+
+
+def claim_ready_mission(
+    fields: Optional[Sequence[str]] = None,
+) -> Optional[ReadyMission]:
+    """
+    Claims the next mission, from the ready queue if it holds one.
+
+    Falls back to claiming a mission from the database when the queue is empty
+    or disabled, loading only the requested fields.
+
+    Args:
+        fields (Sequence[str], optional): The fields to return, defaults to
+            all of MISSION_FIELDS.
+
+    Returns:
+        ReadyMission: The claimed mission and its response body, or None if
+            there are no unrequested missions.
+    """
+    with _lock:
+        ready_mission = _ready.popleft() if _ready else None
+    if ready_mission is not None and fields:
+        mission = {field: ready_mission.mission[field] for field in fields}
+        ready_mission = ReadyMission(mission, render_mission(mission))
+
+    if ready_mission is None:
+        missions = claim_missions(1, fields)
+        if missions:
+            ready_mission = ReadyMission(missions[0], render_mission(missions[0]))
+
+    if get_ready_queue_size() > 0:
+        _request_top_up()
+    return ready_mission
+
+
+def discard_ready_mission(mission_id: int):
+    """
+    Removes a mission from the ready queue of this process, e.g. after it was deleted.
+
+    Args:
+        mission_id (int): The ID of the mission.
+    """
+    with _lock:
+        for ready_mission in list(_ready):
+            if ready_mission.mission["id"] == mission_id:
+                _ready.remove(ready_mission)
+
+
+def release_ready_missions():
+    """
+    Returns the missions in the ready queue of this process to the buffer, e.g. on shutdown.
+
+    The queue is not topped up again afterwards.
+    """
+    global _released  # pylint: disable=global-statement
+    with _top_up_lock:
+        _released = True
+        with _lock:
+            mission_ids = [ready_mission.mission["id"] for ready_mission in _ready]
+            _ready.clear()
+    if not mission_ids:
+        return
+
+    session = Session()
+    try:
+        session.execute(
+            update(Mission)
+            .where(Mission.id.in_(mission_ids), Mission.is_requested == True)
+            .values(is_requested=False)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    except SQLAlchemyError as e:
+        logging.error("Failed to release the mission ready queue: %s", e)
+    finally:
+        session.close()
+
+
+READY_QUEUE_DEPTH.set_function(lambda: len(_ready))
+
+# pylint: enable=singleton-comparison
@@ -0,0 +1,362 @@
+"""
+This module contains the local similarity index of the stored missions.
+
+Every mission is reduced to a MinHash signature of the word shingles of its
+title, location and script. Signatures are bucketed by band (locality
+sensitive hashing), so a new mission draft is only compared with the stored
+missions that share a band with it. Drafts whose estimated Jaccard similarity
+with a stored mission reaches MISSION_SIMILARITY_THRESHOLD are rejected right
+after the chat call that wrote them, before translation and TTS.
+
+The index also keeps the locations and pups of the most recent missions, to
+tell the model which ones were used most often lately.
+
+The index holds the MISSION_SIMILARITY_INDEX_SIZE most recent missions, so
+loading it and computing their signatures takes bounded time however many
+missions are stored. It is loaded from the database on first use, kept up to
+date as this process adds and deletes missions, and picks up the missions
+stored by other processes every time it is fetched.
+"""
+import os
+import re
+import random
+import hashlib
+from collections import Counter, deque
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import load_only
+from api.database import Mission
+
+# Number of hash functions in a signature, in bands of rows
+SIGNATURE_BANDS = 32
+SIGNATURE_ROWS = 2
+SIGNATURE_SIZE = SIGNATURE_BANDS * SIGNATURE_ROWS
+
+# Number of consecutive words in a shingle
+SHINGLE_SIZE = 2
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_HASH_PARAMETERS = [
+    (generator.randrange(1, _MERSENNE_PRIME), generator.randrange(_MERSENNE_PRIME))
+    for generator in [random.Random(2024)]
+    for _ in range(SIGNATURE_SIZE)
+]
+
+STOPWORDS = frozenset(
+    """
+    a about after all also an and any are around as at be been before but by can
+    could do does for from get go going got has have he her here him his how i if
+    in into is it its just let lets like make may me more must my need needs no
+    not now of off on once one only or our out over own so some that the their
+    them then there these they this those through to too up us very was we were
+    what when where which while who will with would you your
+    """.split()
+)
+
+# The fields a signature and the avoid summary are computed from
+INDEXED_FIELDS = (
+    "id",
+    "mission_title",
+    "main_location",
+    "mission_script",
+    "involved_pups",
+)
+
+_lock = Lock()
+_index: Optional["MissionSimilarityIndex"] = None
+
+
+def get_similarity_threshold() -> float:
+    """
+    Get the similarity above which a mission draft is a near-duplicate.
+
+    Returns:
+        float: The MISSION_SIMILARITY_THRESHOLD environment variable, 0 disables the check.
+    """
+    return float(os.getenv("MISSION_SIMILARITY_THRESHOLD", "0.35"))
+
+
+def _shingles(text: str) -> set:
+    words = [
+        word
+        for word in re.findall(r"[^\W\d_]+", text.lower())
+        if len(word) > 2 and word not in STOPWORDS
+    ]
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {
+        " ".join(words[start : start + SHINGLE_SIZE])
+        for start in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def mission_signature(mission_data: Dict) -> Optional[Tuple[int, ...]]:
+    """
+    Compute the MinHash signature of a mission.
+
+    Args:
+        mission_data (dict): The mission, with a title, location and script.
+
+    Returns:
+        tuple: The signature, or None if the mission has no words to compare.
+    """
+    text = " ".join(
+        str(mission_data.get(key) or "")
+        for key in ("mission_title", "main_location", "mission_script")
+    )
+    hashes = [
+        int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for shingle in _shingles(text)
+    ]
+    if not hashes:
+        return None
+    return tuple(
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+        for a, b in _HASH_PARAMETERS
+    )
+
+
+def _pup_names(involved_pups) -> List[str]:
+    if isinstance(involved_pups, str):
+        involved_pups = involved_pups.split(",")
+    return [str(pup).strip() for pup in involved_pups or [] if str(pup).strip()]
+
+
+class MissionSimilarityIndex:
+    """
+    MinHash index of mission signatures with a summary of the recent missions.
+
+    The index is thread-safe, as the drafts of the mission pipeline are
+    checked by the pipeline workers while missions are added. With a max_size,
+    the oldest missions are dropped from the index as new ones are added.
+    """
+
+    def __init__(self, recent_size: int = 20, max_size: int = None):
+        self._lock = Lock()
+        self._signatures: Dict[int, Tuple[int, ...]] = {}
+        self._titles: Dict[int, str] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self._recent: deque = deque(maxlen=recent_size)
+        self._order: deque = deque()
+        self._max_size = max_size
+        self.last_id = 0
+
+    def __len__(self):
+        return len(self._signatures)
+
+    @staticmethod
+    def _bands(signature: Tuple[int, ...]):
+        for band in range(SIGNATURE_BANDS):
+            start = band * SIGNATURE_ROWS
+            yield band, signature[start : start + SIGNATURE_ROWS]
+
+    def add(self, mission: Dict):
+        """
+        Add a stored mission to the index.
+
+        Args:
+            mission (dict): The mission data, including its id.
+        """
+        signature = mission_signature(mission)
+        with self._lock:
+            if mission["id"] in self._signatures:
+                return
+            # Drafts of a bulk generation run are indexed by their custom ID
+            if isinstance(mission["id"], int):
+                self.last_id = max(self.last_id, mission["id"])
+            self._recent.append(
+                (
+                    mission["id"],
+                    mission.get("main_location"),
+                    _pup_names(mission.get("involved_pups")),
+                )
+            )
+            if signature is None:
+                return
+            self._signatures[mission["id"]] = signature
+            self._titles[mission["id"]] = mission.get("mission_title")
+            self._order.append(mission["id"])
+            for band in self._bands(signature):
+                self._buckets.setdefault(band, set()).add(mission["id"])
+            while self._max_size and len(self._signatures) > self._max_size:
+                self._drop(self._order.popleft())
+
+    def remove(self, mission_id: int):
+        """
+        Remove a deleted mission from the index.
+
+        Args:
+            mission_id (int): The ID of the mission.
+        """
+        with self._lock:
+            self._recent = deque(
+                (entry for entry in self._recent if entry[0] != mission_id),
+                maxlen=self._recent.maxlen,
+            )
+            self._drop(mission_id)
+
+    def _drop(self, mission_id: int):
+        signature = self._signatures.pop(mission_id, None)
+        self._titles.pop(mission_id, None)
+        if signature is None:
+            return
+        for band in self._bands(signature):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(mission_id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def find_duplicate(
+        self, mission_data: Dict, threshold: float = None
+    ) -> Optional[Tuple[int, str, float]]:
+        """
+        Find the stored mission most similar to a mission draft, if it is a near-duplicate.
+
+        Args:
+            mission_data (dict): The mission draft.
+            threshold (float, optional): The minimum estimated Jaccard similarity.
+                Defaults to get_similarity_threshold().
+
+        Returns:
+            tuple: The ID, title and similarity of the stored mission, or None
+                if the draft is not a near-duplicate.
+        """
+        if threshold is None:
+            threshold = get_similarity_threshold()
+        if threshold <= 0:
+            return None
+        signature = mission_signature(mission_data)
+        if signature is None:
+            return None
+
+        best = None
+        with self._lock:
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self._buckets.get(band, set())
+            for mission_id in candidates:
+                other = self._signatures[mission_id]
+                similarity = (
+                    sum(1 for mine, theirs in zip(signature, other) if mine == theirs)
+                    / SIGNATURE_SIZE
+                )
+                if similarity >= threshold and (best is None or similarity > best[2]):
+                    best = (mission_id, self._titles[mission_id], similarity)
+        return best
+
+    def avoid_summary(self, limit: int = 3) -> Dict[str, List[str]]:
+        """
+        Summarize the locations and pups used most often by the recent missions.
+
+        Args:
+            limit (int): The maximum number of locations and of pups. Defaults to 3.
+
+        Returns:
+            dict: The "locations" and "pups" used more than once, most common first.
+        """
+        with self._lock:
+            recent = list(self._recent)
+        locations, spellings, pups = Counter(), {}, Counter()
+        for _, location, names in recent:
+            if location:
+                key = str(location).strip().lower()
+                locations[key] += 1
+                spellings[key] = location
+            pups.update(names)
+        return {
+            "locations": [
+                spellings[key] for key, uses in locations.most_common(limit) if uses > 1
+            ],
+            "pups": [pup for pup, uses in pups.most_common(limit) if uses > 1],
+        }
+
+
+def get_similarity_index_size() -> int:
+    """
+    Get the number of recent missions kept in the similarity index.
+
+    Returns:
+        int: The MISSION_SIMILARITY_INDEX_SIZE environment variable, defaults to 500.
+    """
+    return int(os.getenv("MISSION_SIMILARITY_INDEX_SIZE", "500"))
+
+
+def _load_missions(session, index: MissionSimilarityIndex):
+    """
+    Add the most recent missions stored after the newest mission of the index.
+    """
+    missions = (
+        session.query(Mission)
+        .options(
+            load_only(
+                Mission.id,
+                Mission.mission_title,
+                Mission.main_location,
+                Mission.mission_script,
+            )
+        )
+        .filter(Mission.id > index.last_id)
+        .order_by(Mission.id.desc())
+        .limit(get_similarity_index_size())
+        .all()
+    )
+    for mission in reversed(missions):
+        index.add(mission.to_dict(INDEXED_FIELDS))
+
+
+def get_similarity_index(session) -> MissionSimilarityIndex:
+    """
+    Get the similarity index of this process, loading the recent missions on first use.
+
+    Missions stored by other processes since the last call are added, so the
+    index also covers the missions of bulk generation runs and other workers.
+    The signatures are computed outside the lock of the shared index.
+
+    Args:
+        session (Session): The database session used to load the missions.
+
+    Returns:
+        MissionSimilarityIndex: The shared index.
+    """
+    global _index  # pylint: disable=global-statement
+    with _lock:
+        index = _index
+    if index is None:
+        index = MissionSimilarityIndex(
+            int(os.getenv("MISSION_AVOID_RECENT_COUNT", "20")),
+            get_similarity_index_size(),
+        )
+    _load_missions(session, index)
+    with _lock:
+        if _index is None:
+            _index = index
+        return _index
+
+
+def index_mission(mission: Dict):
+    """
+    Add a stored mission to the similarity index, if it has been loaded.
+
+    Args:
+        mission (dict): The stored mission data.
+    """
+    with _lock:
+        index = _index
+    if index is not None:
+        index.add(mission)
+
+
+def remove_indexed_mission(mission_id: int):
+    """
+    Remove a deleted mission from the similarity index, if it has been loaded.
+
+    Args:
+        mission_id (int): The ID of the mission.
+    """
+    with _lock:
+        index = _index
+    if index is not None:
+        index.remove(mission_id)
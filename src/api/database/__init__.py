@@ -2,7 +2,8 @@
 This module provides the database functionality for the Paw Patrol Tower API.
 
 The `Session` class represents a session in the database,
-while the `Mission` class represents a mission.
+while the `Mission` class represents a mission and the `MissionPup`
+class a pup involved in a mission.
 
 Usage:
     from api.database import Session, Mission
@@ -14,7 +15,24 @@ Usage:
     mission = Mission()
 
     # Perform database operations using the session and mission objects
+
+The database engine is created, and the schema migrated, when the first
+session is opened or get_engine() is called.
 """
-from .models import Session, Mission
+from .models import (
+    get_engine,
+    Session,
+    Mission,
+    MissionPup,
+    MISSION_FIELDS,
+    COMPACT_MISSION_FIELDS,
+)
 
-__all__ = ["Session", "Mission"]
+__all__ = [
+    "get_engine",
+    "Session",
+    "Mission",
+    "MissionPup",
+    "MISSION_FIELDS",
+    "COMPACT_MISSION_FIELDS",
+]
@@ -0,0 +1,104 @@
+"""
+This module contains the lightweight schema migrations for existing databases.
+
+The schema version is stored in the SQLite user_version pragma. New databases
+are created from the models at the latest version, existing databases run the
+migrations after their version in order. Migrations run under a file lock on
+the database volume, so gunicorn workers starting at the same time do not
+create or migrate the schema concurrently.
+"""
+import os
+import logging
+from contextlib import contextmanager
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is not available on Windows
+    fcntl = None
+
+
+def _create_mission_indexes(connection, metadata):
+    for index in metadata.tables["missions"].indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _normalize_involved_pups(connection, metadata):
+    # Also creates the indexes of the table
+    metadata.tables["mission_pups"].create(connection, checkfirst=True)
+
+    columns = {column["name"] for column in inspect(connection).get_columns("missions")}
+    if "involved_pups" not in columns:
+        return
+
+    rows = connection.execute(text("SELECT id, involved_pups FROM missions")).all()
+    pups = [
+        {"mission_id": mission_id, "position": position, "pup": pup.strip()}
+        for mission_id, involved_pups in rows
+        for position, pup in enumerate((involved_pups or "").split(","))
+        if pup.strip()
+    ]
+    if pups:
+        connection.execute(
+            text(
+                "INSERT OR IGNORE INTO mission_pups (mission_id, position, pup) "
+                "VALUES (:mission_id, :position, :pup)"
+            ),
+            pups,
+        )
+
+    try:
+        connection.execute(text("ALTER TABLE missions DROP COLUMN involved_pups"))
+    except OperationalError as e:
+        # SQLite before 3.35 cannot drop columns, the column is no longer used
+        logging.warning("Kept the unused involved_pups column: %s", e)
+
+
+# The migrations in order, the schema version after a migration is its position + 1
+MIGRATIONS = [
+    _create_mission_indexes,
+    _normalize_involved_pups,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+@contextmanager
+def _schema_lock(directory_path: str):
+    if fcntl is None:
+        yield
+        return
+
+    with open(
+        os.path.join(directory_path, "schema.lock"), "a", encoding="utf-8"
+    ) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate_database(engine, metadata, directory_path: str):
+    """
+    Creates the database schema or migrates an existing database to the latest version.
+
+    Args:
+        engine (Engine): The database engine.
+        metadata (MetaData): The metadata of the models.
+        directory_path (str): The directory of the database, used for the lock file.
+    """
+    with _schema_lock(directory_path), engine.begin() as connection:
+        version = connection.execute(text("PRAGMA user_version")).scalar()
+        if not inspect(connection).has_table("missions"):
+            metadata.create_all(connection)
+            version = LATEST_VERSION
+        else:
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logging.info("Migrating database to schema version %s", number)
+                migration(connection, metadata)
+                version = number
+        # Also creates tables added to the models without a migration
+        metadata.create_all(connection)
+        connection.execute(text(f"PRAGMA user_version = {version}"))
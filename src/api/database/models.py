@@ -2,20 +2,144 @@
 This module provides the model functionality for the Paw Patrol Tower API.
 """
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean
+from threading import Lock
+from sqlalchemy import (
+    create_engine,
+    event,
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    Boolean,
+    Index,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session as OrmSession, relationship, sessionmaker
+from .migrations import migrate_database
 
 directory_path = os.getenv("DATABASE_DIRECTORY_PATH", "/data/database")
-os.makedirs(directory_path, exist_ok=True)
 
 database_name = os.getenv("DATABASE_NAME", "mission_database.db")
 
-# Create an engine that stores data in the specified path
-engine = create_engine(f"sqlite:///{directory_path}/{database_name}")
+# Supported values for the DATABASE_ENGINE_PROFILE environment variable
+DEFAULT_ENGINE_PROFILE = "default"  # SQLAlchemy and SQLite defaults
+CONCURRENT_ENGINE_PROFILE = "concurrent"  # WAL and pragmas for concurrent access
+
+
+def get_sqlite_pragmas():
+    """
+    Get the SQLite pragmas applied to every connection in the concurrent profile.
+
+    Returns:
+        dict: The pragma values keyed by pragma name.
+    """
+    return {
+        # Readers no longer block the writer, and the writer no longer blocks readers
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        # Safe in WAL mode, only the last transactions can be lost on power loss
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        # Wait for locks instead of failing with "database is locked"
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+        # Negative values are in KiB
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-8192")),
+        "foreign_keys": "ON",
+    }
+
+
+def create_database_engine(url: str, profile: str = CONCURRENT_ENGINE_PROFILE):
+    """
+    Create the database engine for the given engine profile.
+
+    Args:
+        url (str): The database URL.
+        profile (str): The engine profile, DEFAULT_ENGINE_PROFILE or
+            CONCURRENT_ENGINE_PROFILE. Defaults to CONCURRENT_ENGINE_PROFILE.
+
+    Returns:
+        Engine: The database engine.
+    """
+    if profile == DEFAULT_ENGINE_PROFILE:
+        return create_engine(url)
+
+    pragmas = get_sqlite_pragmas()
+    database_engine = create_engine(
+        url,
+        connect_args={
+            # Connections are pooled and shared by the request and maintenance threads
+            "check_same_thread": False,
+            "timeout": pragmas["busy_timeout"] / 1000,
+        },
+        pool_size=int(os.getenv("DATABASE_POOL_SIZE", "8")),
+        max_overflow=int(os.getenv("DATABASE_POOL_MAX_OVERFLOW", "8")),
+        pool_timeout=float(os.getenv("DATABASE_POOL_TIMEOUT", "30")),
+    )
+
+    @event.listens_for(database_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return database_engine
+
+
+_engine = None
+_engine_lock = Lock()
+
+
+def get_engine():
+    """
+    Get the database engine, creating it and migrating the database on first use.
+
+    The engine is created lazily so that importing the models, e.g. while the
+    app starts, neither opens the database nor runs the schema migrations.
+
+    Returns:
+        Engine: The engine that stores data in the configured database file.
+    """
+    global _engine  # pylint: disable=global-statement
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                os.makedirs(directory_path, exist_ok=True)
+                database_engine = create_database_engine(
+                    f"sqlite:///{directory_path}/{database_name}",
+                    os.getenv(
+                        "DATABASE_ENGINE_PROFILE", CONCURRENT_ENGINE_PROFILE
+                    ).lower(),
+                )
+                # Create all tables in the engine and migrate existing databases
+                migrate_database(database_engine, Base.metadata, directory_path)
+                _engine = database_engine
+    return _engine
+
+
+def __getattr__(name):
+    # The engine used to be created at import time as models.engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 Base = declarative_base()
 
+# The fields of a mission, in the order of Mission.to_dict()
+MISSION_FIELDS = (
+    "id",
+    "mission_title",
+    "involved_pups",
+    "main_location",
+    "mission_script",
+    "translation",
+    "is_requested",
+)
+# The fields the tower needs to announce a mission and fetch its audio
+COMPACT_MISSION_FIELDS = ("id", "mission_title")
+
 
 class Mission(Base):
     """
@@ -24,7 +148,9 @@ class Mission(Base):
     Attributes:
         id (int): The unique identifier of the mission.
         mission_title (str): The title of the mission.
-        involved_pups (str): The pups involved in the mission, stored as a comma-separated string.
+        involved_pups (str): The pups involved in the mission as a comma-separated string,
+            stored as MissionPup rows.
+        pups (list): The MissionPup rows of the mission, in order.
         main_location (str): The main location of the mission.
         mission_script (str): The script of the mission.
         translation (str): The translation of the mission.
@@ -36,40 +162,94 @@ class Mission(Base):
     """
 
     __tablename__ = "missions"
+    __table_args__ = (
+        # Partial index covering only the missions that can still be claimed
+        Index(
+            "ix_missions_unrequested",
+            "id",
+            sqlite_where=text("is_requested = 0"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
-    mission_title = Column(String)
-    involved_pups = Column(String)
+    mission_title = Column(String, index=True)
     main_location = Column(String)
     mission_script = Column(Text)
     translation = Column(Text)
     is_requested = Column(Boolean, default=False)
+    pups = relationship(
+        "MissionPup",
+        order_by="MissionPup.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+    @property
+    def involved_pups(self):
+        """
+        str: The pups involved in the mission as a comma-separated string.
+        """
+        return ",".join(pup.pup for pup in self.pups)
+
+    @involved_pups.setter
+    def involved_pups(self, involved_pups):
+        if isinstance(involved_pups, str):
+            involved_pups = involved_pups.split(",")
+        self.pups = [
+            MissionPup(pup=pup.strip(), position=position)
+            for position, pup in enumerate(involved_pups or [])
+            if pup and pup.strip()
+        ]
 
     def __repr__(self):
         return (
             f"<Mission(title='{self.mission_title}', location='{self.main_location}')>"
         )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         """
         Convert the object to a dictionary representation.
 
+        Args:
+            fields (Sequence[str], optional): The fields to include, defaults to
+                all of MISSION_FIELDS.
+
         Returns:
             dict: A dictionary containing the object's attributes.
         """
-        return {
-            "id": self.id,
-            "mission_title": self.mission_title,
-            "involved_pups": self.involved_pups,
-            "main_location": self.main_location,
-            "mission_script": self.mission_script,
-            "translation": self.translation,
-            "is_requested": self.is_requested,
-        }
+        return {field: getattr(self, field) for field in fields or MISSION_FIELDS}
+
+
+class MissionPup(Base):
+    """
+    Represents a pup involved in a mission.
+
+    Attributes:
+        mission_id (int): The ID of the mission.
+        position (int): The position of the pup in the mission's list of pups.
+        pup (str): The name of the pup.
+    """
+
+    __tablename__ = "mission_pups"
+
+    mission_id = Column(
+        Integer, ForeignKey("missions.id", ondelete="CASCADE"), primary_key=True
+    )
+    position = Column(Integer, primary_key=True)
+    pup = Column(String, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<MissionPup(mission_id={self.mission_id}, pup='{self.pup}')>"
+
+
+class LazyEngineSession(OrmSession):
+    """
+    Session that is bound to the database engine when it is first created.
+    """
 
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or get_engine(), **kwargs)
 
-# Create all tables in the engine
-Base.metadata.create_all(engine)
 
 # Create a configured "Session" class
-Session: sessionmaker = sessionmaker(bind=engine)
+Session: sessionmaker = sessionmaker(class_=LazyEngineSession)
@@ -1,7 +1,46 @@
 """
 This module contains generators for missions and audio files.
 """
-from .mission_generator import generate_new_mission_data
-from .audio_generator import create_audio_file
+from .mission_generator import (
+    generate_new_mission_data,
+    generate_mission_draft,
+    generate_single_pass_mission,
+    add_mission_translation,
+    create_mission_chat_app,
+    get_mission_chat_options,
+    build_mission_chat_request,
+    build_mission_messages,
+    build_translation_messages,
+    get_generation_mode,
+    get_mission_variation,
+    MULTI_PASS_MODE,
+    SINGLE_PASS_MODE,
+)
+from .audio_generator import (
+    AudioFormat,
+    ConversionException,
+    create_audio_file,
+    create_audio_variant,
+    parse_audio_format,
+)
 
-__all__ = ["generate_new_mission_data", "create_audio_file"]
+__all__ = [
+    "generate_new_mission_data",
+    "generate_mission_draft",
+    "generate_single_pass_mission",
+    "add_mission_translation",
+    "create_mission_chat_app",
+    "get_mission_chat_options",
+    "build_mission_chat_request",
+    "build_mission_messages",
+    "build_translation_messages",
+    "get_generation_mode",
+    "get_mission_variation",
+    "MULTI_PASS_MODE",
+    "SINGLE_PASS_MODE",
+    "AudioFormat",
+    "ConversionException",
+    "create_audio_file",
+    "create_audio_variant",
+    "parse_audio_format",
+]
@@ -0,0 +1,196 @@
+"""
+This module contains a content-addressed cache for generated audio files.
+
+Audio is cached by a hash of the script, the TTS voice and model and the
+output format, so regenerating a mission with a script that was already
+spoken reuses the existing audio instead of calling the TTS model again.
+"""
+import os
+import hashlib
+import logging
+import shutil
+import threading
+import time
+from typing import Optional
+from api.openai_integration import TTS_MODEL
+
+_eviction_lock = threading.Lock()
+
+
+def get_cache_directory() -> Optional[str]:
+    """
+    Gets the audio cache directory, creating it if it does not yet exist.
+
+    Returns:
+        Optional[str]: The path of the cache directory, or None if the cache is
+            disabled by setting TTS_CACHE_MAX_BYTES to 0.
+    """
+    if get_cache_max_bytes() <= 0:
+        return None
+    path = os.path.join(os.getenv("AUDIO_DIRECTORY_PATH", "/data/audio"), "cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_cache_max_bytes() -> int:
+    """
+    Gets the maximum size of the audio cache from the TTS_CACHE_MAX_BYTES environment variable.
+
+    Returns:
+        int: The maximum size in bytes. Defaults to 500 MB.
+    """
+    return int(os.getenv("TTS_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+
+def get_variant_cache_max_bytes() -> int:
+    """
+    Gets the maximum size of the audio variant cache from the
+    AUDIO_VARIANT_CACHE_MAX_BYTES environment variable.
+
+    Returns:
+        int: The maximum size in bytes. Defaults to 200 MB.
+    """
+    return int(os.getenv("AUDIO_VARIANT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def touch_cached_file(path: str):
+    """
+    Marks a cache entry as recently used for the LRU eviction.
+
+    Only the access time is updated, as the modification time is shared with
+    the linked mission files and is part of their ETag.
+
+    Args:
+        path (str): The path of the cache entry.
+
+    Raises:
+        OSError: If the entry does not exist.
+    """
+    os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+
+
+def audio_cache_key(script: str, output_format: str) -> str:
+    """
+    Builds the cache key for an audio file.
+
+    Args:
+        script (str): The script converted to audio.
+        output_format (str): A description of the audio file format.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest identifying the audio.
+    """
+    digest = hashlib.sha256()
+    for part in (script, os.getenv("TTS_VOICE", "nova"), TTS_MODEL, output_format):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def link_file(source: str, destination: str):
+    """
+    Hard-links a file to a destination, replacing it atomically if it exists.
+
+    Falls back to copying the file if hard links are not supported.
+
+    Args:
+        source (str): The path of the existing file.
+        destination (str): The path of the link.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+
+    temporary_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.link"
+    try:
+        os.link(source, temporary_path)
+    except OSError:
+        shutil.copyfile(source, temporary_path)
+    os.replace(temporary_path, destination)
+
+
+def use_cached_audio(cache_key: str, destination: str) -> bool:
+    """
+    Links a cached audio file to the destination if it is in the cache.
+
+    Args:
+        cache_key (str): The cache key of the audio.
+        destination (str): The path the audio file should be available at.
+
+    Returns:
+        bool: True if the cached audio was used, False otherwise.
+    """
+    cache_directory = get_cache_directory()
+    if cache_directory is None:
+        return False
+
+    cached_path = os.path.join(cache_directory, f"{cache_key}.wav")
+    try:
+        link_file(cached_path, destination)
+        touch_cached_file(cached_path)
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logging.warning("Failed to use cached audio file %s: %s", cached_path, e)
+        return False
+
+    logging.info("Reused cached audio file %s for %s", cached_path, destination)
+    return True
+
+
+def store_cached_audio(cache_key: str, source: str):
+    """
+    Adds an audio file to the cache and evicts the least recently used entries
+    if the cache grew beyond its maximum size.
+
+    Args:
+        cache_key (str): The cache key of the audio.
+        source (str): The path of the audio file.
+    """
+    cache_directory = get_cache_directory()
+    if cache_directory is None:
+        return
+
+    try:
+        link_file(source, os.path.join(cache_directory, f"{cache_key}.wav"))
+    except OSError as e:
+        logging.warning("Failed to cache audio file %s: %s", source, e)
+        return
+    evict_cached_audio(cache_directory, get_cache_max_bytes())
+
+
+def evict_cached_audio(cache_directory: str, max_bytes: int):
+    """
+    Deletes the least recently used cache entries until the cache fits in max_bytes.
+
+    Entries are counted by inode: an entry that is hard linked to a mission
+    audio file shares its disk space with the mission, so deleting it would
+    free nothing. Only entries whose inode has no other link count towards
+    max_bytes and are deleted. Files still being written, which are hidden or
+    end in ".link", are skipped.
+
+    Args:
+        cache_directory (str): The path of the cache directory.
+        max_bytes (int): The maximum total size of the cache in bytes.
+    """
+    with _eviction_lock:
+        entries = []
+        for entry in os.scandir(cache_directory):
+            if (
+                entry.is_file()
+                and not entry.name.startswith(".")
+                and not entry.name.endswith(".link")
+            ):
+                entry_stat = entry.stat()
+                if entry_stat.st_nlink > 1:
+                    continue
+                entries.append((entry_stat.st_atime, entry_stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except FileNotFoundError:
+                pass
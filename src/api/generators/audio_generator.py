@@ -4,8 +4,123 @@ This module contains functions for generating audio files.
 import os
 import subprocess
 import logging
+import tempfile
+import threading
 import time
-from api.openai_integration import create_mission_audio, TTSException
+import wave
+from typing import NamedTuple
+from api.monitoring import OPENAI_FAILURES, STAGE_DURATION
+from api.openai_integration import (
+    create_mission_audio,
+    get_rate_limiter,
+    next_retry_delay,
+    stream_mission_audio,
+    MAX_ATTEMPTS,
+    RetryLaterException,
+    TTS_LIMITER,
+    TTSException,
+)
+from .audio_cache import (
+    audio_cache_key,
+    evict_cached_audio,
+    get_variant_cache_max_bytes,
+    store_cached_audio,
+    touch_cached_file,
+    use_cached_audio,
+)
+from .speech_chunks import get_chunk_max_chars, split_script, synthesize_pcm_chunks
+
+# Format of the WAV files served to the towers
+WAV_CODEC = "pcm_s16le"
+WAV_SAMPLE_RATE = 44100
+WAV_CHANNELS = 2
+
+# Format of the raw PCM audio returned by the TTS model
+TTS_PCM_SAMPLE_RATE = 24000
+TTS_PCM_CHANNELS = 1
+TTS_PCM_SAMPLE_WIDTH = 2
+
+# Supported values for the AUDIO_CONVERSION_MODE environment variable
+STREAM_CONVERSION_MODE = "stream"  # Pipe the TTS MP3 stream through ffmpeg
+PCM_CONVERSION_MODE = "pcm"  # Wrap the TTS PCM stream in a WAV header, no ffmpeg
+MP3_CONVERSION_MODE = "mp3"  # Store the TTS MP3 on disk and convert it afterwards
+
+# Sample rates accepted for audio variants
+PCM_SAMPLE_RATES = (8000, 11025, 16000, 22050, 24000, 32000, 44100, 48000)
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Codecs that mission audio variants can be encoded with. The encoders are
+# ffmpeg encoder names keyed by bit depth, the first one being the default.
+AUDIO_CODECS = {
+    "wav": {
+        "encoders": {16: "pcm_s16le", 8: "pcm_u8"},
+        "format": "wav",
+        "extension": "wav",
+        "mimetype": "audio/wav",
+        "sample_rates": PCM_SAMPLE_RATES,
+    },
+    "adpcm": {
+        "encoders": {4: "adpcm_ima_wav"},
+        "format": "wav",
+        "extension": "wav",
+        "mimetype": "audio/wav",
+        "sample_rates": PCM_SAMPLE_RATES,
+    },
+    "mp3": {
+        "encoders": {16: "libmp3lame"},
+        "format": "mp3",
+        "extension": "mp3",
+        "mimetype": "audio/mpeg",
+        "sample_rates": PCM_SAMPLE_RATES,
+        "bitrate": "32k",
+    },
+    "opus": {
+        "encoders": {16: "libopus"},
+        "format": "ogg",
+        "extension": "opus",
+        "mimetype": "audio/ogg",
+        "sample_rates": OPUS_SAMPLE_RATES,
+        "default_sample_rate": 48000,
+        "bitrate": "24k",
+    },
+}
+
+
+# Serializes the conversion of each variant. Variants are spread over a
+# fixed set of locks by their path, so the set does not grow with the files.
+VARIANT_LOCK_STRIPES = 64
+_variant_locks = [threading.Lock() for _ in range(VARIANT_LOCK_STRIPES)]
+
+
+class AudioFormat(NamedTuple):
+    """
+    Represents the format of a mission audio variant.
+
+    Attributes:
+        codec (str): The codec, one of the keys of AUDIO_CODECS.
+        sample_rate (int): The sample rate in Hz.
+        channels (int): The number of audio channels.
+        bit_depth (int): The number of bits per sample.
+    """
+
+    codec: str
+    sample_rate: int
+    channels: int
+    bit_depth: int
+
+    @property
+    def key(self) -> str:
+        """
+        str: A string identifying the format, used in cache file names.
+        """
+        return f"{self.codec}_{self.sample_rate}_{self.channels}_{self.bit_depth}"
+
+    @property
+    def mimetype(self) -> str:
+        """
+        str: The MIME type of audio in this format.
+        """
+        return AUDIO_CODECS[self.codec]["mimetype"]
 
 
 class ConversionException(Exception):
@@ -67,62 +182,445 @@ def convert_mp3_to_wav(path):
     output_file = os.path.splitext(path)[0] + ".wav"
 
     try:
-        command = [
-            "ffmpeg",
-            "-i",
-            path,  # Input file
-            "-acodec",
-            "pcm_s16le",  # Convert to PCM 16-bit little-endian
-            "-ar",
-            "44100",  # Set the sample rate to 44100 Hz
-            "-ac",
-            "2",  # Set number of audio channels to 2
-            output_file,  # Output file
-        ]
-        subprocess.run(command, check=True)
+        command = ["ffmpeg", "-i", path] + _wav_output_arguments() + [output_file]
+        with STAGE_DURATION.time(stage="ffmpeg"):
+            subprocess.run(command, check=True)
         return output_file
     except subprocess.CalledProcessError as e:
         raise ConversionException(f"Error during conversion: {e}") from e
 
 
-def create_audio_file(file_name: str, script: str) -> bool:
+def _wav_output_arguments():
+    return [
+        "-acodec",
+        WAV_CODEC,  # Convert to PCM 16-bit little-endian
+        "-ar",
+        str(WAV_SAMPLE_RATE),  # Set the sample rate to 44100 Hz
+        "-ac",
+        str(WAV_CHANNELS),  # Set number of audio channels to 2
+    ]
+
+
+def _temporary_path_for(path):
+    """
+    Creates an empty temporary file next to the given path.
+
+    Returns:
+        str: The path of the temporary file.
+    """
+    directory, file_name = os.path.split(path)
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        prefix=f".{file_name}.", suffix=".part", dir=directory or "."
+    )
+    os.close(file_descriptor)
+    return temporary_path
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def stream_wav_audio_file(wav_path, text):
+    """
+    Creates a WAV audio file by piping the TTS MP3 stream straight into ffmpeg.
+
+    The WAV file is written to a temporary file that is renamed into place once
+    the conversion succeeded, so a partially written file is never served.
+
+    Args:
+        wav_path (str): The path where the WAV audio file will be saved.
+        text (str): The text to convert to audio.
+
+    Returns:
+        str: The path of the created WAV audio file.
+
+    Raises:
+        TTSException: If failed to receive the audio from the TTS model.
+        ConversionException: If an error occurs during the conversion.
+    """
+    temporary_path = _temporary_path_for(wav_path)
+    command = (
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "mp3", "-i", "pipe:0"]
+        + _wav_output_arguments()
+        + ["-f", "wav", temporary_path]
+    )
+    try:
+        with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+            try:
+                streamed = stream_mission_audio(process.stdin.write, text)
+            except BrokenPipeError:
+                streamed = None
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            # ffmpeg converts while the audio streams in, this is only the remainder
+            with STAGE_DURATION.time(stage="ffmpeg"):
+                return_code = process.wait()
+
+        if streamed is False:
+            raise TTSException("Failed to stream audio from the TTS model")
+        if streamed is None or return_code != 0:
+            raise ConversionException(
+                f"Error during conversion: ffmpeg exited with status {return_code}"
+            )
+
+        os.replace(temporary_path, wav_path)
+        return wav_path
+    except OSError as e:
+        raise ConversionException(f"Error during conversion: {e}") from e
+    finally:
+        _remove_if_exists(temporary_path)
+
+
+def stream_pcm_wav_audio_file(wav_path, text):
+    """
+    Creates a WAV audio file from the raw PCM output of the TTS model, without ffmpeg.
+
+    The file keeps the TTS model's native format (24 kHz, mono, 16-bit) and is
+    written through a temporary file that is renamed into place on success.
+
+    Args:
+        wav_path (str): The path where the WAV audio file will be saved.
+        text (str): The text to convert to audio.
+
+    Returns:
+        str: The path of the created WAV audio file.
+
+    Raises:
+        TTSException: If failed to receive the audio from the TTS model.
+        ConversionException: If the WAV file could not be written.
+    """
+    temporary_path = _temporary_path_for(wav_path)
+    try:
+        with wave.open(temporary_path, "wb") as wav_file:
+            wav_file.setnchannels(TTS_PCM_CHANNELS)
+            wav_file.setsampwidth(TTS_PCM_SAMPLE_WIDTH)
+            wav_file.setframerate(TTS_PCM_SAMPLE_RATE)
+            streamed = stream_mission_audio(
+                wav_file.writeframesraw, text, response_format="pcm"
+            )
+
+        if not streamed:
+            raise TTSException("Failed to stream audio from the TTS model")
+
+        os.replace(temporary_path, wav_path)
+        return wav_path
+    except (OSError, wave.Error) as e:
+        raise ConversionException(f"Error when writing WAV file: {e}") from e
+    finally:
+        _remove_if_exists(temporary_path)
+
+
+def create_chunked_wav_audio_file(wav_path, chunks, pcm_chunks, convert=True):
+    """
+    Creates a WAV audio file from script chunks that are synthesized in parallel.
+
+    The chunks are requested as raw PCM and joined before they are written, so
+    the result is one gapless stream with a uniform format.
+
+    Args:
+        wav_path (str): The path where the WAV audio file will be saved.
+        chunks (list): The script chunks.
+        pcm_chunks (dict): The chunks synthesized by earlier attempts, keyed by
+            index. Newly synthesized chunks are added to it.
+        convert (bool, optional): Convert the audio to the 44.1 kHz stereo WAV
+            format with ffmpeg. Otherwise the TTS model's native format is kept.
+            Defaults to True.
+
+    Returns:
+        str: The path of the created WAV audio file.
+
+    Raises:
+        TTSException: If any chunk could not be synthesized.
+        ConversionException: If an error occurs during the conversion.
+    """
+    pcm_audio = synthesize_pcm_chunks(chunks, pcm_chunks)
+    temporary_path = _temporary_path_for(wav_path)
+    try:
+        if convert:
+            command = (
+                ["ffmpeg", "-loglevel", "error", "-y", "-f", "s16le"]
+                + ["-ar", str(TTS_PCM_SAMPLE_RATE), "-ac", str(TTS_PCM_CHANNELS)]
+                + ["-i", "pipe:0"]
+                + _wav_output_arguments()
+                + ["-f", "wav", temporary_path]
+            )
+            with STAGE_DURATION.time(stage="ffmpeg"):
+                subprocess.run(command, input=pcm_audio, check=True)
+        else:
+            with wave.open(temporary_path, "wb") as wav_file:
+                wav_file.setnchannels(TTS_PCM_CHANNELS)
+                wav_file.setsampwidth(TTS_PCM_SAMPLE_WIDTH)
+                wav_file.setframerate(TTS_PCM_SAMPLE_RATE)
+                wav_file.writeframes(pcm_audio)
+
+        os.replace(temporary_path, wav_path)
+        return wav_path
+    except (subprocess.CalledProcessError, OSError, wave.Error) as e:
+        raise ConversionException(f"Error during conversion: {e}") from e
+    finally:
+        _remove_if_exists(temporary_path)
+
+
+def get_conversion_mode():
+    """
+    Gets the audio conversion mode from the AUDIO_CONVERSION_MODE environment variable.
+
+    Returns:
+        str: The conversion mode.
+    """
+    return os.getenv("AUDIO_CONVERSION_MODE", STREAM_CONVERSION_MODE).lower()
+
+
+def get_output_format_description():
+    """
+    Describes the format of the WAV files produced in the current conversion mode.
+
+    Returns:
+        str: A description of the sample format, rate and channels.
+    """
+    if get_conversion_mode() == PCM_CONVERSION_MODE:
+        return f"pcm_s16le_{TTS_PCM_SAMPLE_RATE}_{TTS_PCM_CHANNELS}"
+    return f"{WAV_CODEC}_{WAV_SAMPLE_RATE}_{WAV_CHANNELS}"
+
+
+def create_wav_audio_file(path, file_name, script, pcm_chunks=None):
+    """
+    Creates a WAV audio file using the mode set in the AUDIO_CONVERSION_MODE
+    environment variable.
+
+    In the stream and pcm modes, scripts longer than TTS_CHUNK_MAX_CHARS are
+    split into chunks that are synthesized in parallel.
+
+    Args:
+        path (str): The audio directory.
+        file_name (str): The name of the audio file, without extension.
+        script (str): The script to convert to audio.
+        pcm_chunks (dict, optional): The chunks synthesized by earlier attempts,
+            so only failed chunks are requested again. Defaults to None.
+
+    Returns:
+        str: The path of the created WAV audio file.
+
+    Raises:
+        TTSException: If failed to create the audio with the TTS model.
+        ConversionException: If an error occurs during the conversion.
+        ValueError: If the conversion mode is unknown.
+    """
+    mode = get_conversion_mode()
+    wav_path = f"{path}/{file_name}.wav"
+
+    max_chars = get_chunk_max_chars()
+    if mode in (STREAM_CONVERSION_MODE, PCM_CONVERSION_MODE) and (
+        0 < max_chars < len(script)
+    ):
+        return create_chunked_wav_audio_file(
+            wav_path,
+            split_script(script, max_chars),
+            pcm_chunks if pcm_chunks is not None else {},
+            convert=mode == STREAM_CONVERSION_MODE,
+        )
+    if mode == STREAM_CONVERSION_MODE:
+        return stream_wav_audio_file(wav_path, script)
+    if mode == PCM_CONVERSION_MODE:
+        return stream_pcm_wav_audio_file(wav_path, script)
+    if mode == MP3_CONVERSION_MODE:
+        mp3_path = f"{path}/{file_name}.mp3"
+        create_mp3_audio_file(mp3_path, script)
+        wav_path = convert_mp3_to_wav(mp3_path)
+        os.remove(mp3_path)
+        return wav_path
+
+    raise ValueError(f"Unknown audio conversion mode: {mode}")
+
+
+def create_audio_file(
+    file_name: str, script: str, attempt: int = None, pcm_chunks: dict = None
+) -> bool:
     """
     Creates an audio file from the given script.
 
+    Audio previously generated for the same script, voice, model and format is
+    reused from the audio cache instead of calling the TTS model.
+
     Args:
         file_name (str): The name of the audio file.
         script (str): The script to convert to audio.
+        attempt (int, optional): The number of this attempt, from 0, when the caller
+            reschedules retries itself. Defaults to None, retrying in this thread.
+        pcm_chunks (dict, optional): The chunks of a long script synthesized by
+            earlier attempts, kept by the caller between rescheduled attempts.
 
     Returns:
         bool: True if the audio file was successfully created, False otherwise.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the TTS call should
+            be retried after a delay.
     """
-    max_retries = 3
-    retry_delay = 20  # Initial delay in seconds
+    path = create_directory_if_not_yet_exists()
+    cache_key = audio_cache_key(script, get_output_format_description())
+    if use_cached_audio(cache_key, f"{path}/{file_name}.wav"):
+        return True
 
-    for attempt in range(max_retries):
+    # Chunks of long scripts that were synthesized, kept between attempts
+    if pcm_chunks is None:
+        pcm_chunks = {}
+
+    for current in range(attempt or 0, MAX_ATTEMPTS):
         try:
-            path = create_directory_if_not_yet_exists()
-            mp3_path = f"{path}/{file_name}.mp3"
-            create_mp3_audio_file(mp3_path, script)
-            wav_path = convert_mp3_to_wav(mp3_path)
+            wav_path = create_wav_audio_file(path, file_name, script, pcm_chunks)
 
             if wav_path:
-                os.remove(mp3_path)
+                store_cached_audio(cache_key, wav_path)
                 return True
         except TTSException as e:
             logging.error(
-                "Attempt %s: Error when generating audio file: %s", attempt + 1, e
+                "Attempt %s: Error when generating audio file: %s", current + 1, e
+            )
+            delay = next_retry_delay(
+                e, "tts", current, 20, get_rate_limiter(TTS_LIMITER)
             )
-            time.sleep(retry_delay)
-            retry_delay *= 2  # Exponential backoff
+            if delay is None:
+                return False
+            if attempt is not None:
+                raise RetryLaterException(delay) from e
+            time.sleep(delay)
         except ConversionException as e:
             logging.error(
-                "Attempt %s: Error when converting audio file: %s", attempt + 1, e
+                "Attempt %s: Error when converting audio file: %s", current + 1, e
             )
         except ValueError as e:
-            logging.error(
-                "The provided audio file does not have an .mp3 extension: %s", e
-            )
+            logging.error("Invalid audio file configuration: %s", e)
             return False
 
+    # Failed TTS calls return above, so the attempts were used up by conversion errors
+    OPENAI_FAILURES.inc(operation="conversion")
     return False
+
+
+def parse_audio_format(
+    codec: str = None,
+    sample_rate: str = None,
+    channels: str = None,
+    bit_depth: str = None,
+) -> AudioFormat:
+    """
+    Parses and validates a requested audio format.
+
+    Parameters that are not given default to the codec's default bit depth and
+    sample rate, and the channels of the stored WAV files. The default sample
+    rate is the one of the stored WAV files for codecs that support it.
+
+    Args:
+        codec (str, optional): The codec name. Defaults to "wav".
+        sample_rate (str, optional): The sample rate in Hz.
+        channels (str, optional): The number of channels, 1 or 2.
+        bit_depth (str, optional): The number of bits per sample.
+
+    Returns:
+        AudioFormat: The validated audio format.
+
+    Raises:
+        ValueError: If a parameter is invalid or not supported by the codec.
+    """
+    codec = (codec or "wav").lower()
+    if codec not in AUDIO_CODECS:
+        raise ValueError(
+            f"Unsupported codec '{codec}', expected one of: {', '.join(AUDIO_CODECS)}"
+        )
+    codec_settings = AUDIO_CODECS[codec]
+
+    sample_rate = (
+        int(sample_rate)
+        if sample_rate
+        else codec_settings.get("default_sample_rate", WAV_SAMPLE_RATE)
+    )
+    if sample_rate not in codec_settings["sample_rates"]:
+        raise ValueError(f"Unsupported sample rate {sample_rate} for codec '{codec}'")
+
+    channels = int(channels) if channels else WAV_CHANNELS
+    if channels not in (1, 2):
+        raise ValueError(f"Unsupported number of channels {channels}")
+
+    bit_depth = int(bit_depth) if bit_depth else next(iter(codec_settings["encoders"]))
+    if bit_depth not in codec_settings["encoders"]:
+        raise ValueError(f"Unsupported bit depth {bit_depth} for codec '{codec}'")
+
+    return AudioFormat(codec, sample_rate, channels, bit_depth)
+
+
+def create_audio_variant(wav_path: str, audio_format: AudioFormat) -> str:
+    """
+    Gets a mission audio file in the given format, converting it on first use.
+
+    Variants are cached in a "variants" directory next to the WAV file, keyed by
+    the file name and the format, and written atomically through a temporary file.
+    Concurrent requests for the same variant wait for a single conversion. The
+    least recently used variants are evicted once the directory grows beyond
+    AUDIO_VARIANT_CACHE_MAX_BYTES.
+
+    Args:
+        wav_path (str): The path of the stored WAV audio file.
+        audio_format (AudioFormat): The requested audio format.
+
+    Returns:
+        str: The path of the audio variant.
+
+    Raises:
+        ConversionException: If an error occurs during the conversion.
+    """
+    directory, file_name = os.path.split(wav_path)
+    codec_settings = AUDIO_CODECS[audio_format.codec]
+    variant_directory = os.path.join(directory, "variants")
+    variant_path = os.path.join(
+        variant_directory,
+        f"{os.path.splitext(file_name)[0]}.{audio_format.key}.{codec_settings['extension']}",
+    )
+    with _variant_locks[hash(variant_path) % VARIANT_LOCK_STRIPES]:
+        try:
+            touch_cached_file(variant_path)
+            return variant_path
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(variant_directory, exist_ok=True)
+        _convert_audio_variant(wav_path, variant_path, audio_format)
+    evict_cached_audio(variant_directory, get_variant_cache_max_bytes())
+    return variant_path
+
+
+def _convert_audio_variant(wav_path: str, variant_path: str, audio_format: AudioFormat):
+    codec_settings = AUDIO_CODECS[audio_format.codec]
+    temporary_path = _temporary_path_for(variant_path)
+    command = [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        wav_path,
+        "-acodec",
+        codec_settings["encoders"][audio_format.bit_depth],
+        "-ar",
+        str(audio_format.sample_rate),
+        "-ac",
+        str(audio_format.channels),
+    ]
+    if "bitrate" in codec_settings:
+        command += ["-b:a", codec_settings["bitrate"]]
+    command += ["-f", codec_settings["format"], temporary_path]
+
+    try:
+        with STAGE_DURATION.time(stage="ffmpeg"):
+            subprocess.run(command, check=True)
+        os.replace(temporary_path, variant_path)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ConversionException(f"Error during conversion: {e}") from e
+    finally:
+        _remove_if_exists(temporary_path)
@@ -3,7 +3,7 @@ This module contains functions for generating missions.
 """
 import os
 import time
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 import json
 import logging
 from openai import (
@@ -11,12 +11,464 @@ from openai import (
     RateLimitError,
     APIError,
 )
-from api.openai_integration import ChatApp
-from api.prompts import mission_prompt, translation_prompt_1, translation_prompt_2
+from api.monitoring import STAGE_DURATION
+from api.openai_integration import (
+    API_MODEL,
+    CHAT_LIMITER,
+    MAX_ATTEMPTS,
+    ChatApp,
+    CircuitOpenException,
+    JsonObjectStreamParser,
+    RetryLaterException,
+    get_rate_limiter,
+    next_retry_delay,
+)
+from api.prompts import (
+    mission_prompt,
+    translation_prompt_1,
+    translation_prompt_2,
+    single_pass_prompt,
+)
+
+# Supported values for the MISSION_GENERATION_MODE environment variable
+MULTI_PASS_MODE = "multi-pass"  # Generate, translate and refine in three chat calls
+SINGLE_PASS_MODE = "single-pass"  # Generate and translate in one streamed chat call
+
+# The pups and settings combined into the variation hints of bulk generation
+VARIATION_PUPS = ("Chase", "Marshall", "Skye", "Rubble", "Zuma", "Rocky")
+VARIATION_SETTINGS = (
+    "on the water",
+    "in the air",
+    "in the mountains",
+    "in the middle of Adventure Bay",
+    "on a farm",
+    "in the jungle",
+    "in the snow",
+    "at night",
+)
+
+
+def get_generation_mode() -> str:
+    """
+    Get the mission generation mode from the MISSION_GENERATION_MODE environment variable.
+
+    Returns:
+        str: SINGLE_PASS_MODE or MULTI_PASS_MODE.
+    """
+    mode = os.getenv("MISSION_GENERATION_MODE", MULTI_PASS_MODE).lower()
+    return SINGLE_PASS_MODE if mode == SINGLE_PASS_MODE else MULTI_PASS_MODE
+
+
+def get_mission_chat_options(temperature: float = 0) -> Dict[str, Any]:
+    """
+    Get the chat completion options used for mission generation.
+
+    Args:
+        temperature (float, optional): The sampling temperature. Defaults to 0.
+
+    Returns:
+        Dict[str, Any]: The options passed to the chat completions API.
+    """
+    return {
+        "response_format": {"type": "json_object"},
+        "temperature": temperature,
+        "max_tokens": int(os.getenv("OPENAI_MAX_TOKENS", "2048")),
+        "top_p": 1,
+        "frequency_penalty": 0.3,
+    }
+
+
+def create_mission_chat_app(temperature: float = 0) -> ChatApp:
+    """
+    Create a chat app configured for mission generation.
+
+    Args:
+        temperature (float, optional): The sampling temperature. Defaults to 0.
+
+    Returns:
+        ChatApp: A new chat application instance.
+    """
+    return ChatApp(**get_mission_chat_options(temperature))
+
+
+def build_mission_chat_request(
+    messages: List[Dict[str, str]], temperature: float = 0
+) -> Dict[str, Any]:
+    """
+    Build the body of a mission generation chat request, e.g. for a batch file.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages of the conversation.
+        temperature (float, optional): The sampling temperature. Defaults to 0.
+
+    Returns:
+        Dict[str, Any]: The request body for the chat completions API.
+    """
+    return dict(
+        get_mission_chat_options(temperature), model=API_MODEL, messages=messages
+    )
+
+
+def get_mission_variation(number: int) -> str:
+    """
+    Get a hint that steers a mission away from the others of the same batch.
+
+    Consecutive numbers feature a different pup, and each round of pups moves
+    to a different setting, so a batch repeats a hint only after
+    len(VARIATION_PUPS) * len(VARIATION_SETTINGS) missions.
+
+    Args:
+        number (int): The number of the mission in its batch, from 0.
+
+    Returns:
+        str: The hint, appended to the user message.
+    """
+    pup = VARIATION_PUPS[number % len(VARIATION_PUPS)]
+    setting = VARIATION_SETTINGS[
+        (number // len(VARIATION_PUPS)) % len(VARIATION_SETTINGS)
+    ]
+    return f"Feature {pup} and set the mission {setting}"
+
+
+def build_mission_messages(
+    avoid_missions: List[Dict] = None,
+    mode: str = None,
+    avoid_summary: Dict[str, List[str]] = None,
+    variation: str = None,
+) -> List[Dict[str, str]]:
+    """
+    Build the messages that ask for a new mission, as sent by the text stage.
+
+    Args:
+        avoid_missions (List[Dict], optional): Missions to avoid repeating. Defaults to None.
+        mode (str, optional): The generation mode. Defaults to get_generation_mode().
+        avoid_summary (Dict[str, List[str]], optional): Recently overused locations
+            and pups. Defaults to None.
+        variation (str, optional): A hint from get_mission_variation. Defaults to None.
+
+    Returns:
+        List[Dict[str, str]]: The system and user messages.
+    """
+    mode = mode or get_generation_mode()
+    return [
+        {
+            "role": "system",
+            "content": single_pass_prompt
+            if mode == SINGLE_PASS_MODE
+            else mission_prompt,
+        },
+        {
+            "role": "user",
+            "content": build_mission_request(avoid_missions, avoid_summary, variation),
+        },
+    ]
+
+
+def build_translation_messages(
+    mission_data: Dict[str, Any], draft_translation: str = None
+) -> List[Dict[str, str]]:
+    """
+    Build the messages of the translation stage.
+
+    Args:
+        mission_data (Dict[str, Any]): Mission data containing a mission script.
+        draft_translation (str, optional): The response to the first translation
+            request. If given, the messages ask to refine it. Defaults to None.
+
+    Returns:
+        List[Dict[str, str]]: The messages of the translation or refinement request.
+    """
+    messages = [
+        {"role": "system", "content": translation_prompt_1},
+        {"role": "user", "content": mission_data.get("mission_script")},
+    ]
+    if draft_translation is not None:
+        messages += [
+            {"role": "assistant", "content": draft_translation},
+            {"role": "user", "content": translation_prompt_2},
+        ]
+    return messages
+
+
+def build_mission_request(
+    avoid_missions: List[Dict] = None,
+    avoid_summary: Dict[str, List[str]] = None,
+    variation: str = None,
+) -> str:
+    """
+    Build the user message that asks for a new mission.
+
+    Args:
+        avoid_missions (List[Dict], optional): Missions whose location, pups
+            and title the new mission should avoid. Defaults to None.
+        avoid_summary (Dict[str, List[str]], optional): The "locations" and "pups"
+            used most often by recent missions, which the new mission should
+            prefer not to use. Defaults to None.
+        variation (str, optional): A hint from get_mission_variation. Defaults to None.
+
+    Returns:
+        str: The user message.
+    """
+    user_message = "Generate one mission"
+    missions = [mission for mission in avoid_missions or [] if mission]
+    if missions:
+        user_message = _build_avoid_missions_request(user_message, missions)
+    for hint in (_format_avoid_summary(avoid_summary), variation):
+        if hint:
+            user_message = f"{user_message}. {hint}"
+    return user_message
+
+
+def _build_avoid_missions_request(user_message: str, missions: List[Dict]) -> str:
+    locations = ", ".join(str(mission.get("main_location")) for mission in missions)
+    pups = "; ".join(_format_pups(mission.get("involved_pups")) for mission in missions)
+    titles = ", ".join(f"\"{mission.get('mission_title')}\"" for mission in missions)
+    if len(missions) == 1:
+        return (
+            f"{user_message}. Avoid location {locations}, "
+            f"pups {pups}, "
+            f"and title similar to {titles}"
+        )
+    return (
+        f"{user_message}. Avoid locations {locations}, "
+        f"pup combinations {pups}, "
+        f"and titles similar to {titles}"
+    )
+
+
+def _format_avoid_summary(avoid_summary: Dict[str, List[str]] = None) -> str:
+    parts = []
+    if avoid_summary and avoid_summary.get("locations"):
+        parts.append(f"locations {', '.join(avoid_summary['locations'])}")
+    if avoid_summary and avoid_summary.get("pups"):
+        parts.append(f"pups {', '.join(avoid_summary['pups'])}")
+    if not parts:
+        return ""
+    return f"Recent missions often used {' and '.join(parts)}, prefer others"
+
+
+def _format_pups(involved_pups) -> str:
+    if isinstance(involved_pups, (list, tuple)):
+        return ",".join(involved_pups)
+    return str(involved_pups)
+
+
+def _log_generation_stats(stage: str, chat_app: ChatApp, usage_before: Dict, started):
+    """
+    Log the number of chat calls, the token usage and the duration of a generation stage.
+
+    Args:
+        stage (str): The name of the generation stage.
+        chat_app (ChatApp): The chat application used by the stage.
+        usage_before (Dict): A copy of the chat app's usage before the stage started.
+        started (float): The time.perf_counter() value when the stage started.
+    """
+    logging.info(
+        "Mission generation stats: mode=%s stage=%s calls=%s prompt_tokens=%s "
+        "completion_tokens=%s cached_tokens=%s saved_tokens=%s duration_ms=%s",
+        get_generation_mode(),
+        stage,
+        chat_app.usage["calls"] - usage_before["calls"],
+        chat_app.usage["prompt_tokens"] - usage_before["prompt_tokens"],
+        chat_app.usage["completion_tokens"] - usage_before["completion_tokens"],
+        chat_app.usage["cached_tokens"] - usage_before["cached_tokens"],
+        chat_app.usage["saved_tokens"] - usage_before["saved_tokens"],
+        round((time.perf_counter() - started) * 1000),
+    )
+
+
+def _run_with_retries(
+    operation: Callable[[], Any], attempt: int = None
+) -> Optional[Any]:
+    """
+    Run an OpenAI operation, retrying with exponential backoff on API errors.
+
+    The delays honor the Retry-After header of rate limit errors and the
+    shared chat rate limiter. Without an attempt number the retries wait in
+    this thread; with one, the operation is run once and the retry is left
+    to the caller.
+
+    Args:
+        operation (Callable[[], Any]): The operation to run.
+        attempt (int, optional): The number of this attempt, from 0, when the
+            caller reschedules retries itself. Defaults to None.
+
+    Returns:
+        Optional[Any]: The result of the operation, or None if it failed.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the operation
+            should be retried after a delay.
+    """
+    limiter = get_rate_limiter(CHAT_LIMITER)
+    for current in range(attempt or 0, MAX_ATTEMPTS):
+        try:
+            return operation()
+        except (APITimeoutError, RateLimitError, APIError, CircuitOpenException) as e:
+            delay = next_retry_delay(e, "chat", current, 5, limiter)
+            if delay is None:
+                break
+            if attempt is not None:
+                raise RetryLaterException(delay) from e
+            time.sleep(delay)
+        except json.JSONDecodeError:
+            logging.error("Failed to parse JSON response")
+            return None
+
+    logging.error("Max retry attempts reached. Unable to generate mission data.")
+    return None
+
+
+def generate_mission_draft(
+    avoid_missions: List[Dict] = None,
+    chat_app: ChatApp = None,
+    avoid_summary: Dict[str, List[str]] = None,
+    attempt: int = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Generate the English mission text, without a translation.
+
+    Args:
+        avoid_missions (List[Dict], optional): Missions to avoid repeating. Defaults to None.
+        chat_app (ChatApp, optional): Chat application instance. Defaults to None.
+        avoid_summary (Dict[str, List[str]], optional): Recently overused locations
+            and pups. Defaults to None.
+        attempt (int, optional): The number of this attempt, from 0, when the caller
+            reschedules retries itself. Defaults to None, retrying in this thread.
+
+    Returns:
+        Optional[Dict[str, Any]]: Generated mission data, or None if generation failed.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the call should be
+            retried after a delay.
+    """
+    if chat_app is None:
+        chat_app = create_mission_chat_app()
+
+    def generate():
+        chat_app.set_system_message(mission_prompt)
+        with STAGE_DURATION.time(stage="chat"):
+            mission_response = chat_app.chat(
+                build_mission_request(avoid_missions, avoid_summary)
+            )
+        return json.loads(mission_response)
+
+    usage_before, started = dict(chat_app.usage), time.perf_counter()
+    try:
+        mission_data = _run_with_retries(generate, attempt)
+    finally:
+        _log_generation_stats("draft", chat_app, usage_before, started)
+    return mission_data
+
+
+def generate_single_pass_mission(
+    avoid_missions: List[Dict] = None,
+    chat_app: ChatApp = None,
+    on_field: Callable[[str, Any], bool] = None,
+    avoid_summary: Dict[str, List[str]] = None,
+    attempt: int = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Generate the mission and its refined translation in one streamed chat call.
+
+    The response is parsed while it streams in, and each top-level field is
+    passed to on_field as soon as it is complete.
+
+    Args:
+        avoid_missions (List[Dict], optional): Missions to avoid repeating. Defaults to None.
+        chat_app (ChatApp, optional): Chat application instance. Defaults to None.
+        on_field (Callable, optional): Called with the key and value of each completed
+            field; returning False rejects the mission and stops the stream. Defaults to None.
+        avoid_summary (Dict[str, List[str]], optional): Recently overused locations
+            and pups. Defaults to None.
+        attempt (int, optional): The number of this attempt, from 0, when the caller
+            reschedules retries itself. Defaults to None, retrying in this thread.
+
+    Returns:
+        Optional[Dict[str, Any]]: Generated mission data including the translation,
+            or None if generation failed or the mission was rejected.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the call should be
+            retried after a delay.
+    """
+    if chat_app is None:
+        chat_app = create_mission_chat_app()
+
+    def generate():
+        chat_app.set_system_message(single_pass_prompt)
+        parser = JsonObjectStreamParser()
+        with STAGE_DURATION.time(stage="chat"):
+            for text in chat_app.chat_stream(
+                build_mission_request(avoid_missions, avoid_summary)
+            ):
+                for key, value in parser.feed(text):
+                    if on_field is not None and on_field(key, value) is False:
+                        logging.info(
+                            "Rejected mission while streaming on field %s", key
+                        )
+                        return None
+        if not parser.complete or "translation" not in parser.fields:
+            raise json.JSONDecodeError("Incomplete mission response", "", 0)
+        return parser.fields
+
+    usage_before, started = dict(chat_app.usage), time.perf_counter()
+    try:
+        mission_data = _run_with_retries(generate, attempt)
+    finally:
+        _log_generation_stats("single-pass", chat_app, usage_before, started)
+    return mission_data
+
+
+def add_mission_translation(
+    mission_data: Dict[str, Any], chat_app: ChatApp = None, attempt: int = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Translate the mission script and add it to the mission data.
+
+    Args:
+        mission_data (Dict[str, Any]): Mission data containing a mission script.
+        chat_app (ChatApp, optional): Chat application instance. Defaults to None.
+        attempt (int, optional): The number of this attempt, from 0, when the caller
+            reschedules retries itself. Defaults to None, retrying in this thread.
+
+    Returns:
+        Optional[Dict[str, Any]]: The mission data including the translation,
+            or None if translation failed.
+
+    Raises:
+        RetryLaterException: If an attempt number is given and the call should be
+            retried after a delay.
+    """
+    if chat_app is None:
+        chat_app = create_mission_chat_app()
+
+    def translate():
+        chat_app.set_system_message(translation_prompt_1)
+        with STAGE_DURATION.time(stage="translate"):
+            chat_app.chat(mission_data.get("mission_script"))
+        with STAGE_DURATION.time(stage="refine"):
+            translation_response = json.loads(chat_app.chat(translation_prompt_2))
+        return translation_response.get("translation")
+
+    usage_before, started = dict(chat_app.usage), time.perf_counter()
+    try:
+        translation = _run_with_retries(translate, attempt)
+    finally:
+        _log_generation_stats("translation", chat_app, usage_before, started)
+    if translation is None:
+        return None
+
+    mission_data["translation"] = translation
+    return mission_data
 
 
 def generate_new_mission_data(
-    previous_mission: Dict = None, chat_app: ChatApp = None
+    previous_mission: Dict = None,
+    chat_app: ChatApp = None,
+    avoid_missions: List[Dict] = None,
+    mission_filter: Callable[[Dict[str, Any]], bool] = None,
 ) -> Dict[str, Any]:
     """
     Generate new mission data.
@@ -24,58 +476,32 @@ def generate_new_mission_data(
     Args:
         previous_mission (Dict, optional): Previous mission data. Defaults to None.
         chat_app (ChatApp, optional): Chat application instance. Defaults to None.
+        avoid_missions (List[Dict], optional): Additional missions to avoid. Defaults to None.
+        mission_filter (Callable, optional): Called with the generated mission, before
+            translation in multi-pass mode; returning False rejects it. Defaults to None.
 
     Returns:
         Dict[str, Any]: Generated mission data.
     """
     # Create a new chat app if none is provided
     if chat_app is None:
-        chat_app = ChatApp(
-            response_format={"type": "json_object"},
-            temperature=0,
-            max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "2048")),
-            top_p=1,
-            frequency_penalty=0.3,
-        )
+        chat_app = create_mission_chat_app()
 
-    retry_delay = 5
-    max_attempts = 3
+    missions_to_avoid = [previous_mission] + list(avoid_missions or [])
+    if get_generation_mode() == SINGLE_PASS_MODE:
+        mission_data = generate_single_pass_mission(missions_to_avoid, chat_app)
+        if mission_data is not None and mission_filter is not None:
+            if not mission_filter(mission_data):
+                logging.info("Rejected mission: %s", mission_data.get("mission_title"))
+                return None
+        return mission_data
 
-    for _ in range(max_attempts):
-        try:
-            # Generate a new mission
-            chat_app.set_system_message(mission_prompt)
-            user_message = "Generate one mission"
-            if previous_mission:
-                user_message += (
-                    f". Avoid location {previous_mission.get('main_location')}, "
-                    f"pups {previous_mission.get('involved_pups')}, "
-                    f"and title similar to \"{previous_mission.get('mission_title')}\""
-                )
-
-            mission_response = chat_app.chat(user_message)
-            mission_response_data = json.loads(mission_response)
-
-            # Translate the mission script
-            chat_app.set_system_message(translation_prompt_1)
-            chat_app.chat(mission_response_data.get("mission_script"))
-            translation_response = json.loads(chat_app.chat(translation_prompt_2))
+    mission_data = generate_mission_draft(missions_to_avoid, chat_app)
+    if mission_data is None:
+        return None
 
-            mission_response_data["translation"] = translation_response.get(
-                "translation"
-            )
-            return mission_response_data
-        except (APITimeoutError, RateLimitError, APIError) as e:
-            logging.warning(
-                "%s encountered. Retrying after %s seconds.",
-                type(e).__name__,
-                retry_delay,
-            )
-            time.sleep(retry_delay)
-            retry_delay *= 2  # Exponential backoff
-        except json.JSONDecodeError:
-            logging.error("Failed to parse JSON response")
-            return None
+    if mission_filter is not None and not mission_filter(mission_data):
+        logging.info("Rejected mission draft: %s", mission_data.get("mission_title"))
+        return None
 
-    logging.error("Max retry attempts reached. Unable to generate mission data.")
-    return None
+    return add_mission_translation(mission_data, chat_app)
@@ -0,0 +1,105 @@
+"""
+This module contains functions for synthesizing long scripts as chunks in parallel.
+
+Scripts are split at sentence boundaries and every chunk is requested from the
+TTS model as raw PCM, so the chunks can be joined without gaps into one
+uniformly formatted audio stream.
+"""
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from api.openai_integration import stream_mission_audio, TTSException
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+")
+
+
+def get_chunk_max_chars() -> int:
+    """
+    Gets the maximum length of a chunk from the TTS_CHUNK_MAX_CHARS environment variable.
+
+    Returns:
+        int: The maximum number of characters per chunk, 0 disables chunking.
+    """
+    return int(os.getenv("TTS_CHUNK_MAX_CHARS", "800"))
+
+
+def split_script(script: str, max_chars: int) -> List[str]:
+    """
+    Splits a script into chunks of at most max_chars characters at sentence boundaries.
+
+    Sentences longer than max_chars are split between words.
+
+    Args:
+        script (str): The script to split.
+        max_chars (int): The maximum number of characters per chunk.
+
+    Returns:
+        List[str]: The chunks, in order.
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(script.strip()):
+        while len(sentence) > max_chars:
+            split_at = sentence.rfind(" ", 0, max_chars + 1)
+            if split_at <= 0:
+                split_at = max_chars
+            pieces.append(sentence[:split_at])
+            sentence = sentence[split_at:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def _synthesize_chunk(text: str):
+    audio = bytearray()
+    if not stream_mission_audio(audio.extend, text, response_format="pcm"):
+        return None
+    return bytes(audio)
+
+
+def synthesize_pcm_chunks(chunks: List[str], pcm_chunks: Dict[int, bytes]) -> bytes:
+    """
+    Synthesizes the chunks that are not yet in pcm_chunks in parallel and joins all chunks.
+
+    Synthesized chunks are stored in pcm_chunks, so calling this again with the
+    same dictionary after a failure only requests the chunks that failed.
+
+    Args:
+        chunks (List[str]): The script chunks.
+        pcm_chunks (Dict[int, bytes]): The PCM audio of the chunks synthesized so far,
+            keyed by chunk index.
+
+    Returns:
+        bytes: The raw PCM audio of the whole script.
+
+    Raises:
+        TTSException: If any chunk could not be synthesized.
+    """
+    missing = [index for index in range(len(chunks)) if index not in pcm_chunks]
+    if missing:
+        concurrency = int(os.getenv("TTS_CHUNK_CONCURRENCY", "4"))
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(concurrency, len(missing))),
+            thread_name_prefix="tts-chunk",
+        ) as executor:
+            results = executor.map(
+                _synthesize_chunk, [chunks[index] for index in missing]
+            )
+            for index, audio in zip(missing, results):
+                if audio is not None:
+                    pcm_chunks[index] = audio
+
+    failed = [index for index in range(len(chunks)) if index not in pcm_chunks]
+    if failed:
+        logging.error("Failed to synthesize %s of %s chunks", len(failed), len(chunks))
+        raise TTSException(f"Failed to synthesize chunks {failed}")
+
+    return b"".join(pcm_chunks[index] for index in range(len(chunks)))
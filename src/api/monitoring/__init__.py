@@ -0,0 +1,47 @@
+"""
+This module provides the metrics and the logging setup of the Paw Patrol Tower API.
+
+Usage:
+    from api.monitoring import STAGE_DURATION, render_metrics
+
+    with STAGE_DURATION.time(stage="tts"):
+        ...
+
+    print(render_metrics())
+"""
+from .logs import configure_logging, start_shared_log_listener
+from .metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    render_metrics,
+    REQUEST_DURATION,
+    STAGE_DURATION,
+    OPENAI_TOKENS,
+    OPENAI_TOKENS_SAVED,
+    OPENAI_RETRIES,
+    OPENAI_FAILURES,
+    OPENAI_RATE_LIMIT_WAIT,
+    OPENAI_CIRCUIT_OPEN,
+    BUFFER_DEPTH,
+    READY_QUEUE_DEPTH,
+)
+
+__all__ = [
+    "configure_logging",
+    "start_shared_log_listener",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "render_metrics",
+    "REQUEST_DURATION",
+    "STAGE_DURATION",
+    "OPENAI_TOKENS",
+    "OPENAI_TOKENS_SAVED",
+    "OPENAI_RETRIES",
+    "OPENAI_FAILURES",
+    "OPENAI_RATE_LIMIT_WAIT",
+    "OPENAI_CIRCUIT_OPEN",
+    "BUFFER_DEPTH",
+    "READY_QUEUE_DEPTH",
+]
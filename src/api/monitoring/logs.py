@@ -0,0 +1,146 @@
+"""
+This module contains the logging setup of the Paw Patrol Tower API.
+
+Log records are put on an in-memory queue by the thread that logs them and
+are formatted and written to the log file by a background listener thread,
+so formatting and disk I/O do not stall request and generation threads. The
+log file is rotated by size or time so it does not fill the data volume.
+
+Under gunicorn, the master process starts the listener before it forks the
+workers, and the workers put their records on the inherited process queue.
+The master is then the only process writing and rotating the log file, so
+the workers never rotate it under each other. With "external" rotation the
+file is reopened after an external tool such as logrotate renamed it.
+"""
+import os
+import queue
+import atexit
+import logging
+import multiprocessing
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+    WatchedFileHandler,
+)
+
+# Supported values for the LOG_ROTATION environment variable
+SIZE_ROTATION = "size"  # Rotate when the file reaches LOG_MAX_BYTES
+TIME_ROTATION = "time"  # Rotate at LOG_ROTATION_WHEN, e.g. midnight
+EXTERNAL_ROTATION = "external"  # Reopen the file when another tool rotated it
+NO_ROTATION = "none"  # Append to a single file forever
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+# The queue of the listener started by start_shared_log_listener, inherited
+# by the processes forked afterwards
+_shared_queue = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting the record to the listener thread.
+
+    The standard QueueHandler formats the message in the logging thread so the
+    record can be pickled. The queue never leaves this process, so the record
+    is passed on as is and the message is only built when it is written.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _create_file_handler(log_file_path: str) -> logging.Handler:
+    rotation = os.getenv("LOG_ROTATION", SIZE_ROTATION).lower()
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+    if rotation == SIZE_ROTATION:
+        return RotatingFileHandler(
+            log_file_path,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+    if rotation == TIME_ROTATION:
+        return TimedRotatingFileHandler(
+            log_file_path,
+            when=os.getenv("LOG_ROTATION_WHEN", "midnight"),
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+    if rotation == EXTERNAL_ROTATION:
+        return WatchedFileHandler(log_file_path, mode="a", encoding="utf-8")
+    if rotation == NO_ROTATION:
+        return logging.FileHandler(log_file_path, mode="a", encoding="utf-8")
+    raise ValueError(
+        f"Unsupported LOG_ROTATION {rotation!r}, expected {SIZE_ROTATION!r}, "
+        f"{TIME_ROTATION!r}, {EXTERNAL_ROTATION!r} or {NO_ROTATION!r}"
+    )
+
+
+def configure_logging(log_file_path: str):
+    """
+    Sends the log records of the root logger to a rotating log file through a queue.
+
+    In a process forked after start_shared_log_listener, e.g. a gunicorn
+    worker, the records are sent to the shared listener instead, which writes
+    them to its own log file.
+
+    Args:
+        log_file_path (str): The path of the log file.
+
+    Raises:
+        ValueError: If the LOG_ROTATION environment variable is not supported.
+    """
+    global _listener  # pylint: disable=global-statement
+    root_logger = logging.getLogger()
+    if _listener is not None or any(
+        isinstance(handler, QueueHandler) for handler in root_logger.handlers
+    ):
+        return
+
+    root_logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    if _shared_queue is not None:
+        # Records are pickled to cross the process boundary, so the standard
+        # handler formats the message in this process
+        root_logger.addHandler(QueueHandler(_shared_queue))
+        return
+
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(DeferredQueueHandler(log_queue))
+    _listener = _start_listener(log_queue, log_file_path)
+
+
+def start_shared_log_listener(log_file_path: str):
+    """
+    Starts writing the log records of this process and of the processes forked
+    from it to a single rotating log file.
+
+    Called by the gunicorn master before it forks the workers.
+
+    Args:
+        log_file_path (str): The path of the log file.
+
+    Raises:
+        ValueError: If the LOG_ROTATION environment variable is not supported.
+    """
+    global _shared_queue  # pylint: disable=global-statement
+    if _shared_queue is not None:
+        return
+    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+    _shared_queue = multiprocessing.get_context("fork").Queue()
+    _start_listener(_shared_queue, log_file_path)
+
+
+def _start_listener(log_queue, log_file_path: str) -> QueueListener:
+    file_handler = _create_file_handler(log_file_path)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # Write the records still in the queue when the process exits. Forked
+    # processes inherit the exit handler, but must not stop a shared listener.
+    pid = os.getpid()
+    atexit.register(lambda: os.getpid() == pid and listener.stop())
+    return listener
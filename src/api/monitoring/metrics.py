@@ -0,0 +1,290 @@
+"""
+This module contains lightweight Prometheus metrics for the Paw Patrol Tower API.
+
+Counters, gauges and histograms are kept in memory and rendered in the
+Prometheus text exposition format by render_metrics(). Every gunicorn worker
+process collects and reports its own metrics.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+_registry: List["_Metric"] = []
+
+# Default histogram buckets in seconds, from API response times up to slow OpenAI calls
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Base class of the metrics, holding one value per combination of label values.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [
+                (self.name, _format_labels(self.label_names, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def render(self) -> str:
+        """
+        Renders the metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The HELP and TYPE lines followed by one line per sample.
+        """
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, such as a number of requests or tokens.
+    """
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increments the counter.
+
+        Args:
+            amount (float): The amount to add, must not be negative. Defaults to 1.
+            **labels: The label values.
+        """
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down, such as the depth of a buffer.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._function: Optional[Callable[[], Optional[float]]] = None
+
+    def set(self, value: float, **labels):
+        """
+        Sets the gauge to a value.
+
+        Args:
+            value (float): The new value.
+            **labels: The label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], Optional[float]]):
+        """
+        Reads the value of an unlabelled gauge from a function whenever the metrics are rendered.
+
+        Args:
+            function (Callable[[], Optional[float]]): Returns the current value,
+                or None if it is not known.
+        """
+        self._function = function
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        if self._function is None:
+            return super()._samples()
+        value = self._function()
+        return [] if value is None else [(self.name, "", value)]
+
+
+class Histogram(_Metric):
+    """
+    Counts observations, such as durations, in cumulative buckets.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        """
+        Records an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the managed block in seconds, also if it raises.
+
+        Args:
+            **labels: The label values.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        _format_labels(
+                            self.label_names + ("le",), key + (_format_value(bucket),)
+                        ),
+                        cumulative,
+                    )
+                )
+            labels = _format_labels(self.label_names, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+def render_metrics() -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics, ending with a newline.
+    """
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+REQUEST_DURATION = Histogram(
+    "paw_request_duration_seconds",
+    "Time spent handling API requests until the response is ready.",
+    ["endpoint"],
+)
+STAGE_DURATION = Histogram(
+    "paw_pipeline_stage_duration_seconds",
+    "Time spent in each stage of the mission generation pipeline.",
+    ["stage"],
+)
+OPENAI_TOKENS = Counter(
+    "paw_openai_tokens_total",
+    "Tokens used by chat completions, as reported by the API (prompt, completion, cached).",
+    ["kind"],
+)
+OPENAI_TOKENS_SAVED = Counter(
+    "paw_openai_prompt_tokens_saved_total",
+    "Prompt tokens left out of chat calls by the history policy, estimated locally.",
+)
+OPENAI_RETRIES = Counter(
+    "paw_openai_retries_total",
+    "OpenAI operations retried after an API error.",
+    ["operation"],
+)
+OPENAI_FAILURES = Counter(
+    "paw_openai_failures_total",
+    "OpenAI operations, and the audio conversion of their output, that failed after all retries.",
+    ["operation"],
+)
+OPENAI_RATE_LIMIT_WAIT = Histogram(
+    "paw_openai_rate_limit_wait_seconds",
+    "Time OpenAI calls waited for the rate limiter before they were sent.",
+    ["operation"],
+)
+OPENAI_CIRCUIT_OPEN = Gauge(
+    "paw_openai_circuit_open",
+    "1 while the circuit breaker of an OpenAI operation is open, 0 otherwise.",
+    ["operation"],
+)
+BUFFER_DEPTH = Gauge(
+    "paw_mission_buffer_depth",
+    "Unrequested missions in the buffer, as last counted by this process.",
+)
+READY_QUEUE_DEPTH = Gauge(
+    "paw_mission_ready_queue_depth",
+    "Missions read ahead by this process and pre-rendered to be served.",
+)
@@ -1,8 +1,32 @@
 """
 This package contains the OpenAI integration for the chat app.
 """
-from .chat_app import ChatApp
-from .tts import create_mission_audio
+from .batch import (
+    BatchException,
+    read_batch_results,
+    submit_batch,
+    wait_for_batch,
+    write_batch_file,
+)
+from .chat_app import ChatApp, API_MODEL
+from .client import create_openai_client, get_openai_client
+from .json_stream import JsonObjectStreamParser
+from .rate_limit import (
+    CHAT_LIMITER,
+    TTS_LIMITER,
+    CircuitOpenException,
+    RateLimiter,
+    get_rate_limiter,
+)
+from .retry import (
+    MAX_ATTEMPTS,
+    RetryLaterException,
+    RetryScheduler,
+    get_retry_delay,
+    next_retry_delay,
+)
+from .tokens import estimate_messages_tokens, estimate_tokens
+from .tts import create_mission_audio, stream_mission_audio, TTS_MODEL
 
 
 class TTSException(Exception):
@@ -11,4 +35,31 @@ class TTSException(Exception):
     """
 
 
-__all__ = ["ChatApp", "create_mission_audio", "TTSException"]
+__all__ = [
+    "BatchException",
+    "read_batch_results",
+    "submit_batch",
+    "wait_for_batch",
+    "write_batch_file",
+    "ChatApp",
+    "API_MODEL",
+    "create_openai_client",
+    "get_openai_client",
+    "JsonObjectStreamParser",
+    "CHAT_LIMITER",
+    "TTS_LIMITER",
+    "CircuitOpenException",
+    "RateLimiter",
+    "get_rate_limiter",
+    "MAX_ATTEMPTS",
+    "RetryLaterException",
+    "RetryScheduler",
+    "get_retry_delay",
+    "next_retry_delay",
+    "estimate_messages_tokens",
+    "estimate_tokens",
+    "create_mission_audio",
+    "stream_mission_audio",
+    "TTS_MODEL",
+    "TTSException",
+]
@@ -0,0 +1,184 @@
+"""
+This module contains the functions that use the OpenAI Batch API.
+
+Requests are written to a JSONL file, uploaded, and processed by the API
+asynchronously within the completion window, at batch pricing and with
+separate rate limits. The results are downloaded once the batch has ended.
+"""
+import os
+import json
+import time
+import logging
+from typing import Any, Dict, Iterable, Optional, Tuple
+from openai import APIConnectionError, InternalServerError, OpenAI, RateLimitError
+from .client import get_openai_client
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+
+# Batch statuses after which the batch no longer changes
+FINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchException(Exception):
+    """
+    Exception raised when a batch fails, is cancelled or does not end in time.
+    """
+
+
+def write_batch_file(
+    path: str,
+    requests: Iterable[Tuple[str, Dict]],
+    endpoint: str = CHAT_COMPLETIONS_ENDPOINT,
+) -> int:
+    """
+    Writes requests to a JSONL batch input file.
+
+    Args:
+        path (str): The path of the batch file.
+        requests (Iterable[Tuple[str, Dict]]): The custom ID and the request body
+            of every request. The custom ID identifies the result of the request.
+        endpoint (str): The API endpoint of the requests.
+
+    Returns:
+        int: The number of requests written.
+    """
+    written = 0
+    with open(path, "w", encoding="utf-8") as batch_file:
+        for custom_id, body in requests:
+            line = {"custom_id": custom_id, "method": "POST", "url": endpoint}
+            batch_file.write(json.dumps(dict(line, body=body)) + "\n")
+            written += 1
+    return written
+
+
+def submit_batch(
+    path: str,
+    endpoint: str = CHAT_COMPLETIONS_ENDPOINT,
+    client: OpenAI = None,
+) -> Dict:
+    """
+    Uploads a batch input file and creates a batch for it.
+
+    Args:
+        path (str): The path of the batch file written by write_batch_file.
+        endpoint (str): The API endpoint of the requests.
+        client (OpenAI, optional): The OpenAI client to use. Defaults to the shared client.
+
+    Returns:
+        Dict: The created batch.
+    """
+    client = client or get_openai_client()
+    with open(path, "rb") as batch_file:
+        input_file = client.files.create(
+            file=(os.path.basename(path), batch_file), purpose="batch"
+        )
+    batch = client.post(
+        "/batches",
+        body={
+            "input_file_id": input_file.id,
+            "endpoint": endpoint,
+            "completion_window": "24h",
+        },
+        cast_to=Dict[str, Any],
+    )
+    logging.info("Submitted batch %s with input file %s", batch["id"], path)
+    return batch
+
+
+def retrieve_batch(batch_id: str, client: OpenAI = None) -> Dict:
+    """
+    Retrieves the current state of a batch.
+
+    Args:
+        batch_id (str): The ID of the batch.
+        client (OpenAI, optional): The OpenAI client to use. Defaults to the shared client.
+
+    Returns:
+        Dict: The batch, including its status and request counts.
+    """
+    client = client or get_openai_client()
+    return client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+
+
+def wait_for_batch(
+    batch_id: str,
+    poll_interval: float = 60,
+    timeout: Optional[float] = None,
+    client: OpenAI = None,
+) -> Dict:
+    """
+    Polls a batch until it has ended.
+
+    Expired batches are returned as well, as the requests completed before
+    the completion window ran out are still in their output file. A poll that
+    fails with a connection, rate limit or server error is retried at the
+    next poll, as the client does not retry by itself.
+
+    Args:
+        batch_id (str): The ID of the batch.
+        poll_interval (float): Seconds between two polls. Defaults to 60.
+        timeout (float, optional): Seconds to wait at most. Defaults to no limit.
+        client (OpenAI, optional): The OpenAI client to use. Defaults to the shared client.
+
+    Returns:
+        Dict: The ended batch.
+
+    Raises:
+        BatchException: If the batch failed, was cancelled or did not end in time.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    batch = {}
+    while True:
+        try:
+            batch = retrieve_batch(batch_id, client)
+        except (APIConnectionError, InternalServerError, RateLimitError) as e:
+            logging.warning("Failed to poll batch %s: %s", batch_id, e)
+        status = batch.get("status")
+        if status in FINAL_BATCH_STATUSES:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            raise BatchException(f"Batch {batch_id} is still {status} after {timeout}s")
+        logging.info(
+            "Batch %s is %s: %s", batch_id, status, batch.get("request_counts")
+        )
+        time.sleep(poll_interval)
+
+    logging.info("Batch %s %s: %s", batch_id, status, batch.get("request_counts"))
+    if status in ("failed", "cancelled"):
+        raise BatchException(f"Batch {batch_id} {status}: {batch.get('errors')}")
+    return batch
+
+
+def read_batch_results(batch: Dict, client: OpenAI = None) -> Dict[str, Optional[Dict]]:
+    """
+    Downloads the results of an ended batch.
+
+    Args:
+        batch (Dict): The batch returned by wait_for_batch.
+        client (OpenAI, optional): The OpenAI client to use. Defaults to the shared client.
+
+    Returns:
+        Dict[str, Optional[Dict]]: The response body of every request by custom ID,
+            or None for the requests that failed.
+    """
+    client = client or get_openai_client()
+    results = {}
+    for key in ("output_file_id", "error_file_id"):
+        if not batch.get(key):
+            continue
+        content = client.files.content(batch[key]).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logging.warning(
+                    "Batch request %s failed: %s",
+                    result.get("custom_id"),
+                    result.get("error") or response.get("body"),
+                )
+                results[result["custom_id"]] = None
+            else:
+                results[result["custom_id"]] = response.get("body")
+    return results
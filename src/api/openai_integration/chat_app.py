@@ -1,8 +1,17 @@
 """
 This module contains the ChatApp class for interacting with the OpenAI Chat API.
+
+The conversation is sent with the system prompt first, so the static prompts
+form a stable prefix that the API's prompt caching can reuse. When the
+history grows over its token budget, the oldest turns after the system
+prompt are dropped or replaced by a short summary, depending on the history
+policy.
 """
 import os
+import re
+import hashlib
 import logging
+from typing import Dict, Iterator, List, Tuple
 from openai import (
     OpenAI,
     APITimeoutError,
@@ -12,11 +21,27 @@ from openai import (
     RateLimitError,
     APIError,
 )
+from api.monitoring import OPENAI_TOKENS, OPENAI_TOKENS_SAVED
+from .client import get_openai_client
+from .rate_limit import CHAT_LIMITER, get_rate_limiter
+from .tokens import estimate_message_tokens, estimate_messages_tokens
 
 API_MODEL = os.getenv(
     "API_MODEL", "gpt-3.5-turbo-1106"
 )  # Default to 'gpt-3.5-turbo-1106' if not set
 
+# Supported values for the CHAT_LOG_MODE environment variable
+FULL_CHAT_LOG = "full"  # Log the complete message history after every call
+DIGEST_CHAT_LOG = "digest"  # Log a short digest and the length of every message
+
+# Supported values for the CHAT_HISTORY_POLICY environment variable
+FULL_HISTORY = "full"  # Send the whole conversation with every call
+TRUNCATE_HISTORY = "truncate"  # Drop the oldest turns that do not fit the budget
+SUMMARIZE_HISTORY = "summarize"  # Replace the oldest turns by a short excerpt
+
+# Characters of each dropped message kept in the summary of the summarize policy
+SUMMARY_CHARS_PER_MESSAGE = 300
+
 
 class ChatApp:
     """
@@ -25,16 +50,47 @@ class ChatApp:
     It also includes error handling and logging functionality.
     """
 
-    def __init__(self, **options):
+    def __init__(
+        self,
+        client: OpenAI = None,
+        history_policy: str = None,
+        max_history_tokens: int = None,
+        **options,
+    ):
         """
         Initializes a new instance of the ChatApp class.
         Args:
+            client (OpenAI, optional): The OpenAI client to use. Defaults to the shared client.
+            history_policy (str, optional): FULL_HISTORY, TRUNCATE_HISTORY or
+                SUMMARIZE_HISTORY. Defaults to the CHAT_HISTORY_POLICY environment variable.
+            max_history_tokens (int, optional): The prompt token budget of the truncate
+                and summarize policies. Defaults to the CHAT_HISTORY_MAX_TOKENS
+                environment variable.
             **options: Additional options to be passed to the OpenAI API.
         """
-        self.client = OpenAI()
+        self.client = client or get_openai_client()
         self.options = options
+        self.history_policy = (
+            history_policy or os.getenv("CHAT_HISTORY_POLICY", FULL_HISTORY)
+        ).lower()
+        self.max_history_tokens = max_history_tokens or int(
+            os.getenv("CHAT_HISTORY_MAX_TOKENS", "3000")
+        )
         self.messages = []
-        logging.info("Chat app initialized with options: %s", self.options)
+        self.usage = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "estimated_prompt_tokens": 0,
+            "saved_tokens": 0,
+        }
+        self.last_call_tokens = {}
+        logging.info(
+            "Chat app initialized with options: %s, history policy: %s",
+            self.options,
+            self.history_policy,
+        )
 
     def set_system_message(self, system_message: str):
         """
@@ -53,13 +109,16 @@ class ChatApp:
             str: The assistant message received in response, or None if an error occurs.
         """
         self.messages.append({"role": "user", "content": user_message})
+        messages, estimate = self._prepare_messages()
         try:
-            response = self.client.chat.completions.create(
-                model=API_MODEL, **self.options, messages=self.messages
-            )
+            with get_rate_limiter(CHAT_LIMITER).limit(self._expected_tokens(estimate)):
+                response = self.client.chat.completions.create(
+                    model=API_MODEL, **self.options, messages=messages
+                )
             assistant_message = response.choices[0].message.content
             self.messages.append({"role": "assistant", "content": assistant_message})
-            self._log_chat_session(response)
+            self._record_usage(response.usage, estimate)
+            self._log_chat_session(response.id, response.usage)
             return assistant_message
         except (
             APITimeoutError,
@@ -73,16 +132,192 @@ class ChatApp:
             logging.error("OpenAI API request failed: %s", e)
             raise
 
-    def _log_chat_session(self, response):
+    def chat_stream(self, user_message: str) -> Iterator[str]:
+        """
+        Sends a user message to the chat and streams the assistant message in response.
+        The complete assistant message is added to the messages once the stream ends.
+        Args:
+            user_message (str): The user message to be sent.
+        Yields:
+            str: The parts of the assistant message as they are received.
+        """
+        self.messages.append({"role": "user", "content": user_message})
+        messages, estimate = self._prepare_messages()
+        try:
+            # The concurrency slot is held until the stream ends
+            with get_rate_limiter(CHAT_LIMITER).limit(self._expected_tokens(estimate)):
+                stream = self.client.chat.completions.create(
+                    model=API_MODEL,
+                    **self.options,
+                    messages=messages,
+                    stream=True,
+                    extra_body={"stream_options": {"include_usage": True}},
+                )
+                try:
+                    session_id, usage, parts = None, None, []
+                    for chunk in stream:
+                        session_id = chunk.id
+                        usage = getattr(chunk, "usage", None) or usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                finally:
+                    stream.response.close()
+
+            assistant_message = "".join(parts)
+            self.messages.append({"role": "assistant", "content": assistant_message})
+            self._record_usage(usage, estimate)
+            self._log_chat_session(session_id, usage)
+        except (
+            APITimeoutError,
+            APIConnectionError,
+            BadRequestError,
+            AuthenticationError,
+            PermissionError,
+            RateLimitError,
+            APIError,
+        ) as e:
+            logging.error("OpenAI API request failed: %s", e)
+            raise
+
+    def _prepare_messages(self) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Applies the history policy to the conversation.
+        Returns:
+            tuple: The messages to send, and the estimated prompt tokens of the
+                whole conversation ("full") and of the messages sent ("sent").
+        """
+        full_tokens = estimate_messages_tokens(self.messages, API_MODEL)
+        if self.history_policy not in (TRUNCATE_HISTORY, SUMMARIZE_HISTORY) or (
+            full_tokens <= self.max_history_tokens
+        ):
+            return self.messages, {"full": full_tokens, "sent": full_tokens}
+
+        # The system prompt stays first and the new user message last
+        prefix = self.messages[:1] if self.messages[0]["role"] == "system" else []
+        older, latest = self.messages[len(prefix) : -1], self.messages[-1:]
+        budget = self.max_history_tokens - estimate_messages_tokens(
+            prefix + latest, API_MODEL
+        )
+        kept = []
+        for message in reversed(older):
+            budget -= estimate_message_tokens(message, API_MODEL)
+            if budget < 0:
+                break
+            kept.insert(0, message)
+
+        messages = prefix + kept + latest
+        sent_tokens = estimate_messages_tokens(messages, API_MODEL)
+        if self.history_policy == SUMMARIZE_HISTORY and len(kept) < len(older):
+            # The summary takes the place of the oldest kept turns it does not fit next to
+            while True:
+                summary = summarize_messages(older[: len(older) - len(kept)])
+                messages = prefix + [{"role": "system", "content": summary}]
+                messages += kept + latest
+                sent_tokens = estimate_messages_tokens(messages, API_MODEL)
+                if sent_tokens <= self.max_history_tokens or not kept:
+                    break
+                kept.pop(0)
+        return messages, {"full": full_tokens, "sent": sent_tokens}
+
+    def _expected_tokens(self, estimate: Dict[str, int]) -> int:
+        """
+        Get the tokens the rate limits count for a call: its prompt and maximum completion.
+        Args:
+            estimate (Dict[str, int]): The estimate returned by _prepare_messages.
+        Returns:
+            int: The expected number of tokens.
+        """
+        return estimate["sent"] + int(self.options.get("max_tokens") or 0)
+
+    def _record_usage(self, usage, estimate: Dict[str, int] = None):
+        """
+        Adds the token usage of a response to the totals of this chat app.
+        Args:
+            usage: The usage object of the response, if any.
+            estimate (Dict[str, int], optional): The estimated prompt tokens of the
+                whole conversation and of the messages sent, from _prepare_messages.
+        """
+        self.usage["calls"] += 1
+        call_tokens = {}
+        for key in ("prompt_tokens", "completion_tokens"):
+            value = _usage_value(usage, key)
+            call_tokens[key] = value
+            self.usage[key] += value
+            OPENAI_TOKENS.inc(value, kind=key.split("_")[0])
+
+        details = _usage_value(usage, "prompt_tokens_details", None)
+        call_tokens["cached_tokens"] = _usage_value(details, "cached_tokens")
+        self.usage["cached_tokens"] += call_tokens["cached_tokens"]
+        OPENAI_TOKENS.inc(call_tokens["cached_tokens"], kind="cached")
+
+        if estimate:
+            call_tokens["estimated_prompt_tokens"] = estimate["sent"]
+            call_tokens["saved_tokens"] = estimate["full"] - estimate["sent"]
+            self.usage["estimated_prompt_tokens"] += estimate["sent"]
+            self.usage["saved_tokens"] += call_tokens["saved_tokens"]
+            OPENAI_TOKENS_SAVED.inc(call_tokens["saved_tokens"])
+        self.last_call_tokens = call_tokens
+
+    def _log_chat_session(self, session_id, usage):
         """
         Logs the details of the chat session.
         Args:
-            response: The response object from the OpenAI API.
+            session_id: The ID of the response from the OpenAI API.
+            usage: The usage object of the response from the OpenAI API.
         """
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
+
+        if os.getenv("CHAT_LOG_MODE", FULL_CHAT_LOG).lower() == DIGEST_CHAT_LOG:
+            messages = [
+                {
+                    "role": message["role"],
+                    "chars": len(message["content"] or ""),
+                    "sha256": hashlib.sha256(
+                        (message["content"] or "").encode("utf-8")
+                    ).hexdigest()[:12],
+                }
+                for message in self.messages
+            ]
+        else:
+            # Copied, as the record is only formatted later by the logging thread
+            messages = list(self.messages)
+
         logging_object = {
-            "session_id": response.id,
+            "session_id": session_id,
             "options": self.options,
-            "messages": self.messages,
-            "usage": response.usage,
+            "messages": messages,
+            "usage": usage,
+            "tokens": self.last_call_tokens,
         }
         logging.info(logging_object)
+
+
+def _usage_value(usage, key: str, default=0):
+    value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+    return default if value is None else value
+
+
+def summarize_messages(messages: List[Dict[str, str]]) -> str:
+    """
+    Summarizes dropped messages locally, by the first sentences of each message.
+    Args:
+        messages (List[Dict[str, str]]): The messages dropped from the history.
+    Returns:
+        str: The summary, to be sent as a system message.
+    """
+    lines = []
+    for message in messages:
+        content = " ".join((message.get("content") or "").split())
+        excerpt = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", content):
+            if excerpt and len(excerpt) + len(sentence) > SUMMARY_CHARS_PER_MESSAGE:
+                break
+            excerpt = f"{excerpt} {sentence}".strip()
+        if len(excerpt) > SUMMARY_CHARS_PER_MESSAGE:
+            excerpt = excerpt[:SUMMARY_CHARS_PER_MESSAGE].rstrip() + "..."
+        elif len(excerpt) < len(content):
+            excerpt += " ..."
+        lines.append(f"{message['role']}: {excerpt}")
+    return "Summary of the earlier conversation:\n" + "\n".join(lines)
@@ -0,0 +1,86 @@
+"""
+This module contains the shared OpenAI client used by the chat app and the TTS functions.
+"""
+import os
+import logging
+import importlib.util
+from threading import Lock
+from typing import Optional
+import httpx
+from openai import OpenAI
+from .rate_limit import update_rate_limits
+
+_client: Optional[OpenAI] = None
+_client_lock = Lock()
+
+
+def _http2_enabled() -> bool:
+    """
+    Checks whether HTTP/2 should be used, based on the OPENAI_HTTP2 environment variable.
+
+    The default, "auto", enables HTTP/2 when the optional h2 package is installed.
+
+    Returns:
+        bool: True if HTTP/2 should be used, False otherwise.
+    """
+    setting = os.getenv("OPENAI_HTTP2", "auto").lower()
+    h2_installed = importlib.util.find_spec("h2") is not None
+    if setting == "auto":
+        return h2_installed
+    if setting in ("1", "true", "yes"):
+        if not h2_installed:
+            logging.warning("OPENAI_HTTP2 is enabled but h2 is not installed")
+        return h2_installed
+    return False
+
+
+def create_openai_client() -> OpenAI:
+    """
+    Creates an OpenAI client with a tuned HTTP connection pool and explicit timeouts.
+
+    The pool and timeouts are configured with the OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT and OPENAI_HTTP2 environment variables.
+    The rate limit headers of every response are passed to the shared rate limiters.
+    The client does not retry by itself, as the retries are scheduled by the
+    callers with RetryScheduler, honoring the rate limiters.
+
+    Returns:
+        OpenAI: A new OpenAI client.
+    """
+    timeout = httpx.Timeout(
+        float(os.getenv("OPENAI_READ_TIMEOUT", "120")),
+        connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10")),
+    )
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "10")),
+        max_keepalive_connections=int(
+            os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "5")
+        ),
+        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+    )
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=limits,
+        http2=_http2_enabled(),
+        event_hooks={"response": [update_rate_limits]},
+    )
+    return OpenAI(http_client=http_client, timeout=timeout, max_retries=0)
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Gets the OpenAI client shared by all threads of the process.
+
+    The client is created on first use. Reusing it keeps connections to the API
+    alive between generation, translation and TTS calls.
+
+    Returns:
+        OpenAI: The shared OpenAI client.
+    """
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_openai_client()
+    return _client
@@ -0,0 +1,77 @@
+"""
+This module contains an incremental parser for JSON objects received in chunks.
+"""
+import json
+from typing import Any, Dict, List, Tuple
+
+
+class JsonObjectStreamParser:
+    """
+    The JsonObjectStreamParser class parses a JSON object as its text arrives in
+    chunks, e.g. from a streamed chat completion, and reports each top-level
+    field as soon as its value is complete.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new instance of the JsonObjectStreamParser class.
+        """
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._field: List[str] = []
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """
+        Feeds the next chunk of JSON text to the parser.
+        Args:
+            text (str): The next chunk of the JSON object.
+        Returns:
+            list: The (key, value) pairs of the top-level fields completed by this chunk.
+        Raises:
+            json.JSONDecodeError: If a completed field is not valid JSON.
+        """
+        completed = []
+        for char in text:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    continue
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_field(completed)
+                    self.complete = True
+                    continue
+            elif char == "," and self._depth == 1:
+                self._complete_field(completed)
+                continue
+
+            if self._depth >= 1:
+                self._field.append(char)
+        return completed
+
+    def _complete_field(self, completed: List[Tuple[str, Any]]):
+        """
+        Parses the buffered top-level field and adds it to the completed fields.
+        Args:
+            completed (list): The list of completed (key, value) pairs to add to.
+        """
+        field_text = "".join(self._field).strip()
+        self._field = []
+        if not field_text:
+            return
+        for key, value in json.loads("{" + field_text + "}").items():
+            self.fields[key] = value
+            completed.append((key, value))
@@ -0,0 +1,404 @@
+"""
+This module contains the rate limiters shared by the OpenAI calls of the process.
+
+Every kind of call (chat, tts) has one RateLimiter that all threads go through.
+It combines:
+
+- token buckets for the requests and tokens per minute, configured by
+  environment variables and adjusted to the x-ratelimit-* headers of the API
+  responses, so that the limits of the API key are learned at runtime,
+- a pause of all calls after a 429 response, for as long as its Retry-After
+  header asks,
+- a bound on the number of concurrent calls,
+- a circuit breaker that rejects calls for a cooldown after consecutive
+  connection or server errors, instead of letting every caller wait for its
+  own timeouts during an outage.
+"""
+import os
+import re
+import time
+import logging
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Dict, Mapping, Optional
+import httpx
+import openai
+from api.monitoring import OPENAI_CIRCUIT_OPEN, OPENAI_RATE_LIMIT_WAIT
+
+CHAT_LIMITER = "chat"
+TTS_LIMITER = "tts"
+
+# API paths of the calls limited by each rate limiter
+LIMITED_PATHS = {"/chat/completions": CHAT_LIMITER, "/audio/speech": TTS_LIMITER}
+
+# Errors counted by the circuit breaker: the API could not be reached or failed
+OUTAGE_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+_limiters: Dict[str, "RateLimiter"] = {}
+_limiters_lock = Lock()
+
+
+class CircuitOpenException(Exception):
+    """
+    Exception raised when a call is rejected because the circuit breaker is open.
+
+    Attributes:
+        retry_in (float): Seconds until the circuit breaker lets a call through again.
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"The OpenAI {name} circuit is open for {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a duration of the rate limit headers, e.g. "20ms", "1.5s", "6m0s" or "30".
+
+    Args:
+        value (str, optional): The header value. A plain number is in seconds.
+
+    Returns:
+        float: The duration in seconds, or None if the value is missing or invalid.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def get_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Reads the delay requested by the Retry-After headers of a response.
+
+    Args:
+        headers (Mapping[str, str]): The response headers.
+
+    Returns:
+        float: The delay in seconds, or None if the response does not request one.
+    """
+    retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously with its capacity every minute.
+
+    A capacity of 0 disables the bucket, until a limit is learned from the
+    rate limit headers.
+    """
+
+    def __init__(self, capacity: float = 0):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity:
+            self.level = min(
+                self.capacity,
+                self.level + (now - self.updated) * self.capacity / 60,
+            )
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Get the seconds until the bucket holds an amount of tokens.
+
+        Args:
+            amount (float): The tokens needed, at most the capacity.
+            now (float): The time.monotonic() value.
+
+        Returns:
+            float: The seconds to wait, 0 if the tokens are available.
+        """
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60 / self.capacity)
+
+    def take(self, amount: float, now: float):
+        """
+        Takes tokens from the bucket.
+
+        Args:
+            amount (float): The tokens used, at most the capacity.
+            now (float): The time.monotonic() value.
+        """
+        if self.capacity:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def update(self, limit: Optional[float], remaining: Optional[float], now: float):
+        """
+        Adjusts the bucket to the limit and remaining tokens reported by the API.
+
+        Args:
+            limit (float, optional): The tokens allowed per minute.
+            remaining (float, optional): The tokens left before the limit is reached.
+            now (float): The time.monotonic() value.
+        """
+        self._refill(now)
+        if limit:
+            self.capacity = limit
+            self.level = min(self.level, limit)
+        if remaining is not None and self.capacity:
+            # The API also counts the calls of other processes using the same key
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Rate limiter, concurrency limiter and circuit breaker of one kind of OpenAI call.
+
+    The limiter is thread-safe. Calls wait in acquire() until the buckets allow
+    them, and are rejected with CircuitOpenException while the circuit is open.
+    After the cooldown, one call is let through to probe whether the API has
+    recovered; its success closes the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = 0,
+        failure_threshold: int = 5,
+        cooldown: float = 60,
+    ):
+        """
+        Initializes a new rate limiter.
+
+        Args:
+            name (str): The name of the calls, used in logs and metrics.
+            requests_per_minute (float): The initial request limit, 0 until learned.
+            tokens_per_minute (float): The initial token limit, 0 until learned.
+            max_concurrency (int): The maximum number of calls at once, 0 for no limit.
+            failure_threshold (int): Consecutive outage errors that open the circuit,
+                0 disables the circuit breaker.
+            cooldown (float): Seconds the circuit stays open.
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._condition = Condition()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._active = 0
+        self._paused_until = 0.0
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    def retry_in(self) -> float:
+        """
+        Get the seconds until the limiter lets calls through after a pause or an outage.
+
+        Returns:
+            float: The seconds to wait, 0 if calls are let through now.
+        """
+        with self._condition:
+            until = self._paused_until
+            if self.failure_threshold and self._failures >= self.failure_threshold:
+                until = max(until, self._open_until)
+            return max(0.0, until - time.monotonic())
+
+    def _admit(self, now: float) -> bool:
+        if not self.failure_threshold or self._failures < self.failure_threshold:
+            return False
+        if now < self._open_until or self._probing:
+            raise CircuitOpenException(self.name, max(0.0, self._open_until - now))
+        logging.info("Probing the OpenAI %s API after an outage", self.name)
+        self._probing = True
+        return True
+
+    def acquire(self, tokens: float = 0) -> bool:
+        """
+        Waits until a call is allowed and reserves its request, tokens and concurrency slot.
+
+        Args:
+            tokens (float): The tokens the call is expected to use.
+
+        Returns:
+            bool: True if the call probes the API while the circuit is half-open.
+
+        Raises:
+            CircuitOpenException: If the circuit breaker is open.
+        """
+        started = time.monotonic()
+        probe = False
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                probe = probe or self._admit(now)
+                wait = max(
+                    self._paused_until - now,
+                    self._requests.wait_time(1, now),
+                    self._tokens.wait_time(tokens, now),
+                )
+                if wait <= 0 and (
+                    not self.max_concurrency or self._active < self.max_concurrency
+                ):
+                    break
+                self._condition.wait(wait if wait > 0 else None)
+
+            self._requests.take(1, now)
+            self._tokens.take(tokens, now)
+            self._active += 1
+        OPENAI_RATE_LIMIT_WAIT.observe(time.monotonic() - started, operation=self.name)
+        return probe
+
+    def release(self, error: Optional[BaseException] = None, probe: bool = False):
+        """
+        Frees the concurrency slot of a call and records its outcome.
+
+        Args:
+            error (BaseException, optional): The error raised by the call, if any.
+            probe (bool): Whether the call was the probe of a half-open circuit.
+        """
+        with self._condition:
+            self._active -= 1
+            if probe:
+                self._probing = False
+            if isinstance(error, OUTAGE_ERRORS):
+                self._failures += 1
+                if self.failure_threshold and self._failures >= self.failure_threshold:
+                    self._open_until = time.monotonic() + self.cooldown
+                    OPENAI_CIRCUIT_OPEN.set(1, operation=self.name)
+                    logging.warning(
+                        "OpenAI %s circuit opened for %ss after %s consecutive errors",
+                        self.name,
+                        self.cooldown,
+                        self._failures,
+                    )
+            elif error is None:
+                if self.failure_threshold and self._failures >= self.failure_threshold:
+                    logging.info("OpenAI %s circuit closed", self.name)
+                self._failures = 0
+                OPENAI_CIRCUIT_OPEN.set(0, operation=self.name)
+            self._condition.notify_all()
+
+    @contextmanager
+    def limit(self, tokens: float = 0):
+        """
+        Runs the managed call within the limits, recording whether it failed.
+
+        Args:
+            tokens (float): The tokens the call is expected to use.
+
+        Raises:
+            CircuitOpenException: If the circuit breaker is open.
+        """
+        probe = self.acquire(tokens)
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(error, probe)
+
+    def update(self, headers: Mapping[str, str], status_code: int = 200):
+        """
+        Adjusts the limiter to the rate limit headers of an API response.
+
+        Args:
+            headers (Mapping[str, str]): The response headers.
+            status_code (int): The response status code.
+        """
+        now = time.monotonic()
+        pauses = []
+        with self._condition:
+            for kind, bucket in (
+                ("requests", self._requests),
+                ("tokens", self._tokens),
+            ):
+                remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+                bucket.update(
+                    _header_number(headers, f"x-ratelimit-limit-{kind}"),
+                    remaining,
+                    now,
+                )
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining is not None and remaining < 1 and reset:
+                    pauses.append(reset)
+
+            if status_code == 429:
+                retry_after = get_retry_after(headers)
+                pauses.append(retry_after if retry_after is not None else 1.0)
+            if pauses:
+                pause = max(pauses)
+                self._paused_until = max(self._paused_until, now + pause)
+                logging.warning(
+                    "OpenAI %s rate limit reached, pausing calls for %.1fs",
+                    self.name,
+                    pause,
+                )
+            self._condition.notify_all()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """
+    Gets the rate limiter of a kind of call, shared by all threads of the process.
+
+    The limiter is created on first use from the OPENAI_<NAME>_RPM,
+    OPENAI_<NAME>_TPM, OPENAI_MAX_CONCURRENT_REQUESTS, OPENAI_CIRCUIT_FAILURES
+    and OPENAI_CIRCUIT_COOLDOWN environment variables.
+
+    Args:
+        name (str): CHAT_LIMITER or TTS_LIMITER.
+
+    Returns:
+        RateLimiter: The shared rate limiter.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            prefix = f"OPENAI_{name.upper()}"
+            _limiters[name] = RateLimiter(
+                name,
+                requests_per_minute=float(os.getenv(f"{prefix}_RPM", "0")),
+                tokens_per_minute=float(os.getenv(f"{prefix}_TPM", "0")),
+                max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS", "10")),
+                failure_threshold=int(os.getenv("OPENAI_CIRCUIT_FAILURES", "5")),
+                cooldown=float(os.getenv("OPENAI_CIRCUIT_COOLDOWN", "60")),
+            )
+        return _limiters[name]
+
+
+def update_rate_limits(response: httpx.Response):
+    """
+    Passes the rate limit headers of an API response to the rate limiter of its call.
+
+    Installed as a response hook of the shared HTTP client, so that the limits
+    are also learned from the retries made by the OpenAI client itself.
+
+    Args:
+        response (httpx.Response): The API response, before its body is read.
+    """
+    path = response.request.url.path
+    for suffix, name in LIMITED_PATHS.items():
+        if path.endswith(suffix):
+            get_rate_limiter(name).update(response.headers, response.status_code)
+            return
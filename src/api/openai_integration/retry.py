@@ -0,0 +1,193 @@
+"""
+This module contains the retry policy of the OpenAI operations and the
+scheduler of their delayed retries.
+
+The delay before a retry grows exponentially with the attempt, and is never
+shorter than the Retry-After header of a rate limit error or the time until
+the rate limiter lets calls through again.
+
+Pipeline stages do not sleep between attempts. A failed attempt raises
+RetryLaterException with its delay, and the pipeline reschedules the stage
+with RetryScheduler, which frees the worker thread for the other missions of
+the refill meanwhile.
+"""
+import time
+import logging
+from concurrent.futures import CancelledError, Executor, Future
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Thread
+from typing import Any, Callable, Optional
+from api.monitoring import OPENAI_FAILURES, OPENAI_RETRIES
+from .rate_limit import CircuitOpenException, RateLimiter, get_retry_after
+
+# Attempts made of an OpenAI operation before it fails
+MAX_ATTEMPTS = 3
+
+
+class RetryLaterException(Exception):
+    """
+    Exception raised by an attempt that failed and should be retried after a delay.
+
+    Attributes:
+        delay (float): Seconds to wait before the next attempt.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__(f"Retry after {delay:.1f}s")
+        self.delay = delay
+
+
+def get_retry_delay(
+    error: Exception,
+    attempt: int,
+    base_delay: float,
+    limiter: RateLimiter = None,
+) -> float:
+    """
+    Get the delay before retrying an operation that failed.
+
+    Args:
+        error (Exception): The error of the failed attempt.
+        attempt (int): The number of the failed attempt, from 0.
+        base_delay (float): The delay after the first attempt, doubled for every attempt.
+        limiter (RateLimiter, optional): The rate limiter of the operation.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    delays = [base_delay * 2**attempt]
+    response = getattr(error, "response", None)
+    if response is not None and get_retry_after(response.headers) is not None:
+        delays.append(get_retry_after(response.headers))
+    if isinstance(error, CircuitOpenException):
+        delays.append(error.retry_in)
+    if limiter is not None:
+        delays.append(limiter.retry_in())
+    return max(delays)
+
+
+def next_retry_delay(
+    error: Exception,
+    operation: str,
+    attempt: int,
+    base_delay: float,
+    limiter: RateLimiter = None,
+) -> Optional[float]:
+    """
+    Records a failed attempt and get the delay before the next one.
+
+    Args:
+        error (Exception): The error of the failed attempt.
+        operation (str): The name of the operation, used in logs and metrics.
+        attempt (int): The number of the failed attempt, from 0.
+        base_delay (float): The delay after the first attempt, doubled for every attempt.
+        limiter (RateLimiter, optional): The rate limiter of the operation.
+
+    Returns:
+        float: The delay in seconds, or None if no attempts are left.
+    """
+    if attempt + 1 >= MAX_ATTEMPTS:
+        OPENAI_FAILURES.inc(operation=operation)
+        return None
+    delay = get_retry_delay(error, attempt, base_delay, limiter)
+    logging.warning(
+        "%s encountered. Retrying after %.1f seconds.", type(error).__name__, delay
+    )
+    OPENAI_RETRIES.inc(operation=operation)
+    return delay
+
+
+class RetryScheduler:
+    """
+    Submits jobs to an executor, immediately or after a delay.
+
+    Delayed jobs wait in a heap, served by one timer thread, instead of in a
+    worker thread. The future returned for a delayed job completes with the
+    result of the job, so it can be waited for like any executor future.
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._condition = Condition()
+        self._jobs = []
+        self._sequence = count()
+        self._thread: Optional[Thread] = None
+        self._closed = False
+
+    def submit(
+        self, function: Callable[..., Any], *args, delay: float = 0, **kwargs
+    ) -> Future:
+        """
+        Schedules a job.
+
+        Args:
+            function (Callable[..., Any]): The job.
+            *args: The positional arguments of the job.
+            delay (float): Seconds to wait before the job is submitted. Defaults to 0.
+            **kwargs: The keyword arguments of the job.
+
+        Returns:
+            Future: The future of the job.
+        """
+        if delay <= 0:
+            return self._executor.submit(function, *args, **kwargs)
+
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot schedule jobs after close")
+            due = time.monotonic() + delay
+            heappush(
+                self._jobs, (due, next(self._sequence), future, function, args, kwargs)
+            )
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="retry-scheduler", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._jobs:
+                    self._condition.wait()
+                    continue
+                wait = self._jobs[0][0] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                _, _, future, function, args, kwargs = heappop(self._jobs)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    job = self._executor.submit(function, *args, **kwargs)
+                except RuntimeError as e:
+                    future.set_exception(e)
+                    continue
+                job.add_done_callback(lambda job, future=future: _chain(job, future))
+
+    def close(self):
+        """
+        Cancels the jobs still waiting for their delay and stops the timer thread.
+        """
+        with self._condition:
+            self._closed = True
+            jobs, self._jobs = self._jobs, []
+            self._condition.notify()
+        for job in jobs:
+            job[2].cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _chain(job: Future, future: Future):
+    if job.cancelled():
+        future.set_exception(CancelledError())
+    elif job.exception() is not None:
+        future.set_exception(job.exception())
+    else:
+        future.set_result(job.result())
@@ -0,0 +1,80 @@
+"""
+This module contains the local token estimates of chat messages.
+
+The estimates use the model's tokenizer when the optional tiktoken package is
+installed, and about four characters per token otherwise. They decide which
+messages fit the history budget before a request is sent; the API's usage
+report remains the source of truth for the tokens actually used.
+"""
+import math
+import importlib.util
+from functools import lru_cache
+from typing import Dict, List
+
+# Tokens added to every message and to the reply, following OpenAI's counting guide
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Characters per token when no tokenizer is installed
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    if importlib.util.find_spec("tiktoken") is None:
+        return None
+    import tiktoken  # pylint: disable=import-outside-toplevel
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens(text: str, model: str = "") -> int:
+    """
+    Estimates the number of tokens in a text.
+
+    Args:
+        text (str): The text.
+        model (str): The model whose tokenizer to use, if tiktoken is installed.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def estimate_message_tokens(message: Dict[str, str], model: str = "") -> int:
+    """
+    Estimates the number of prompt tokens a chat message takes up.
+
+    Args:
+        message (Dict[str, str]): The message, with a role and content.
+        model (str): The model whose tokenizer to use, if tiktoken is installed.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return TOKENS_PER_MESSAGE + estimate_tokens(message.get("content") or "", model)
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]], model: str = "") -> int:
+    """
+    Estimates the number of prompt tokens of a chat request.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages of the request.
+        model (str): The model whose tokenizer to use, if tiktoken is installed.
+
+    Returns:
+        int: The estimated number of prompt tokens.
+    """
+    return TOKENS_PER_REPLY + sum(
+        estimate_message_tokens(message, model) for message in messages
+    )
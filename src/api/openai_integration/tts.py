@@ -3,8 +3,21 @@ This module contains the functions that interact with the OpenAI Text-to-Speech
 """
 import os
 import logging
-from typing import Optional
+from typing import Any, Callable, Optional
+import httpx
 import openai
+from api.monitoring import STAGE_DURATION
+from .client import get_openai_client
+from .rate_limit import TTS_LIMITER, CircuitOpenException, get_rate_limiter
+
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")  # Default to 'tts-1' if not set
+
+# Size of the chunks in which streamed audio is passed on, in bytes
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+# Makes the client return before the response body is read, so the audio can
+# be consumed while the TTS model is still sending it
+STREAMED_RESPONSE_HEADERS = {"X-Stainless-Streamed-Raw-Response": "true"}
 
 
 def create_mission_audio(path: str, text: str) -> Optional[bool]:
@@ -19,12 +32,66 @@ def create_mission_audio(path: str, text: str) -> Optional[bool]:
         Optional[bool]: True if the audio file was successfully created and saved, False otherwise.
     """
     try:
-        response = openai.audio.speech.create(
-            model="tts-1", voice=os.getenv("TTS_VOICE", "nova"), input=text
-        )
-        response.stream_to_file(path)
+        with get_rate_limiter(TTS_LIMITER).limit(), STAGE_DURATION.time(stage="tts"):
+            response = get_openai_client().audio.speech.create(
+                model=TTS_MODEL,
+                voice=os.getenv("TTS_VOICE", "nova"),
+                input=text,
+                extra_headers=STREAMED_RESPONSE_HEADERS,
+            )
+            try:
+                response.stream_to_file(path, chunk_size=AUDIO_CHUNK_SIZE)
+            finally:
+                response.response.close()
+        return True
+    except (
+        CircuitOpenException,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.BadRequestError,
+        openai.AuthenticationError,
+        PermissionError,
+        openai.RateLimitError,
+        openai.APIError,
+        httpx.HTTPError,
+    ) as e:
+        logging.error("OpenAI API request failed: %s", e)
+        return False
+
+
+def stream_mission_audio(
+    write: Callable[[bytes], Any], text: str, response_format: str = "mp3"
+) -> Optional[bool]:
+    """
+    Converts the given text into speech and passes the audio bytes to a writer
+    in chunks as they arrive, without storing them on disk.
+
+    Args:
+        write (Callable[[bytes], Any]): Called with each chunk of audio bytes.
+        text (str): The text to be converted into speech.
+        response_format (str, optional): The audio format requested from the
+            TTS model, e.g. "mp3" or "pcm". Defaults to "mp3".
+
+    Returns:
+        Optional[bool]: True if all audio bytes were passed to the writer, False otherwise.
+    """
+    try:
+        with get_rate_limiter(TTS_LIMITER).limit(), STAGE_DURATION.time(stage="tts"):
+            response = get_openai_client().audio.speech.create(
+                model=TTS_MODEL,
+                voice=os.getenv("TTS_VOICE", "nova"),
+                input=text,
+                response_format=response_format,
+                extra_headers=STREAMED_RESPONSE_HEADERS,
+            )
+            try:
+                for chunk in response.iter_bytes(AUDIO_CHUNK_SIZE):
+                    write(chunk)
+            finally:
+                response.response.close()
         return True
     except (
+        CircuitOpenException,
         openai.APITimeoutError,
         openai.APIConnectionError,
         openai.BadRequestError,
@@ -32,6 +99,7 @@ def create_mission_audio(path: str, text: str) -> Optional[bool]:
         PermissionError,
         openai.RateLimitError,
         openai.APIError,
+        httpx.HTTPError,
     ) as e:
         logging.error("OpenAI API request failed: %s", e)
         return False
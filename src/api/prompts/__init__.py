@@ -1,6 +1,16 @@
 """
 This module contains the prompts for the Paw Patrol Tower API.
 """
-from .prompts import mission_prompt, translation_prompt_1, translation_prompt_2
+from .prompts import (
+    mission_prompt,
+    translation_prompt_1,
+    translation_prompt_2,
+    single_pass_prompt,
+)
 
-__all__ = ["mission_prompt", "translation_prompt_1", "translation_prompt_2"]
+__all__ = [
+    "mission_prompt",
+    "translation_prompt_1",
+    "translation_prompt_2",
+    "single_pass_prompt",
+]
@@ -21,3 +21,10 @@ An example output:
 translation_prompt_1 = """You are a world class translator with years of experience. You are extremely well versed in the world of Paw Patrol and have translated thousands of texts related to that. You will be given a text in English that you will translate into Swedish. Only respond with the Swedish text inside of a json object that looks like this: {"translation":"[The translated text in Swedish]"}"""
 
 translation_prompt_2 = """Compare the translated text with the original and validate that it is correct, complete and in Swedish. If it is not correct, complete or in Swedish, create a translation that is correct, complete and in Swedish. Now refine the text to achieve the flow of a native speaker. You will only respond with the translated text inside of a json object that looks like this: {"translation":"[The translated text in Swedish]"}"""
+
+single_pass_prompt = (
+    mission_prompt
+    + """
+You are also a world class translator with years of experience, extremely well versed in the world of Paw Patrol. After writing the mission script, translate it into Swedish, validate that the translation is correct, complete and in Swedish, and refine it to achieve the flow of a native speaker. Add only the refined Swedish text as the last field of the JSON object:
+"translation":"[The translated mission script in Swedish]\""""
+)
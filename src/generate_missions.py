@@ -0,0 +1,75 @@
+"""
+Command line entry point for generating missions in bulk through the OpenAI Batch API.
+
+Use it to fill the buffer with many missions at once, e.g. overnight before
+new towers are handed out, at batch pricing instead of the interactive calls
+made by the buffer maintenance thread. See api.controllers.batch_generation.
+
+Usage:
+    python generate_missions.py --missions 200
+    python generate_missions.py --resume /data/batches/run-20240101-220000
+"""
+import os
+import sys
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+# pylint: disable=import-outside-toplevel
+
+
+def main():
+    """
+    Parse the command line arguments and run or resume a batch generation run.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--missions", type=int, help="Number of missions to request")
+    group.add_argument("--resume", metavar="RUN_DIRECTORY", help="Resume a run")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="Seconds between polls of a batch, defaults to BATCH_POLL_INTERVAL",
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Seconds to wait for each batch at most"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Audio files created at once, defaults to MISSION_GENERATION_CONCURRENCY",
+    )
+    args = parser.parse_args()
+
+    # The environment is loaded before the modules reading it are imported
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY environment variable not set")
+        sys.exit(1)
+
+    from api.controllers import generate_missions_in_batches
+    from api.monitoring import configure_logging
+    from api.openai_integration import BatchException
+
+    log_directory = os.getenv("LOG_DIRECTORY_PATH", "/data/logs")
+    os.makedirs(log_directory, exist_ok=True)
+    configure_logging(os.path.join(log_directory, "batch_generation.log"))
+
+    try:
+        missions = generate_missions_in_batches(
+            args.missions,
+            args.resume,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+            concurrency=args.concurrency,
+        )
+    except BatchException as e:
+        logging.error("Batch generation stopped: %s", e)
+        print(f"Batch generation stopped, resume it with --resume: {e}")
+        sys.exit(1)
+    print(f"Stored {len(missions)} missions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Gunicorn configuration for the Paw Patrol Tower API.
+
+The API runs on threaded (gthread) workers, so a slow audio download only
+occupies one thread instead of a whole worker and /mission stays responsive
+while towers download audio. Audio files are handed to the server's
+file wrapper, which streams them with sendfile where the platform supports it.
+
+Every setting can be overridden with an environment variable.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# "gthread" serves each connection on a thread, "sync" is gunicorn's default
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# Every worker creates the app and starts its own mission buffer thread
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+
+# Number of concurrent connections, e.g. audio downloads, per worker
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Slow clients on flaky Wi-Fi need time to download several MB of audio
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """
+    Starts the log listener in the master process before the workers are forked,
+    so the master is the only process writing and rotating the log file.
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.monitoring import start_shared_log_listener
+
+    start_shared_log_listener(
+        os.path.join(
+            os.getenv("LOG_DIRECTORY_PATH", "/data/logs"), "mission_control.log"
+        )
+    )
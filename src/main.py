@@ -4,63 +4,66 @@ This module contains the main Flask application for the Paw Patrol Tower API.
 The API provides endpoints for retrieving missions and mission audio files.
 
 Endpoints:
-- /mission: GET request to retrieve the latest unrequested mission.
-- /mission-audio/<int:id>: GET request to retrieve the audio file for a specific mission.
+- /mission: GET request to retrieve the latest unrequested mission, with optional field selection.
+- /mission-audio/<int:id>: GET request to retrieve the audio file for a specific mission,
+  with support for range requests, ETag revalidation and audio format selection.
+- /metrics: GET request to retrieve the metrics of this worker in the Prometheus format.
 
-The module also includes a background thread for maintaining the mission buffer.
+The application is created by create_app(), e.g. "gunicorn 'main:create_app()'".
+Creating it only loads Flask and the logging setup: the database engine, the
+OpenAI client and the mission generators are imported when first used, and the
+background thread maintaining the mission buffer is started by create_app().
 
 Classes:
 - PrettyLogger: Custom logger class that formats log messages in a pretty way.
 
 Functions:
+- create_app: Creates and configures the Flask application.
+- start_background_services: Starts the mission buffer maintenance thread.
 - run_mission_buffer_maintenance: Function that runs the mission buffer maintenance thread.
 
 """
 
 import os
 import sys
-from threading import Thread
 import time
+from threading import Lock, Thread
 import logging
 import pprint
 
-# Pylint Disable for specific import order
-# pylint: disable=wrong-import-order,wrong-import-position
-from dotenv import load_dotenv
-
-load_dotenv()
-# pylint: enable=wrong-import-order,wrong-import-position
-
-from flask import Flask, jsonify, send_file
-from api.controllers import maintain_mission_buffer, get_latest_unrequested_mission
-
+from flask import (
+    Flask,
+    Response,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    request,
+    send_file,
+)
+from api.monitoring import REQUEST_DURATION, configure_logging, render_metrics
 
-# Check that the OPENAI_API_KEY environment variable is set and exit if not
-if not os.getenv("OPENAI_API_KEY"):
-    print("OPENAI_API_KEY environment variable not set")
-    sys.exit(1)
+# pylint: disable=import-outside-toplevel
 
-# Fetch the log directory path from environment variable or set default
-log_directory = os.getenv("LOG_DIRECTORY_PATH", "/data/logs")
 
-# Ensure the directory exists
-os.makedirs(log_directory, exist_ok=True)
+class PrettyArgument:
+    """
+    Log message argument that is pretty-printed when the message is built.
+    """
 
-# Log file path
-log_file_path = os.path.join(log_directory, "mission_control.log")
+    def __init__(self, value):
+        self.value = value
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filename=log_file_path,  # Logs are written to this file
-    filemode="a",  # 'a' for append, 'w' for overwrite
-)
+    def __str__(self):
+        return pprint.pformat(self.value)
 
 
 class PrettyLogger(logging.Logger):
     """
     Custom logger class that formats log messages in a pretty way.
+
+    The arguments are only pretty-printed when the record is written, by the
+    logging thread, and not at all if the record is filtered out.
     """
 
     def _log(
@@ -74,71 +77,325 @@ class PrettyLogger(logging.Logger):
         stacklevel=1,
     ):
         if args:
-            msg = msg % tuple(pprint.pformat(a) for a in args)
-        super()._log(level, msg, (), exc_info, extra, stack_info)
+            # Numbers are passed on as is, so that %d and %f placeholders still work
+            args = tuple(
+                a if isinstance(a, (int, float)) else PrettyArgument(a) for a in args
+            )
+        super()._log(level, msg, args, exc_info, extra, stack_info)
 
 
-logging.setLoggerClass(PrettyLogger)
+# Seconds to wait after a failed maintenance pass, doubled up to the maximum
+MAINTENANCE_ERROR_DELAY = 10
+MAINTENANCE_MAX_ERROR_DELAY = 60 * 15
 
 
 def run_mission_buffer_maintenance():
     """
     Function that runs the mission buffer maintenance thread.
 
-    The function is executed in a background thread and periodically maintains the mission buffer.
+    The function is executed in a background thread and refills the mission buffer
+    as soon as claims drain it to the low watermark, and at least every 15 minutes.
+    Only one process at a time maintains the buffer; the threads of the other
+    workers stand by to take over if that process exits. Errors are logged and
+    retried with a growing delay, so that one failure cannot stop generation.
     """
+    # The generators and the OpenAI client are imported here, off the startup path
+    from api.controllers import (
+        become_buffer_leader,
+        get_buffer_size,
+        maintain_mission_buffer,
+        wait_for_refill_request,
+    )
+
     logging.info("Starting mission buffer maintenance thread")
+    error_delay = MAINTENANCE_ERROR_DELAY
     while True:
-        mission_buffer = int(os.getenv("MISSION_BUFFER_SIZE", "5"))
-        maintain_mission_buffer(mission_buffer)
-        time.sleep(
-            60 * 15
-        )  # Run every 15 minutes as the max run time including retries is 12 minutes for 5 missions
+        try:
+            if become_buffer_leader():
+                maintain_mission_buffer(get_buffer_size())
+                error_delay = MAINTENANCE_ERROR_DELAY
+                # Fall back to running every 15 minutes if no refill is requested
+                wait_for_refill_request(60 * 15)
+            else:
+                wait_for_refill_request(60)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception(
+                "Mission buffer maintenance failed, retrying in %s seconds",
+                error_delay,
+            )
+            time.sleep(error_delay)
+            error_delay = min(error_delay * 2, MAINTENANCE_MAX_ERROR_DELAY)
+
+
+_background_lock = Lock()
+_buffer_thread = None
+
+
+def start_background_services():
+    """
+    Start the mission buffer maintenance thread of this process, once.
+    """
+    global _buffer_thread  # pylint: disable=global-statement
+    with _background_lock:
+        if _buffer_thread is not None:
+            return
+        _buffer_thread = Thread(target=run_mission_buffer_maintenance)
+        # This ensures that the thread will close when the main process exits
+        _buffer_thread.daemon = True
+        _buffer_thread.start()
 
 
-# Start the background thread
-buffer_thread = Thread(target=run_mission_buffer_maintenance)
-buffer_thread.daemon = (
-    True  # This ensures that the thread will close when the main process exits
-)
-buffer_thread.start()
+# Endpoints whose latency is recorded, mapped to their metric label
+TIMED_ENDPOINTS = {"get_mission": "/mission", "get_mission_audio": "/mission-audio"}
+
+
+def start_request_timer():
+    """
+    Record when the request started, for the request duration metric.
+    """
+    g.request_started = time.perf_counter()
+
+
+def observe_request_duration(response):
+    """
+    Record the duration of requests to the timed endpoints.
+    """
+    endpoint = TIMED_ENDPOINTS.get(request.endpoint)
+    if endpoint is not None and "request_started" in g:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - g.request_started, endpoint=endpoint
+        )
+    return response
+
+
+def get_metrics():
+    """
+    Endpoint for retrieving the metrics of this worker process.
 
-app = Flask(__name__)
+    Returns:
+    - The metrics in the Prometheus text exposition format.
+    """
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4")
 
 
-@app.route("/mission", methods=["GET"])
 def get_mission():
     """
     Endpoint for retrieving the latest unrequested mission.
 
+    The response body is pre-rendered by the ready queue, whose missions are
+    claimed when they are queued, so serving a queued mission does not touch
+    the database.
+
+    Query Parameters:
+    - fields: Comma-separated mission fields to return, e.g. "id,mission_title".
+    - compact: If "true", return only the mission id and title.
+
     Returns:
     - JSON response containing the latest unrequested mission.
+    - A 400 error if an unknown field is requested.
     """
-    return jsonify(get_latest_unrequested_mission())
+    from api.controllers import claim_ready_mission, parse_mission_fields
+
+    try:
+        fields = parse_mission_fields(
+            request.args.get("fields"),
+            request.args.get("compact", "").lower() in ("1", "true", "yes"),
+        )
+    except ValueError as e:
+        return f"Invalid fields: {e}", 400
+
+    ready_mission = claim_ready_mission(fields)
+    if ready_mission is None:
+        return jsonify(None)
+    return Response(ready_mission.payload, mimetype="application/json")
+
+
+# Query parameters used to request a mission audio format, mapped to parse_audio_format
+AUDIO_FORMAT_PARAMETERS = {
+    "codec": "codec",
+    "rate": "sample_rate",
+    "channels": "channels",
+    "bits": "bit_depth",
+}
+
+
+def mission_audio_etag(mission_id, file_stat, audio_format=None):
+    """
+    Build a strong ETag for a mission audio file.
+
+    Args:
+    - mission_id: The ID of the mission.
+    - file_stat: The os.stat_result of the audio file.
+    - audio_format: The AudioFormat of the file, if it is a variant.
+
+    Returns:
+    - The ETag value, which changes whenever the file is replaced.
+    """
+    variant = f"-{audio_format.key}" if audio_format else ""
+    return (
+        f"mission-{mission_id}{variant}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"
+    )
 
 
-@app.route("/mission-audio/<int:mission_id>", methods=["GET"])
 def get_mission_audio(mission_id):
     """
     Endpoint for retrieving the audio file for a specific mission.
 
+    Supports conditional requests (If-None-Match) and byte ranges (Range), so
+    clients can revalidate cached audio and resume interrupted downloads.
+
+    The audio format can be selected with the query parameters codec (wav,
+    adpcm, mp3 or opus), rate, channels and bits. Variants are converted on
+    first request and cached on disk.
+
     Args:
     - id: The ID of the mission.
 
     Returns:
     - The audio file for the specified mission if it exists, or a 404 error if not found.
+    - A 400 error if the requested audio format is not supported.
     """
+    audio_directory = os.getenv("AUDIO_DIRECTORY_PATH", "data/audio")
     audio_file = f"mission_{mission_id}.wav"
-    audio_path = os.path.join(
-        os.getenv("AUDIO_DIRECTORY_PATH", "data/audio"), audio_file
-    )
+    audio_path = os.path.join(audio_directory, audio_file)
+    mimetype = "audio/wav"
 
-    if os.path.exists(audio_path):
-        return send_file(audio_path)
-    else:
+    try:
+        file_stat = os.stat(audio_path)
+    except FileNotFoundError:
         return "Audio file not found", 404
 
+    audio_format = None
+    format_arguments = {
+        argument: request.args.get(parameter)
+        for parameter, argument in AUDIO_FORMAT_PARAMETERS.items()
+        if request.args.get(parameter)
+    }
+    if format_arguments:
+        # Only requests for a variant need the audio conversion code
+        from api.generators import (
+            ConversionException,
+            create_audio_variant,
+            parse_audio_format,
+        )
+
+        try:
+            audio_format = parse_audio_format(**format_arguments)
+        except ValueError as e:
+            return f"Invalid audio format: {e}", 400
+        try:
+            audio_path = create_audio_variant(audio_path, audio_format)
+        except ConversionException as e:
+            logging.error("Failed to create audio variant: %s", e)
+            return "Audio conversion failed", 500
+        audio_file = os.path.relpath(audio_path, audio_directory)
+        mimetype = audio_format.mimetype
+        file_stat = os.stat(audio_path)
+
+    etag = mission_audio_etag(mission_id, file_stat, audio_format)
+    audio_cache_max_age = current_app.config["AUDIO_CACHE_MAX_AGE"]
+
+    if current_app.config["AUDIO_OFFLOAD"] == "x-accel-redirect":
+        response = make_response("")
+        response.headers["X-Accel-Redirect"] = (
+            current_app.config["AUDIO_ACCEL_REDIRECT_PREFIX"] + audio_file
+        )
+        response.mimetype = mimetype
+        response.set_etag(etag)
+        response.last_modified = file_stat.st_mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = audio_cache_max_age
+        return response.make_conditional(request)
+
+    response = send_file(
+        audio_path,
+        mimetype=mimetype,
+        etag=etag,
+        max_age=audio_cache_max_age,
+        conditional=True,
+    )
+    # Advertise range support on full responses too, so clients know they can resume
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+
+def create_app(background_services: bool = True) -> Flask:
+    """
+    Create and configure the Flask application.
+
+    Loads the .env file, configures logging and registers the endpoints. The
+    database, the OpenAI client and the mission generators are only loaded
+    when they are first used, so creating the app stays fast.
+
+    Args:
+        background_services (bool): Whether to start the mission buffer
+            maintenance thread. Defaults to True.
+
+    Returns:
+        Flask: The configured application.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    # Check that the OPENAI_API_KEY environment variable is set and exit if not
+    if not os.getenv("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY environment variable not set")
+        sys.exit(1)
+
+    # Fetch the log directory path from environment variable or set default
+    log_directory = os.getenv("LOG_DIRECTORY_PATH", "/data/logs")
+
+    # Ensure the directory exists
+    os.makedirs(log_directory, exist_ok=True)
+
+    # Configure logging, records are written to the rotating log file by a background thread
+    configure_logging(os.path.join(log_directory, "mission_control.log"))
+    logging.setLoggerClass(PrettyLogger)
+
+    app = Flask(__name__)
+
+    # Let a reverse proxy serve the audio bytes instead of a Python worker.
+    # Supported values: "x-sendfile" (Apache, lighttpd) and "x-accel-redirect" (nginx)
+    audio_offload = os.getenv("AUDIO_OFFLOAD", "").lower()
+    app.config.update(
+        # How long clients may cache mission audio before revalidating it, in seconds
+        AUDIO_CACHE_MAX_AGE=int(os.getenv("AUDIO_CACHE_MAX_AGE", "86400")),
+        AUDIO_OFFLOAD=audio_offload,
+        AUDIO_ACCEL_REDIRECT_PREFIX=os.getenv(
+            "AUDIO_ACCEL_REDIRECT_PREFIX", "/protected-audio/"
+        ),
+        USE_X_SENDFILE=audio_offload == "x-sendfile",
+    )
+
+    app.before_request(start_request_timer)
+    app.after_request(observe_request_duration)
+    app.add_url_rule("/metrics", view_func=get_metrics, methods=["GET"])
+    app.add_url_rule("/mission", view_func=get_mission, methods=["GET"])
+    app.add_url_rule(
+        "/mission-audio/<int:mission_id>",
+        view_func=get_mission_audio,
+        methods=["GET"],
+    )
+
+    if background_services:
+        start_background_services()
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # Support "main:app" in existing gunicorn and flask commands
+    global _app  # pylint: disable=global-statement
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
     # Start the Flask app
-    app.run(debug=True, use_reloader=False)
+    create_app().run(debug=True, use_reloader=False)